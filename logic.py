@@ -34,7 +34,9 @@ And a few other functions:
 
 import heapq
 import itertools
+import multiprocessing
 import random
+import time
 from collections import defaultdict, Counter
 
 import networkx as nx
@@ -42,7 +44,8 @@ import networkx as nx
 from agents import Agent, Glitter, Bump, Stench, Breeze, Scream
 from csp import parse_neighbors, UniversalDict
 from search import astar_search, PlanRoute
-from utils import remove_all, unique, first, probability, isnumber, issequence, Expr, expr, subexpressions, extend
+from utils import (remove_all, unique, first, probability, isnumber, issequence, Expr, expr,
+                   subexpressions, extend, name, print_table)
 
 
 class KB:
@@ -206,12 +209,17 @@ def tt_entails(kb, alpha):
     Does kb entail the sentence alpha? Use truth tables. For propositional
     kb's and sentences. Note that the 'kb' should be an Expr which is a
     conjunction of clauses.
+    Rather than enumerating the models one by one as tt_check_all does,
+    kb and alpha are compiled by pl_compile and evaluated on a whole batch
+    of models at once, one model per bit.
     >>> tt_entails(expr('P & Q'), expr('Q'))
     True
     """
     assert not variables(alpha)
     symbols = list(prop_symbols(kb & alpha))
-    return tt_check_all(kb, alpha, symbols, {})
+    kb_models, alpha_models = pl_compile(kb, symbols), pl_compile(alpha, symbols)
+    return not any(kb_models(values, ones) & ~alpha_models(values, ones)
+                   for values, ones in model_batches(len(symbols)))
 
 
 def tt_check_all(kb, alpha, symbols, model):
@@ -324,6 +332,74 @@ def pl_true(exp, model={}):
         raise ValueError('Illegal operator in logic expression' + str(exp))
 
 
+def pl_compile(exp, symbols):
+    """Compile the propositional sentence exp into a bit-parallel evaluator.
+    The evaluator takes a list values with, for each of the symbols, an integer
+    whose i-th bit is the value of the symbol in the i-th model, and an integer
+    ones with one bit set per model; it returns the integer whose i-th bit
+    is the value of exp in the i-th model.
+    >>> f = pl_compile(expr('P ==> Q'), [P, Q])
+    >>> bin(f([0b1100, 0b1010], 0b1111))
+    '0b1011'
+    """
+    if exp is True:
+        return lambda values, ones: ones
+    if exp is False:
+        return lambda values, ones: 0
+    op, args = exp.op, exp.args
+    if is_prop_symbol(op):
+        i = symbols.index(exp)
+        return lambda values, ones: values[i]
+    fs = [pl_compile(arg, symbols) for arg in args]
+    if op == '~':
+        f = fs[0]
+        return lambda values, ones: ones ^ f(values, ones)
+    elif op == '&':
+        def conjunction(values, ones):
+            result = ones
+            for f in fs:
+                result &= f(values, ones)
+            return result
+
+        return conjunction
+    elif op == '|':
+        def disjunction(values, ones):
+            result = 0
+            for f in fs:
+                result |= f(values, ones)
+            return result
+
+        return disjunction
+    p, q = fs
+    if op == '==>':
+        return lambda values, ones: (ones ^ p(values, ones)) | q(values, ones)
+    elif op == '<==':
+        return lambda values, ones: p(values, ones) | (ones ^ q(values, ones))
+    elif op == '<=>':
+        return lambda values, ones: ones ^ p(values, ones) ^ q(values, ones)
+    elif op == '^':  # xor or 'not equivalent'
+        return lambda values, ones: p(values, ones) ^ q(values, ones)
+    else:
+        raise ValueError('Illegal operator in logic expression' + str(exp))
+
+
+def model_batches(n, batch_bits=16):
+    """Enumerate all the 2**n models of n symbols in batches of up to 2**batch_bits
+    models, in the bit-parallel form taken by the evaluators of pl_compile: yield
+    pairs (values, ones). Within a batch the first batch_bits symbols take all
+    their combinations of values, while the other symbols are constant."""
+    k = min(n, batch_bits)
+    width = 2 ** k
+    ones = (1 << width) - 1
+    patterns = []
+    for j in range(k):
+        block = 2 ** j
+        # the first 2 * block models, with symbol j true in the second half, repeated
+        patterns.append((((1 << block) - 1) << block) * (ones // ((1 << (2 * block)) - 1)))
+    for batch in range(2 ** (n - k)):
+        yield patterns + [ones if (batch >> j) & 1 else 0 for j in range(n - k)], ones
+
+
 # ______________________________________________________________________________
 
 # Convert to Conjunctive Normal Form (CNF)
@@ -485,25 +561,52 @@ def pl_resolution(kb, alpha):
     """
     [Figure 7.12]
     Propositional-logic resolution: say if alpha follows from KB.
+    Rather than resolving all pairs of clauses in rounds, this is a given-clause
+    loop: the shortest clause not yet processed is selected, dropped if a processed
+    clause subsumes it, and otherwise resolved with the processed clauses that
+    contain a complementary literal, found through an index by literal; the
+    processed clauses it subsumes are removed, and tautologies are never kept.
     >>> pl_resolution(horn_clauses_KB, A)
     True
     """
-    clauses = kb.clauses + conjuncts(to_cnf(~alpha))
-    new = set()
-    while True:
-        n = len(clauses)
-        pairs = [(clauses[i], clauses[j])
-                 for i in range(n) for j in range(i + 1, n)]
-        for (ci, cj) in pairs:
-            resolvents = pl_resolve(ci, cj)
-            if False in resolvents:
-                return True
-            new = new.union(set(resolvents))
-        if new.issubset(set(clauses)):
-            return False
-        for c in new:
-            if c not in clauses:
-                clauses.append(c)
+    processed = set()
+    index = defaultdict(set)  # literal: processed clauses containing it
+    unprocessed = []
+    seen = set()
+    counter = itertools.count()
+
+    def complement(literal):
+        return literal.args[0] if literal.op == '~' else ~literal
+
+    def add_unprocessed(clause):
+        if clause not in seen and not any(complement(l) in clause for l in clause):
+            seen.add(clause)
+            heapq.heappush(unprocessed, (len(clause), next(counter), clause))
+
+    for c in kb.clauses + conjuncts(to_cnf(~alpha)):
+        if c is not True:
+            add_unprocessed(frozenset() if c is False else frozenset(disjuncts(c)))
+    while unprocessed:
+        _, _, given = heapq.heappop(unprocessed)
+        if not given:
+            return True
+        if any(c <= given for l in given for c in index[l]):
+            continue  # forward subsumption
+        smallest = min((index[l] for l in given), key=len)
+        for c in [c for c in smallest if given <= c]:  # backward subsumption
+            processed.remove(c)
+            for l in c:
+                index[l].discard(c)
+        processed.add(given)
+        for l in given:
+            index[l].add(given)
+        for l in given:
+            for partner in list(index[complement(l)]):
+                resolvent = (given - {l}) | (partner - {complement(l)})
+                if not resolvent:
+                    return True
+                add_unprocessed(resolvent)
+    return False
 
 
 def pl_resolve(ci, cj):
@@ -1076,6 +1179,253 @@ class TwoWLClauseDatabase:
                         next(l for l in disjuncts(clause) if pl_true(l, model) is False)]
 
 
+# ______________________________________________________________________________
+# Incremental CDCL with assumptions
+
+
+class SATSolver:
+    """
+    An incremental CDCL solver, with the same 1UIP learning, two watched
+    literals, VSIDS branching and restart strategies as cdcl_satisfiable,
+    but over integer literals. Clauses can be added between calls to solve,
+    and each call may assume the truth of some literals, so a sequence of
+    closely related problems keeps all the clauses learned so far: learned
+    clauses only depend on the clauses, never on the assumptions.
+    >>> solver = SATSolver([A | B, ~A | C])
+    >>> solver.solve(assumptions=[~B])[C]
+    True
+    >>> solver.solve(assumptions=[~B, ~C])
+    False
+    """
+
+    selectors = itertools.count()
+
+    def __init__(self, clauses=None, vsids_decay=0.95, restart_strategy=no_restart):
+        self.vsids_decay = vsids_decay
+        self.restart_strategy = restart_strategy
+        self.ids = {}  # symbol: variable, a positive integer
+        self.symbols = [None]  # variable: symbol
+        self.clauses = []
+        self.learned = []
+        self.watches = defaultdict(list)  # literal: clauses to visit when it becomes false
+        self.value = {}  # variable: bool
+        self.true = {}  # literal: bool, for the literals of the assigned variables
+        self.level = {}
+        self.reason = {}
+        self.trail = []
+        self.trail_lim = []  # index in trail of the first assignment of each decision level
+        self.qhead = 0
+        self.activity = Counter()
+        self.bump = 1.0
+        self.heap = []
+        self.phase = {}
+        self.ok = True  # False once the clauses alone are unsatisfiable
+        self.retired = 0  # clauses of the selectors disabled since the last simplify
+        for clause in clauses or []:
+            self.add(clause)
+
+    def literal(self, l):
+        """Return the integer literal of the Expr literal l, creating its variable if needed."""
+        symbol, positive = inspect_literal(l)
+        if symbol not in self.ids:
+            self.ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+            heapq.heappush(self.heap, (0, self.ids[symbol]))
+        return self.ids[symbol] if positive else -self.ids[symbol]
+
+    def lit_value(self, lit):
+        return self.true.get(lit)
+
+    def add(self, sentence):
+        """Add the clauses of the CNF of a propositional sentence."""
+        for clause in conjuncts(to_cnf(sentence)):
+            self.add_clause(clause)
+
+    def add_clause(self, clause):
+        """Add a clause, given as a disjunction of literals."""
+        self.backtrack(0)
+        lits = set()
+        for l in disjuncts(clause):
+            lit = self.literal(l)
+            if -lit in lits or self.lit_value(lit) is True:
+                return  # a tautology or a clause already satisfied forever
+            if self.lit_value(lit) is None:
+                lits.add(lit)
+        lits = list(lits)
+        if not lits:
+            self.ok = False
+        elif len(lits) == 1:
+            self.enqueue(lits[0], None)
+        else:
+            self.clauses.append(lits)
+            self.watches[lits[0]].append(lits)
+            self.watches[lits[1]].append(lits)
+
+    def enqueue(self, lit, reason):
+        var = abs(lit)
+        self.value[var] = lit > 0
+        self.true[lit] = True
+        self.true[-lit] = False
+        self.level[var] = len(self.trail_lim)
+        self.reason[var] = reason
+        self.trail.append(lit)
+
+    def propagate(self):
+        """Unit propagation on the watched literals; return a conflict clause or None."""
+        lit_value, watches = self.true.get, self.watches
+        while self.qhead < len(self.trail):
+            false_lit = -self.trail[self.qhead]
+            self.qhead += 1
+            watching, watches[false_lit] = watches[false_lit], []
+            kept = watches[false_lit]
+            for i, c in enumerate(watching):
+                if c[0] == false_lit:
+                    c[0], c[1] = c[1], c[0]
+                if lit_value(c[0]) is True:
+                    kept.append(c)
+                    continue
+                for k in range(2, len(c)):
+                    if lit_value(c[k]) is not False:
+                        c[1], c[k] = c[k], c[1]
+                        watches[c[1]].append(c)
+                        break
+                else:
+                    kept.append(c)
+                    if lit_value(c[0]) is False:
+                        kept.extend(watching[i + 1:])
+                        return c
+                    self.enqueue(c[0], c)
+        return None
+
+    def analyze(self, conflict):
+        """Return the 1UIP clause learned from conflict, with its asserting literal
+        first, the level to backjump to, and its literal block distance."""
+        learned, seen, counter, p, i = [None], set(), 0, None, len(self.trail) - 1
+        clause = conflict
+        while True:
+            for q in (clause if p is None else clause[1:]):
+                var = abs(q)
+                if var not in seen and self.level[var] > 0:
+                    seen.add(var)
+                    self.activity[var] += self.bump
+                    heapq.heappush(self.heap, (-self.activity[var], var))
+                    if self.level[var] == len(self.trail_lim):
+                        counter += 1
+                    else:
+                        learned.append(q)
+            while abs(self.trail[i]) not in seen:
+                i -= 1
+            p = self.trail[i]
+            i -= 1
+            clause = self.reason[abs(p)]
+            counter -= 1
+            if counter == 0:
+                break
+        learned[0] = -p
+        self.bump /= self.vsids_decay
+        if len(learned) == 1:
+            return learned, 0, 1
+        k = max(range(1, len(learned)), key=lambda j: self.level[abs(learned[j])])
+        learned[1], learned[k] = learned[k], learned[1]
+        return learned, self.level[abs(learned[1])], len({self.level[abs(q)] for q in learned})
+
+    def backtrack(self, level):
+        if len(self.trail_lim) > level:
+            for lit in self.trail[self.trail_lim[level]:]:
+                var = abs(lit)
+                self.phase[var] = self.value.pop(var)
+                del self.true[lit], self.true[-lit]
+                heapq.heappush(self.heap, (-self.activity[var], var))
+            del self.trail[self.trail_lim[level]:]
+            del self.trail_lim[level:]
+            self.qhead = len(self.trail)
+
+    def decide(self):
+        """Return the unassigned variable with the highest activity, or None."""
+        while self.heap:
+            _, var = heapq.heappop(self.heap)
+            if var not in self.value:
+                return var
+        return None
+
+    def solve(self, assumptions=()):
+        """Return a model of the clauses in which all the assumed literals are
+        true, as a dict {symbol: value}, or False if there is none."""
+        if not self.ok:
+            return False
+        self.backtrack(0)
+        assumptions = [self.literal(l) for l in assumptions]
+        conflicts, restarts, queue_lbd, sum_lbd = 0, 1, [], 0
+        while True:
+            conflict = self.propagate()
+            if conflict is not None:
+                if not self.trail_lim:
+                    self.ok = False
+                    return False
+                conflicts += 1
+                learned, level, lbd = self.analyze(conflict)
+                queue_lbd.append(lbd)
+                sum_lbd += lbd
+                self.backtrack(level)
+                if len(learned) == 1:
+                    self.enqueue(learned[0], None)
+                else:
+                    self.learned.append(learned)
+                    self.watches[learned[0]].append(learned)
+                    self.watches[learned[1]].append(learned)
+                    self.enqueue(learned[0], learned)
+                if self.restart_strategy(conflicts, restarts, queue_lbd, sum_lbd):
+                    self.backtrack(0)
+                    queue_lbd.clear()
+                    restarts += 1
+            elif len(self.trail_lim) < len(assumptions):
+                lit = assumptions[len(self.trail_lim)]
+                if self.lit_value(lit) is False:
+                    return False
+                self.trail_lim.append(len(self.trail))
+                if self.lit_value(lit) is None:
+                    self.enqueue(lit, None)
+            else:
+                var = self.decide()
+                if var is None:
+                    return {self.symbols[v]: value for v, value in self.value.items()}
+                self.trail_lim.append(len(self.trail))
+                self.enqueue(var if self.phase.get(var, False) else -var, None)
+
+    def simplify(self):
+        """Remove the clauses satisfied at level 0, such as those of the disabled selectors
+        and the clauses learned from them, from the clauses, the learned clauses and the watches."""
+        self.backtrack(0)
+
+        def live(c):
+            return not any(self.true.get(lit) for lit in c)
+
+        self.clauses = [c for c in self.clauses if live(c)]
+        self.learned = [c for c in self.learned if live(c)]
+        for lit in list(self.watches):
+            self.watches[lit] = [c for c in self.watches[lit] if live(c)]
+        self.retired = 0
+
+    def entails(self, alpha):
+        """Do the clauses entail the sentence alpha? A literal alpha is refuted by assuming
+        its negation; other sentences are added under a fresh selector symbol which is
+        then assumed, and disabled for good once the question is answered. The clauses
+        of the disabled selectors are removed once they make up half of the clauses."""
+        if is_symbol(alpha.op) or (alpha.op == '~' and is_symbol(alpha.args[0].op)):
+            symbol, positive = inspect_literal(alpha)
+            return self.solve(assumptions=[~symbol if positive else symbol]) is False
+        selector = Expr('Query_{}'.format(next(self.selectors)))
+        clauses = conjuncts(to_cnf(~alpha))
+        for clause in clauses:
+            self.add_clause(~selector | clause)
+        entailed = self.solve(assumptions=[selector]) is False
+        self.add_clause(~selector)
+        self.retired += len(clauses)
+        if 2 * self.retired > len(self.clauses):
+            self.simplify()
+        return entailed
+
+
 # ______________________________________________________________________________
 # Walk-SAT [Figure 7.18]
 
@@ -1279,11 +1629,14 @@ def new_disjunction(sentences):
 class WumpusKB(PropKB):
     """
     Create a Knowledge Base that contains the a temporal "Wumpus physics" and temporal rules with time zero.
+    Its clauses are also kept in an incremental SATSolver, which answers the queries
+    of the agent while keeping what it has learned from one query to the next.
     """
 
     def __init__(self, dimrow):
         super().__init__()
         self.dimrow = dimrow
+        self.solver = SATSolver()
         self.tell(~wumpus(1, 1))
         self.tell(~pit(1, 1))
 
@@ -1450,8 +1803,18 @@ class WumpusKB(PropKB):
         # Rule about Wumpus (dead or alive)
         self.tell(equiv(wumpus_alive(time), wumpus_alive(t) & ~percept_scream(time)))
 
+    def tell(self, sentence):
+        clauses = conjuncts(to_cnf(sentence))
+        self.clauses.extend(clauses)
+        for clause in clauses:
+            self.solver.add_clause(clause)
+
     def ask_if_true(self, query):
-        return pl_resolution(self, query)
+        return self.solver.entails(query)
+
+    def retract(self, sentence):
+        super().retract(sentence)
+        self.solver = SATSolver(self.clauses)
 
 
 # ______________________________________________________________________________
@@ -1619,10 +1982,16 @@ class HybridWumpusAgent(Agent):
 # ______________________________________________________________________________
 
 
-def SAT_plan(init, transition, goal, t_max, SAT_solver=cdcl_satisfiable):
+def SAT_plan(init, transition, goal, t_max, SAT_solver=None, t_min=0, processes=None):
     """
     [Figure 7.22]
     Converts a planning problem to Satisfaction problem by translating it to a cnf sentence.
+    By default the horizons share one incremental SATSolver: each new horizon only adds
+    the clauses of its last time step, and the goal is assumed at that step rather than
+    added, so the clauses learned on shorter horizons are kept. A SAT_solver function
+    such as cdcl_satisfiable can still be given to solve each horizon from scratch.
+    Only the horizons from t_min to t_max are tried; given a number of processes, they
+    are solved concurrently in a process pool instead of one after the other.
     >>> transition = {'A': {'Left': 'A', 'Right': 'B'}, 'B': {'Left': 'A', 'Right': 'C'}, 'C': {'Left': 'B', 'Right': 'C'}}
     >>> SAT_plan('A', transition, 'C', 1) is None
     True
@@ -1642,10 +2011,8 @@ def SAT_plan(init, transition, goal, t_max, SAT_solver=cdcl_satisfiable):
         # Add initial state axiom
         clauses.append(state_sym[init, 0])
 
-        # Add goal state axiom
-        clauses.append(state_sym[first(clause[0] for clause in state_sym
-                                       if set(conjuncts(clause[0])).issuperset(conjuncts(goal))), time]) \
-            if isinstance(goal, Expr) else clauses.append(state_sym[goal, time])
+        # Add goal state axiom: one of the states satisfying the goal at the last time
+        clauses.append(associate('|', [state_sym[s, time] for s in goal_states()]))
 
         # All possible transitions
         transition_counter = itertools.count()
@@ -1692,8 +2059,81 @@ def SAT_plan(init, transition, goal, t_max, SAT_solver=cdcl_satisfiable):
         true_transitions.sort(key=lambda x: x[2])
         return [action for s, action, time in true_transitions]
 
+    def goal_states():
+        if isinstance(goal, Expr):
+            return [s for s in transition if set(conjuncts(s)).issuperset(conjuncts(goal))]
+        return [goal]
+
+    def add_time_step(solver, t):
+        # states are numbered, not to hash their sentences for every clause
+        for i in range(len(states)):
+            state_sym[i, t] = Expr('S_{}'.format(next(state_counter)))
+        if t == 0:
+            solver.add_clause(state_sym[index[init], 0])
+            reached.add(index[init])
+        else:
+            reached.update([index[s_] for i in list(reached)
+                            for s_ in transition[states[i]].values()])
+            transitions_t = []
+            for i, s in enumerate(states):
+                from_s = []
+                for action, s_ in transition[s].items():
+                    tr = Expr('T_{}'.format(next(transition_counter)))
+                    action_sym[i, action, t - 1] = tr
+                    solver.add_clause(~tr | state_sym[i, t - 1])
+                    solver.add_clause(~tr | state_sym[index[s_], t])
+                    from_s.append(tr)
+                # transitions from different states are already exclusive, as their states are
+                for k, tr in enumerate(from_s):
+                    for tr_ in from_s[k + 1:]:
+                        solver.add_clause(~tr | ~tr_)
+                transitions_t.extend(from_s)
+            solver.add_clause(associate('|', transitions_t))
+        solver.add_clause(associate('|', [state_sym[i, t] for i in range(len(states))]))
+        # states not reachable in t steps from init are false at time t
+        for i in range(len(states)):
+            if i not in reached:
+                solver.add_clause(~state_sym[i, t])
+        for i in range(len(states)):
+            for j in range(i + 1, len(states)):
+                solver.add_clause(~state_sym[i, t] | ~state_sym[j, t])
+
     # Body of SAT_plan algorithm
-    for t in range(t_max + 1):
+    if processes is not None:
+        # one horizon per task, each encoded from scratch by its worker; the plan returned
+        # is the one of the shortest satisfiable horizon, and leaving the pool terminates
+        # the workers still solving longer horizons
+        with multiprocessing.Pool(processes) as pool:
+            results = [pool.apply_async(SAT_plan, (init, transition, goal, t, SAT_solver, t))
+                       for t in range(t_min, t_max + 1)]
+            for result in results:
+                plan = result.get()
+                if plan is not None:
+                    return plan
+            return None
+
+    if SAT_solver is None:
+        state_sym = {}
+        action_sym = {}
+        state_counter = itertools.count()
+        transition_counter = itertools.count()
+        states = list(transition)
+        index = {s: i for i, s in enumerate(states)}
+        reached = set()
+        solver = SATSolver()
+        targets = [index[s] for s in goal_states() if s in index]
+        for t in range(t_max + 1):
+            add_time_step(solver, t)
+            if t >= t_min and targets:
+                # the goal holds at time t if one of the states satisfying it does
+                goal_sym = Expr('G_{}'.format(t))
+                solver.add_clause(~goal_sym | associate('|', [state_sym[i, t] for i in targets]))
+                model = solver.solve(assumptions=[goal_sym])
+                if model is not False:
+                    return extract_solution(model)
+        return None
+
+    for t in range(t_min, t_max + 1):
         # dictionaries to help extract the solution from model
         state_sym = {}
         action_sym = {}
@@ -1708,15 +2148,130 @@ def SAT_plan(init, transition, goal, t_max, SAT_solver=cdcl_satisfiable):
 # ______________________________________________________________________________
 
 
-def unify(x, y, s={}):
+def unify(x, y, s={}, occurs_check=True):
     """
     [Figure 9.1]
     Unify expressions x,y with substitution s; return a substitution that
     would make x,y equal, or None if x,y can not unify. x and y can be
     variables (e.g. Expr('x')), constants, lists, or Exprs.
+    The work is done on a single triangular Bindings object, which is
+    only resolved into a substitution in normal form at the end; the
+    occurs check can be skipped when the caller knows that no variable
+    can be bound to a term containing it.
     >>> unify(x, 3, {})
     {x: 3}
     """
+    if s is None:
+        return None
+    bindings = Bindings(s, occurs_check)
+    if not bindings.unify(x, y):
+        return None
+    return bindings.as_dict() if bindings.trail else s
+
+
+class Bindings:
+    """A triangular substitution: var: term bindings where a term may mention
+    other bound variables. Binding a variable costs O(1), and the bindings
+    are only applied to a term when it is resolved. The trail records the
+    order of the bindings, so that the ones made after a mark can be undone
+    when backtracking.
+    >>> b = Bindings()
+    >>> b.unify(expr('P(x, y)'), expr('P(y, A)'))
+    True
+    >>> b.resolve(x)
+    A
+    """
+
+    def __init__(self, s=None, occurs_check=True):
+        self.s = dict(s) if s else {}
+        self.trail = []
+        self.occurs_check = occurs_check
+
+    def walk(self, x):
+        """Follow the bindings of x until an unbound variable or a non-variable term."""
+        while is_variable(x) and x in self.s:
+            x = self.s[x]
+        return x
+
+    def bind(self, var, x):
+        self.s[var] = x
+        self.trail.append(var)
+
+    def mark(self):
+        return len(self.trail)
+
+    def undo(self, mark):
+        """Remove all the bindings made since mark."""
+        while len(self.trail) > mark:
+            del self.s[self.trail.pop()]
+
+    def occurs(self, var, x):
+        """Return true if variable var occurs anywhere in the resolved x."""
+        x = self.walk(x)
+        if var == x:
+            return True
+        elif isinstance(x, Expr):
+            return any(self.occurs(var, arg) for arg in x.args)
+        elif isinstance(x, (list, tuple)):
+            return any(self.occurs(var, e) for e in x)
+        else:
+            return False
+
+    def unify(self, x, y):
+        """Extend the bindings so that x and y are equal and return True,
+        or leave them unchanged and return False if x and y can not unify."""
+        mark = self.mark()
+        pairs = [(x, y)]
+        while pairs:
+            x, y = pairs.pop()
+            x, y = self.walk(x), self.walk(y)
+            if x is y or x == y:
+                continue
+            elif is_variable(x) or is_variable(y):
+                var, val = (x, y) if is_variable(x) else (y, x)
+                if self.occurs_check and self.occurs(var, val):
+                    break
+                self.bind(var, val)
+            elif isinstance(x, Expr) and isinstance(y, Expr):
+                if x.op != y.op or len(x.args) != len(y.args):
+                    break
+                pairs.extend(reversed(list(zip(x.args, y.args))))
+            elif isinstance(x, str) or isinstance(y, str):
+                break
+            elif issequence(x) and issequence(y) and len(x) == len(y):
+                pairs.extend(reversed(list(zip(x, y))))
+            else:
+                break
+        else:
+            return True
+        self.undo(mark)
+        return False
+
+    def resolve(self, x):
+        """Apply the bindings to x."""
+        x = self.walk(x)
+        if isinstance(x, Expr) and x.args:
+            return Expr(x.op, *[self.resolve(arg) for arg in x.args])
+        elif isinstance(x, list):
+            return [self.resolve(xi) for xi in x]
+        elif isinstance(x, tuple):
+            return tuple([self.resolve(xi) for xi in x])
+        else:
+            return x
+
+    def as_dict(self):
+        """Return the bindings as a substitution in normal form."""
+        return {var: self.resolve(val) for var, val in self.s.items()}
+
+
+def unify_naive(x, y, s={}):
+    """
+    [Figure 9.1]
+    The textbook unification algorithm, which copies the substitution at every
+    binding; kept as a baseline for compare_unifiers.
+    >>> unify_naive(x, 3, {})
+    {x: 3}
+    """
     if s is None:
         return None
     elif x == y:
@@ -1726,13 +2281,13 @@ def unify(x, y, s={}):
     elif is_variable(y):
         return unify_var(y, x, s)
     elif isinstance(x, Expr) and isinstance(y, Expr):
-        return unify(x.args, y.args, unify(x.op, y.op, s))
+        return unify_naive(x.args, y.args, unify_naive(x.op, y.op, s))
     elif isinstance(x, str) or isinstance(y, str):
         return None
     elif issequence(x) and issequence(y) and len(x) == len(y):
         if not x:
             return s
-        return unify(x[1:], y[1:], unify(x[0], y[0], s))
+        return unify_naive(x[1:], y[1:], unify_naive(x[0], y[0], s))
     else:
         return None
 
@@ -1744,9 +2299,9 @@ def is_variable(x):
 
 def unify_var(var, x, s):
     if var in s:
-        return unify(s[var], x, s)
+        return unify_naive(s[var], x, s)
     elif x in s:
-        return unify(var, s[x], s)
+        return unify_naive(var, s[x], s)
     elif occur_check(var, x, s):
         return None
     else:
@@ -1773,10 +2328,13 @@ def occur_check(var, x, s):
 
 def subst(s, x):
     """Substitute the substitution s into the expression x.
+    s may also be a Bindings object, whose bindings are then resolved.
     >>> subst({x: 42, y:0}, F(x) + y)
     (F(42) + 0)
     """
-    if isinstance(x, list):
+    if isinstance(s, Bindings):
+        return s.resolve(x)
+    elif isinstance(x, list):
         return [subst(s, xi) for xi in x]
     elif isinstance(x, tuple):
         return tuple([subst(s, xi) for xi in x])
@@ -1881,6 +2439,32 @@ def vars_elimination(x, s):
     return Expr(x.op, *[vars_elimination(arg, s) for arg in x.args])
 
 
+def unification_chain(n):
+    """Return a pair of expressions P(x0, ..., xn-1) and P(F(x1), ..., F(xn-1), A)
+    whose unifier binds every variable to a term of growing depth."""
+    xs = [Expr('x{}'.format(i)) for i in range(n)]
+    return Expr('P', *xs), Expr('P', *([Expr('F', xi) for xi in xs[1:]] + [Expr('A')]))
+
+
+def compare_unifiers(problems=None, unifiers=None, repeat=20):
+    """Print the time in ms that each unifier takes to solve each of the
+    unification problems, given as pairs of expressions, repeat times."""
+    if problems is None:
+        problems = [unification_chain(n) for n in (5, 20, 50)]
+    if unifiers is None:
+        unifiers = [unify_naive, unify_mm, unify]
+
+    def do(unifier, problem):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            unifier(*problem, {})
+        return 1000 * (time.perf_counter() - start)
+
+    table = [[name(u)] + [do(u, p) for p in problems] for u in unifiers]
+    print_table(table, header=['Unifier'] + ['{} args'.format(len(p[0].args)) for p in problems],
+                numfmt='{:.2f}')
+
+
 def standardize_variables(sentence, dic=None):
     """Replace all the variables in sentence with new variables."""
     if dic is None:
@@ -1929,9 +2513,11 @@ class FolKB(KB):
     False
     """
 
-    def __init__(self, clauses=None):
+    def __init__(self, clauses=None, tabled=False):
         super().__init__()
         self.clauses = []  # inefficient: no indexing
+        self.tabled = tabled
+        self.table = AnswerTable()
         if clauses:
             for clause in clauses:
                 self.tell(clause)
@@ -1939,32 +2525,92 @@ class FolKB(KB):
     def tell(self, sentence):
         if is_definite_clause(sentence):
             self.clauses.append(sentence)
+            self.table.clear()
         else:
             raise Exception('Not a definite clause: {}'.format(sentence))
 
     def ask_generator(self, query):
+        if self.tabled:
+            return fol_bc_tabled_ask(self, query)
         return fol_bc_ask(self, query)
 
     def retract(self, sentence):
         self.clauses.remove(sentence)
+        self.table.clear()
 
     def fetch_rules_for_goal(self, goal):
         return self.clauses
 
 
+class FactIndex:
+    """The atomic facts of a forward-chaining run, indexed by predicate and by
+    (predicate, argument position, ground argument), so that a premise whose
+    arguments are partly bound can be joined against a single hash bucket.
+    Each fact is stamped with the round in which it was derived."""
+
+    def __init__(self):
+        self.stamps = {}
+        self.by_pred = defaultdict(list)
+        self.by_arg = defaultdict(list)
+        self.general = defaultdict(list)  # facts with variables, not in by_arg
+
+    def __contains__(self, fact):
+        return fact in self.stamps
+
+    def add(self, fact, stamp):
+        self.stamps[fact] = stamp
+        self.by_pred[fact.op].append(fact)
+        if variables(fact):
+            self.general[fact.op].append(fact)
+        else:
+            for i, arg in enumerate(fact.args):
+                self.by_arg[fact.op, i, arg].append(fact)
+
+    def candidates(self, pattern):
+        """Return the facts that may unify with pattern: the smallest bucket
+        among its ground arguments, plus the facts that contain variables."""
+        bucket = self.by_pred.get(pattern.op, [])
+        for i, arg in enumerate(pattern.args):
+            if not variables(arg):
+                arg_bucket = self.by_arg.get((pattern.op, i, arg), [])
+                if len(arg_bucket) < len(bucket):
+                    bucket = arg_bucket + self.general.get(pattern.op, [])
+        return bucket
+
+
 def fol_fc_ask(kb, alpha):
     """
     [Figure 9.3]
-    A simple forward-chaining algorithm.
-    """
-    # TODO: improve efficiency
-    kb_consts = list({c for clause in kb.clauses for c in constant_symbols(clause)})
-
-    def enum_subst(p):
-        query_vars = list({v for clause in p for v in variables(clause)})
-        for assignment_list in itertools.product(kb_consts, repeat=len(query_vars)):
-            theta = {x: y for x, y in zip(query_vars, assignment_list)}
+    A semi-naive forward-chaining algorithm. Rules are indexed by the
+    predicates of their premises, and in each round a rule is only fired
+    through a premise that matches a fact derived in the previous round
+    (the delta); premises before it are matched against older facts, and
+    premises after it against all the known ones, so no inference is repeated.
+    Premises are joined with the FactIndex on the variables bound so far.
+    """
+    facts = FactIndex()
+    triggers = defaultdict(list)
+    for clause in kb.clauses:
+        p, q = parse_definite_clause(clause)
+        if p:
+            p, q = parse_definite_clause(standardize_variables(clause))
+            for i, premise in enumerate(p):
+                triggers[premise.op].append((p, q, i))
+        elif clause not in facts:
+            facts.add(clause, 0)
+
+    def join(premises, delta_pos, last, theta, j=0):
+        if j == len(premises):
             yield theta
+            return
+        pattern = subst(theta, premises[j])
+        for fact in facts.candidates(pattern):
+            stamp = facts.stamps[fact]
+            if ((j < delta_pos and stamp < last) or (j == delta_pos and stamp == last) or
+                    (j > delta_pos and stamp <= last)):
+                theta1 = unify(pattern, fact, theta)
+                if theta1 is not None:
+                    yield from join(premises, delta_pos, last, theta1, j + 1)
 
     # check if we can answer without new inferences
     for q in kb.clauses:
@@ -1972,22 +2618,22 @@ def fol_fc_ask(kb, alpha):
         if phi is not None:
             yield phi
 
-    while True:
+    last, delta = 0, list(facts.stamps)
+    while delta:
         new = []
-        for rule in kb.clauses:
-            p, q = parse_definite_clause(rule)
-            for theta in enum_subst(p):
-                if set(subst(theta, p)).issubset(set(kb.clauses)):
+        for op in {fact.op for fact in delta}:
+            for p, q, i in triggers[op]:
+                for theta in join(p, i, last, {}):
                     q_ = subst(theta, q)
-                    if all([unify_mm(x, q_) is None for x in kb.clauses + new]):
+                    if q_ not in facts:
+                        facts.add(q_, last + 1)
                         new.append(q_)
                         phi = unify_mm(q_, alpha)
                         if phi is not None:
                             yield phi
-        if not new:
-            break
         for clause in new:
             kb.tell(clause)
+        last, delta = last + 1, new
     return None
 
 
@@ -1996,29 +2642,194 @@ def fol_bc_ask(kb, query):
     [Figure 9.6]
     A simple backward-chaining algorithm for first-order logic.
     KB should be an instance of FolKB, and query an atomic sentence.
+    A single Bindings object is threaded through the search: unification
+    binds variables in place, backtracking undoes the bindings on the
+    trail, and the substitution is only resolved when an answer is found.
     """
-    return fol_bc_or(kb, query, {})
+    bindings = Bindings()
+    for _ in fol_bc_or(kb, query, bindings):
+        yield bindings.as_dict()
 
 
-def fol_bc_or(kb, goal, theta):
+def fol_bc_or(kb, goal, bindings):
     for rule in kb.fetch_rules_for_goal(goal):
         lhs, rhs = parse_definite_clause(standardize_variables(rule))
-        for theta1 in fol_bc_and(kb, lhs, unify_mm(rhs, goal, theta)):
-            yield theta1
+        mark = bindings.mark()
+        if bindings.unify(rhs, goal):
+            yield from fol_bc_and(kb, lhs, bindings)
+            bindings.undo(mark)
+
+
+def fol_bc_and(kb, goals, bindings):
+    if not goals:
+        yield bindings
+    else:
+        first, rest = goals[0], goals[1:]
+        for _ in fol_bc_or(kb, bindings.resolve(first), bindings):
+            yield from fol_bc_and(kb, rest, bindings)
+
+
+def fol_bc_naive_ask(kb, query, unifier=unify_naive):
+    """The textbook fol_bc_ask, which threads substitution dicts and builds a
+    new one at every unification; kept as a baseline for compare_backward_chaining."""
 
+    def bc_or(goal, theta):
+        for rule in kb.fetch_rules_for_goal(goal):
+            lhs, rhs = parse_definite_clause(standardize_variables(rule))
+            yield from bc_and(lhs, unifier(rhs, goal, theta))
 
-def fol_bc_and(kb, goals, theta):
+    def bc_and(goals, theta):
+        if theta is None:
+            pass
+        elif not goals:
+            yield theta
+        else:
+            for theta1 in bc_or(subst(theta, goals[0]), theta):
+                yield from bc_and(goals[1:], theta1)
+
+    return bc_or(query, {})
+
+
+def ancestor_kb(n):
+    """Return a FolKB with a chain of n parents and the rules of Ancestor, whose
+    substitutions grow with the depth of the proofs."""
+    rules = ['Parent(x, y) ==> Ancestor(x, y)',
+             '(Parent(x, y) & Ancestor(y, z)) ==> Ancestor(x, z)']
+    return FolKB(map(expr, rules + ['Parent(P{}, P{})'.format(i, i + 1) for i in range(n)]))
+
+
+def compare_backward_chaining(queries=None, askers=None, repeat=5):
+    """Print the time in ms that each backward chainer takes to find all the
+    answers to each of the queries, given as (name, kb, query), repeat times."""
+    if queries is None:
+        queries = [('crime', crime_kb, expr('Criminal(x)')),
+                   ('rabbits', test_kb, expr('Rabbit(x)'))]
+        queries += [('ancestors {}'.format(n), ancestor_kb(n), expr('Ancestor(P0, x)'))
+                    for n in (10, 30)]
+    if askers is None:
+        askers = [('fol_bc_naive_ask(unify_naive)', fol_bc_naive_ask),
+                  ('fol_bc_naive_ask(unify)', lambda kb, q: fol_bc_naive_ask(kb, q, unify)),
+                  ('fol_bc_ask', fol_bc_ask)]
+
+    def do(ask, kb, query):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for _ in ask(kb, query):
+                pass
+        return 1000 * (time.perf_counter() - start)
+
+    table = [[name] + [do(ask, kb, query) for _, kb, query in queries] for name, ask in askers]
+    print_table(table, header=['Backward chainer'] + [q[0] for q in queries], numfmt='{:.2f}')
+
+
+class AnswerTable:
+    """The answer tables of tabled backward chaining, kept by a FolKB across
+    queries. Goals are keyed by variant, i.e. up to a renaming of their
+    variables, and a table is complete once all its answers have been found."""
+
+    def __init__(self):
+        self.answers = {}
+        self.complete = set()
+        self.evaluated = []  # incomplete goals, in the order they were evaluated
+        self.n_answers = 0
+        self.incomplete_reads = 0
+
+    def clear(self):
+        self.__init__()
+
+
+def variant_key(goal):
+    """Rename the variables of goal in order of first occurrence, so that
+    goals which only differ in the names of their variables share a key.
+    >>> variant_key(expr('P(y, A, x, y)')) == variant_key(expr('P(u, A, z, u)'))
+    True
+    """
+    names = {}
+    for e in subexpressions(goal):
+        if is_variable(e) and e not in names:
+            names[e] = Expr('v{}'.format(len(names)))
+    return subst(names, goal)
+
+
+def fol_bc_tabled_ask(kb, query):
+    """
+    A tabled (SLG-style) version of fol_bc_ask. The answers to every subgoal
+    are cached in kb.table by variant and reused by later calls and queries;
+    a call to a variant of a subgoal which is still being evaluated consumes
+    the answers found so far instead of recurring, and the leader of each
+    group of mutually recursive subgoals is re-evaluated until no new answers
+    appear, so left-recursive rules terminate. The tables are cleared by
+    FolKB.tell and FolKB.retract.
+    """
+    for answer in fol_bc_tabled_or(kb, query, []):
+        theta = unify(query, standardize_variables(answer), {})
+        if theta is not None:
+            yield theta
+
+
+def fol_bc_tabled_or(kb, goal, stack):
+    """Return the list of instances of goal entailed by kb, evaluating it if its table
+    is not complete. stack holds [key, low] frames of the goals being evaluated."""
+    table = kb.table
+    key = variant_key(goal)
+    if key in table.complete:
+        return table.answers[key]
+    for depth, frame in enumerate(stack):
+        if frame[0] == key:
+            # a recursive call: every goal above it depends on this incomplete table
+            for upper in stack[depth + 1:]:
+                upper[1] = min(upper[1], depth)
+            table.incomplete_reads += 1
+            return list(table.answers[key])
+    depth = len(stack)
+    frame = [key, depth]
+    stack.append(frame)
+    answers = table.answers.setdefault(key, [])
+    found = set(answers)
+    start = len(table.evaluated)
+    while True:
+        n_answers, reads = table.n_answers, table.incomplete_reads
+        for rule in kb.fetch_rules_for_goal(goal):
+            lhs, rhs = parse_definite_clause(standardize_variables(rule))
+            for theta in fol_bc_tabled_and(kb, lhs, unify(rhs, goal, {}), stack):
+                answer = variant_key(full_subst(theta, goal))
+                if answer not in found:
+                    found.add(answer)
+                    answers.append(answer)
+                    table.n_answers += 1
+        if frame[1] < depth or table.n_answers == n_answers or table.incomplete_reads == reads:
+            break
+    stack.pop()
+    table.evaluated.append(key)
+    if frame[1] == depth:
+        # this goal leads its group of recursive goals, which are now complete
+        table.complete.update(table.evaluated[start:])
+        del table.evaluated[start:]
+    return list(answers)
+
+
+def fol_bc_tabled_and(kb, goals, theta, stack):
     if theta is None:
         pass
     elif not goals:
         yield theta
     else:
         first, rest = goals[0], goals[1:]
-        for theta1 in fol_bc_or(kb, subst(theta, first), theta):
-            for theta2 in fol_bc_and(kb, rest, theta1):
+        goal = full_subst(theta, first)
+        for answer in fol_bc_tabled_or(kb, goal, stack):
+            theta1 = unify(goal, standardize_variables(answer), theta)
+            for theta2 in fol_bc_tabled_and(kb, rest, theta1, stack):
                 yield theta2
 
 
+def full_subst(s, x):
+    """Apply the substitution s to x until no bound variable is left."""
+    y = subst(s, x)
+    while y != x:
+        x, y = y, subst(s, y)
+    return y
+
+
 # A simple KB that defines the relevant conditions of the Wumpus World as in Figure 7.4.
 # See Sec. 7.4.3
 wumpus_kb = PropKB()
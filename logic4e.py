@@ -1304,13 +1304,126 @@ def SAT_plan(init, transition, goal, t_max, SAT_solver=dpll_satisfiable):
 # 9.2.1 Unification
 
 
-def unify(x, y, s={}):
+def unify(x, y, s={}, occurs_check=True):
     """Unify expressions x,y with substitution s; return a substitution that
     would make x,y equal, or None if x,y can not unify. x and y can be
     variables (e.g. Expr('x')), constants, lists, or Exprs. [Figure 9.1]
+    The work is done on a single triangular Bindings object, which is
+    only resolved into a substitution in normal form at the end; the
+    occurs check can be skipped when the caller knows that no variable
+    can be bound to a term containing it.
     >>> unify(x, 3, {})
     {x: 3}
     """
+    if s is None:
+        return None
+    bindings = Bindings(s, occurs_check)
+    if not bindings.unify(x, y):
+        return None
+    return bindings.as_dict() if bindings.trail else s
+
+
+class Bindings:
+    """A triangular substitution: var: term bindings where a term may mention
+    other bound variables. Binding a variable costs O(1), and the bindings
+    are only applied to a term when it is resolved. The trail records the
+    order of the bindings, so that the ones made after a mark can be undone
+    when backtracking.
+    >>> b = Bindings()
+    >>> b.unify(expr('P(x, y)'), expr('P(y, A)'))
+    True
+    >>> b.resolve(x)
+    A
+    """
+
+    def __init__(self, s=None, occurs_check=True):
+        self.s = dict(s) if s else {}
+        self.trail = []
+        self.occurs_check = occurs_check
+
+    def walk(self, x):
+        """Follow the bindings of x until an unbound variable or a non-variable term."""
+        while is_variable(x) and x in self.s:
+            x = self.s[x]
+        return x
+
+    def bind(self, var, x):
+        self.s[var] = x
+        self.trail.append(var)
+
+    def mark(self):
+        return len(self.trail)
+
+    def undo(self, mark):
+        """Remove all the bindings made since mark."""
+        while len(self.trail) > mark:
+            del self.s[self.trail.pop()]
+
+    def occurs(self, var, x):
+        """Return true if variable var occurs anywhere in the resolved x."""
+        x = self.walk(x)
+        if var == x:
+            return True
+        elif isinstance(x, Expr):
+            return any(self.occurs(var, arg) for arg in x.args)
+        elif isinstance(x, (list, tuple)):
+            return any(self.occurs(var, e) for e in x)
+        else:
+            return False
+
+    def unify(self, x, y):
+        """Extend the bindings so that x and y are equal and return True,
+        or leave them unchanged and return False if x and y can not unify."""
+        mark = self.mark()
+        pairs = [(x, y)]
+        while pairs:
+            x, y = pairs.pop()
+            x, y = self.walk(x), self.walk(y)
+            if x is y or x == y:
+                continue
+            elif is_variable(x) or is_variable(y):
+                var, val = (x, y) if is_variable(x) else (y, x)
+                if self.occurs_check and self.occurs(var, val):
+                    break
+                self.bind(var, val)
+            elif isinstance(x, Expr) and isinstance(y, Expr):
+                if x.op != y.op or len(x.args) != len(y.args):
+                    break
+                pairs.extend(reversed(list(zip(x.args, y.args))))
+            elif isinstance(x, str) or isinstance(y, str):
+                break
+            elif issequence(x) and issequence(y) and len(x) == len(y):
+                pairs.extend(reversed(list(zip(x, y))))
+            else:
+                break
+        else:
+            return True
+        self.undo(mark)
+        return False
+
+    def resolve(self, x):
+        """Apply the bindings to x."""
+        x = self.walk(x)
+        if isinstance(x, Expr) and x.args:
+            return Expr(x.op, *[self.resolve(arg) for arg in x.args])
+        elif isinstance(x, list):
+            return [self.resolve(xi) for xi in x]
+        elif isinstance(x, tuple):
+            return tuple([self.resolve(xi) for xi in x])
+        else:
+            return x
+
+    def as_dict(self):
+        """Return the bindings as a substitution in normal form."""
+        return {var: self.resolve(val) for var, val in self.s.items()}
+
+
+def unify_naive(x, y, s={}):
+    """The textbook unification algorithm, which copies the substitution at
+    every binding; kept as a baseline for the faster unify. [Figure 9.1]
+    >>> unify_naive(x, 3, {})
+    {x: 3}
+    """
     if s is None:
         return None
     elif x == y:
@@ -1320,13 +1433,13 @@ def unify(x, y, s={}):
     elif is_variable(y):
         return unify_var(y, x, s)
     elif isinstance(x, Expr) and isinstance(y, Expr):
-        return unify(x.args, y.args, unify(x.op, y.op, s))
+        return unify_naive(x.args, y.args, unify_naive(x.op, y.op, s))
     elif isinstance(x, str) or isinstance(y, str):
         return None
     elif issequence(x) and issequence(y) and len(x) == len(y):
         if not x:
             return s
-        return unify(x[1:], y[1:], unify(x[0], y[0], s))
+        return unify_naive(x[1:], y[1:], unify_naive(x[0], y[0], s))
     else:
         return None
 
@@ -1338,9 +1451,9 @@ def is_variable(x):
 
 def unify_var(var, x, s):
     if var in s:
-        return unify(s[var], x, s)
+        return unify_naive(s[var], x, s)
     elif x in s:
-        return unify(var, s[x], s)
+        return unify_naive(var, s[x], s)
     elif occur_check(var, x, s):
         return None
     else:
@@ -1388,8 +1501,10 @@ class FolKB(KB):
     False
     """
 
-    def __init__(self, initial_clauses=None):
+    def __init__(self, initial_clauses=None, tabled=False):
         self.clauses = []  # inefficient: no indexing
+        self.tabled = tabled
+        self.table = AnswerTable()
         if initial_clauses:
             for clause in initial_clauses:
                 self.tell(clause)
@@ -1397,14 +1512,18 @@ class FolKB(KB):
     def tell(self, sentence):
         if is_definite_clause(sentence):
             self.clauses.append(sentence)
+            self.table.clear()
         else:
             raise Exception("Not a definite clause: {}".format(sentence))
 
     def ask_generator(self, query):
+        if self.tabled:
+            return fol_bc_tabled_ask(self, query)
         return fol_bc_ask(self, query)
 
     def retract(self, sentence):
         self.clauses.remove(sentence)
+        self.table.clear()
 
     def fetch_rules_for_goal(self, goal):
         return self.clauses
@@ -1452,10 +1571,13 @@ def fol_fc_ask(KB, alpha):
 
 def subst(s, x):
     """Substitute the substitution s into the expression x.
+    s may also be a Bindings object, whose bindings are then resolved.
     >>> subst({x: 42, y:0}, F(x) + y)
     (F(42) + 0)
     """
-    if isinstance(x, list):
+    if isinstance(s, Bindings):
+        return s.resolve(x)
+    elif isinstance(x, list):
         return [subst(s, xi) for xi in x]
     elif isinstance(x, tuple):
         return tuple([subst(s, xi) for xi in x])
@@ -1494,29 +1616,140 @@ standardize_variables.counter = itertools.count()
 
 def fol_bc_ask(KB, query):
     """A simple backward-chaining algorithm for first-order logic. [Figure 9.6]
-    KB should be an instance of FolKB, and query an atomic sentence."""
-    return fol_bc_or(KB, query, {})
+    KB should be an instance of FolKB, and query an atomic sentence.
+    A single Bindings object is threaded through the search, and the
+    substitution is only resolved when an answer is found."""
+    bindings = Bindings()
+    for _ in fol_bc_or(KB, query, bindings):
+        yield bindings.as_dict()
 
 
-def fol_bc_or(KB, goal, theta):
+def fol_bc_or(KB, goal, bindings):
     for rule in KB.fetch_rules_for_goal(goal):
         lhs, rhs = parse_definite_clause(standardize_variables(rule))
-        for theta1 in fol_bc_and(KB, lhs, unify(rhs, goal, theta)):
-            yield theta1
+        mark = bindings.mark()
+        if bindings.unify(rhs, goal):
+            yield from fol_bc_and(KB, lhs, bindings)
+            bindings.undo(mark)
+
+
+def fol_bc_and(KB, goals, bindings):
+    if not goals:
+        yield bindings
+    else:
+        first, rest = goals[0], goals[1:]
+        for _ in fol_bc_or(KB, bindings.resolve(first), bindings):
+            yield from fol_bc_and(KB, rest, bindings)
+
+
+class AnswerTable:
+    """The answer tables of tabled backward chaining, kept by a FolKB across
+    queries. Goals are keyed by variant, i.e. up to a renaming of their
+    variables, and a table is complete once all its answers have been found."""
+
+    def __init__(self):
+        self.answers = {}
+        self.complete = set()
+        self.evaluated = []  # incomplete goals, in the order they were evaluated
+        self.n_answers = 0
+        self.incomplete_reads = 0
+
+    def clear(self):
+        self.__init__()
+
+
+def variant_key(goal):
+    """Rename the variables of goal in order of first occurrence, so that
+    goals which only differ in the names of their variables share a key.
+    >>> variant_key(expr('P(y, A, x, y)')) == variant_key(expr('P(u, A, z, u)'))
+    True
+    """
+    names = {}
+    for e in subexpressions(goal):
+        if is_variable(e) and e not in names:
+            names[e] = Expr('v{}'.format(len(names)))
+    return subst(names, goal)
+
+
+def fol_bc_tabled_ask(kb, query):
+    """
+    A tabled (SLG-style) version of fol_bc_ask. The answers to every subgoal
+    are cached in kb.table by variant and reused by later calls and queries;
+    a call to a variant of a subgoal which is still being evaluated consumes
+    the answers found so far instead of recurring, and the leader of each
+    group of mutually recursive subgoals is re-evaluated until no new answers
+    appear, so left-recursive rules terminate. The tables are cleared by
+    FolKB.tell and FolKB.retract.
+    """
+    for answer in fol_bc_tabled_or(kb, query, []):
+        theta = unify(query, standardize_variables(answer), {})
+        if theta is not None:
+            yield theta
 
 
-def fol_bc_and(KB, goals, theta):
+def fol_bc_tabled_or(kb, goal, stack):
+    """Return the list of instances of goal entailed by kb, evaluating it if its table
+    is not complete. stack holds [key, low] frames of the goals being evaluated."""
+    table = kb.table
+    key = variant_key(goal)
+    if key in table.complete:
+        return table.answers[key]
+    for depth, frame in enumerate(stack):
+        if frame[0] == key:
+            # a recursive call: every goal above it depends on this incomplete table
+            for upper in stack[depth + 1:]:
+                upper[1] = min(upper[1], depth)
+            table.incomplete_reads += 1
+            return list(table.answers[key])
+    depth = len(stack)
+    frame = [key, depth]
+    stack.append(frame)
+    answers = table.answers.setdefault(key, [])
+    found = set(answers)
+    start = len(table.evaluated)
+    while True:
+        n_answers, reads = table.n_answers, table.incomplete_reads
+        for rule in kb.fetch_rules_for_goal(goal):
+            lhs, rhs = parse_definite_clause(standardize_variables(rule))
+            for theta in fol_bc_tabled_and(kb, lhs, unify(rhs, goal, {}), stack):
+                answer = variant_key(full_subst(theta, goal))
+                if answer not in found:
+                    found.add(answer)
+                    answers.append(answer)
+                    table.n_answers += 1
+        if frame[1] < depth or table.n_answers == n_answers or table.incomplete_reads == reads:
+            break
+    stack.pop()
+    table.evaluated.append(key)
+    if frame[1] == depth:
+        # this goal leads its group of recursive goals, which are now complete
+        table.complete.update(table.evaluated[start:])
+        del table.evaluated[start:]
+    return list(answers)
+
+
+def fol_bc_tabled_and(kb, goals, theta, stack):
     if theta is None:
         pass
     elif not goals:
         yield theta
     else:
         first, rest = goals[0], goals[1:]
-        for theta1 in fol_bc_or(KB, subst(theta, first), theta):
-            for theta2 in fol_bc_and(KB, rest, theta1):
+        goal = full_subst(theta, first)
+        for answer in fol_bc_tabled_or(kb, goal, stack):
+            theta1 = unify(goal, standardize_variables(answer), theta)
+            for theta2 in fol_bc_tabled_and(kb, rest, theta1, stack):
                 yield theta2
 
 
+def full_subst(s, x):
+    """Apply the substitution s to x until no bound variable is left."""
+    y = subst(s, x)
+    while y != x:
+        x, y = y, subst(s, y)
+    return y
+
+
 # ______________________________________________________________________________
 # A simple KB that defines the relevant conditions of the Wumpus World as in Fig 7.4.
 # See Sec. 7.4.3
@@ -8,10 +8,14 @@ dictionary of {state: number} pairs. We then define the value_iteration
 and policy_iteration algorithms.
 """
 
+import heapq
 import random
 from collections import defaultdict
 
 import numpy as np
+from scipy import sparse
+from scipy.optimize import linprog
+from scipy.sparse import linalg
 
 from utils import vector_add, orientations, turn_right, turn_left
 
@@ -216,6 +220,74 @@ def value_iteration(mdp, epsilon=0.001):
             return U
 
 
+def gauss_seidel_value_iteration(mdp, epsilon=0.001):
+    """Solving an MDP by value iteration [Figure 17.4] with asynchronous,
+    in-place (Gauss-Seidel) updates: each state is backed up with the newest
+    utilities of the states before it in the sweep. A Gauss-Seidel sweep is a
+    contraction by gamma too, so the stopping rule of value_iteration holds."""
+
+    U = {s: 0 for s in mdp.states}
+    R, T, gamma = mdp.R, mdp.T, mdp.gamma
+    while True:
+        delta = 0
+        for s in mdp.states:
+            u = R(s) + gamma * max(sum(p * U[s1] for (p, s1) in T(s, a))
+                                   for a in mdp.actions(s))
+            delta = max(delta, abs(u - U[s]))
+            U[s] = u
+        if delta <= epsilon * (1 - gamma) / gamma:
+            return U
+
+
+def mdp_predecessors(mdp):
+    """Map each state s1 to a dict of the states s with P(s1 | s, a) > 0 for
+    some action a, to the largest such probability over the actions."""
+
+    predecessors = defaultdict(dict)
+    for s in mdp.states:
+        for a in mdp.actions(s):
+            P = defaultdict(float)  # T(s, a) may list a state s1 more than once
+            for (p, s1) in mdp.T(s, a):
+                P[s1] += p
+            for s1, p in P.items():
+                if p > predecessors[s1].get(s, 0):
+                    predecessors[s1][s] = p
+    return predecessors
+
+
+def prioritized_sweeping(mdp, epsilon=0.001):
+    """Solving an MDP by value iteration with the Bellman backups ordered by a
+    priority queue: each state s has a bound on its Bellman residual
+    |R(s) + gamma * max_a sum(p * U[s']) - U[s]|, and the state with the largest
+    bound is backed up first. A change d of U[s] can change the residual of a
+    predecessor s0 of s by at most gamma * P(s | s0, a) * |d|, which is added
+    to its bound. Once every bound is at most epsilon * (1 - gamma) / gamma,
+    so is every residual: the stopping rule of value_iteration."""
+
+    R, T, gamma = mdp.R, mdp.T, mdp.gamma
+    predecessors = mdp_predecessors(mdp)
+    threshold = epsilon * (1 - gamma) / gamma
+    U = {s: 0 for s in mdp.states}
+    bound = {s: abs(R(s)) for s in mdp.states}  # the first backups give U[s] = R(s)
+    # a heap of (-bound, tie breaker, state), where the entries of stale bounds are skipped
+    queue = [(-b, i, s) for i, (s, b) in enumerate(bound.items()) if b > threshold]
+    heapq.heapify(queue)
+    count = len(queue)
+    while queue:
+        b, _, s = heapq.heappop(queue)
+        if -b != bound[s]:
+            continue
+        u = R(s) + gamma * max(sum(p * U[s1] for (p, s1) in T(s, a))
+                               for a in mdp.actions(s))
+        delta, U[s], bound[s] = abs(u - U[s]), u, 0
+        for s0, p in predecessors[s].items():
+            bound[s0] += gamma * p * delta
+            if bound[s0] > threshold:
+                heapq.heappush(queue, (-bound[s0], count, s0))
+                count += 1
+    return U
+
+
 def best_policy(mdp, U):
     """Given an MDP and a utility function U, determine the best policy,
     as a mapping from state to action. [Equation 17.4]"""
@@ -263,6 +335,242 @@ def policy_evaluation(pi, U, mdp, k=20):
     return U
 
 
+# ______________________________________________________________________________
+
+
+class SparseMDP:
+    """An MDP compiled into arrays: the states are numbered in the order of
+    states, the rewards make up the vector R, and each action a of actlist has
+    a scipy.sparse matrix P[a] of the probabilities P(s' | s, a) by row s and
+    column s', with the mask available[a] of the states in which a can be done.
+    Any MDP whose states, actions, R and T are defined can be compiled."""
+
+    def __init__(self, mdp):
+        self.mdp = mdp
+        self.gamma = mdp.gamma
+        self.states = list(mdp.states)
+        self.index = {s: i for i, s in enumerate(self.states)}
+        n = len(self.states)
+        self.R = np.array([mdp.R(s) for s in self.states], dtype=float)
+        self.actlist, entries = [], {}
+        for i, s in enumerate(self.states):
+            for a in mdp.actions(s):
+                if a not in entries:
+                    self.actlist.append(a)
+                    entries[a] = ([], [], [], [])  # rows, columns, probabilities, available states
+                rows, cols, data, available = entries[a]
+                available.append(i)
+                for (p, s1) in mdp.T(s, a):
+                    rows.append(i)
+                    cols.append(self.index[s1])
+                    data.append(p)
+        self.P, self.available = [], np.zeros((len(self.actlist), n), dtype=bool)
+        for k, a in enumerate(self.actlist):
+            rows, cols, data, available = entries[a]
+            self.P.append(sparse.csr_matrix((data, (rows, cols)), shape=(n, n)))
+            self.available[k, available] = True
+
+    def q_values(self, U):
+        """The array of R(s) + gamma * sum(p * U[s'] for (p, s') in T(s, a)) by
+        action a (in the order of actlist) and state s, -inf where a can not be done."""
+        Q = self.R + self.gamma * np.vstack([P @ U for P in self.P])
+        Q[~self.available] = -np.inf
+        return Q
+
+    def to_dict(self, values):
+        """Map each state to its entry of an array of values."""
+        return {s: values[i] for i, s in enumerate(self.states)}
+
+    def to_array(self, mapping):
+        """The array of the values of a mapping of the states."""
+        return np.array([mapping[s] for s in self.states])
+
+
+def sparse_value_iteration(mdp, epsilon=0.001):
+    """Solving an MDP by value iteration [Figure 17.4], as a sparse matrix-vector
+    product per action and a maximum over the actions in each sweep; mdp may be
+    an MDP, or a SparseMDP compiled from it once for several runs."""
+
+    mdp = mdp if isinstance(mdp, SparseMDP) else SparseMDP(mdp)
+    gamma = mdp.gamma
+    U1 = np.zeros(len(mdp.states))
+    while True:
+        U = U1
+        U1 = mdp.q_values(U).max(axis=0)
+        delta = np.abs(U1 - U).max(initial=0)
+        if delta <= epsilon * (1 - gamma) / gamma:
+            return mdp.to_dict(U)
+
+
+def sparse_policy_iteration(mdp):
+    """Solve an MDP by policy iteration [Figure 17.7], evaluating each policy
+    exactly by a sparse linear solve of U = R + gamma * P_pi U; mdp may be an
+    MDP, or a SparseMDP compiled from it."""
+
+    mdp = mdp if isinstance(mdp, SparseMDP) else SparseMDP(mdp)
+    n = len(mdp.states)
+    pi = mdp.available.argmax(axis=0)  # the first action available in each state
+    identity = sparse.identity(n, format='csr')
+    while True:
+        P_pi = sum(sparse.diags((pi == k).astype(float)) @ P for k, P in enumerate(mdp.P))
+        U = linalg.spsolve((identity - mdp.gamma * P_pi).tocsc(), mdp.R)
+        Q = mdp.q_values(U)
+        best = Q.argmax(axis=0)
+        # only switch to strictly better actions, so that ties can not cycle
+        improved = Q[best, np.arange(n)] > Q[pi, np.arange(n)] + 1e-12
+        if not improved.any():
+            return {s: mdp.actlist[pi[i]] for i, s in enumerate(mdp.states)}
+        pi = np.where(improved, best, pi)
+
+
+# ______________________________________________________________________________
+
+
+class ArrayGridMDP(GridMDP):
+    """A GridMDP kept as arrays, for grids far too big for the dicts of GridMDP.
+    The grid is given as for GridMDP, or as a 2-D array with NaN for an obstacle
+    (a reward of 0 is a free cell here). rewards[y, x] is the reward of state
+    (x, y), and the transition kernel is only made when it is needed, as the
+    array moves[k] of the cell reached by going in the direction orientations[k]
+    from each cell (by flat index y * cols + x). R, T and actions are those of
+    GridMDP; expected_utilities, bellman_update and best_actions work on whole
+    grids of utilities U[y, x], with NaN in the obstacles."""
+
+    def __init__(self, grid, terminals, init=(0, 0), gamma=.9):
+        if not (0 < gamma <= 1):
+            raise ValueError("An MDP must have 0 < gamma <= 1")
+        if not isinstance(grid, np.ndarray):
+            grid = [[np.nan if r is None else r for r in row] for row in grid]
+        self.rewards = np.array(grid, dtype=float)[::-1]  # row 0 on the bottom
+        self.free = ~np.isnan(self.rewards)
+        self.rows, self.cols = self.rewards.shape
+        self.init = init
+        self.actlist = orientations
+        self.terminals = terminals
+        self.terminal = np.zeros_like(self.free)
+        for (x, y) in terminals:
+            self.terminal[y, x] = True
+        self.gamma = gamma
+        self._states = self._moves = None
+
+    @property
+    def states(self):
+        """The set of the free (x, y) cells, made on first use."""
+        if self._states is None:
+            self._states = set(zip(*(i.tolist() for i in np.nonzero(self.free.T))))
+        return self._states
+
+    @property
+    def moves(self):
+        """moves[k, y * cols + x] is the flat index of the cell reached by going in the
+        direction orientations[k] from (x, y): the neighbour, or (x, y) at a wall."""
+        if self._moves is None:
+            y, x = np.indices(self.free.shape)
+            here = y * self.cols + x
+            self._moves = np.empty((len(orientations), self.free.size), dtype=np.intp)
+            for k, (dx, dy) in enumerate(orientations):
+                x1, y1 = x + dx, y + dy
+                inside = (0 <= x1) & (x1 < self.cols) & (0 <= y1) & (y1 < self.rows)
+                inside[inside] = self.free[y1[inside], x1[inside]]
+                self._moves[k] = np.where(inside, y1 * self.cols + x1, here).ravel()
+        return self._moves
+
+    def R(self, state):
+        x, y = state
+        return float(self.rewards[y, x])
+
+    def T(self, state, action):
+        return self.calculate_T(state, action) if action else [(0.0, state)]
+
+    def go(self, state, direction):
+        """Return the state that results from going in this direction."""
+        x, y = vector_add(state, direction)
+        return (x, y) if 0 <= x < self.cols and 0 <= y < self.rows and self.free[y, x] else state
+
+    def expected_utilities(self, U):
+        """The array of sum(p * U[s'] for (p, s') in T(s, a)) by the action a,
+        in the order of actlist, and the state s = (x, y) of a grid U[y, x]."""
+        U = np.nan_to_num(U).ravel()
+        ahead = U[self.moves]
+        # turning right or left is the previous or the next orientation
+        EU = 0.8 * ahead + 0.1 * np.roll(ahead, 1, axis=0) + 0.1 * np.roll(ahead, -1, axis=0)
+        return EU.reshape(len(orientations), self.rows, self.cols)
+
+    def bellman_update(self, U):
+        """R(s) + gamma * max(expected utility of a in s) over the grid U, as in
+        value_iteration: the utility of a terminal state is its reward."""
+        EU = self.expected_utilities(U).max(axis=0)
+        return self.rewards + self.gamma * np.where(self.terminal, 0, EU)
+
+    def best_actions(self, U):
+        """The index in actlist of the best action in each cell of the grid U,
+        as in best_policy, and -1 in the terminal states and obstacles."""
+        return np.where(self.terminal | ~self.free, -1, self.expected_utilities(U).argmax(axis=0))
+
+    def to_dict(self, values):
+        """Map each state (x, y) to values[y, x]."""
+        y, x = np.nonzero(self.free)
+        return dict(zip(zip(x.tolist(), y.tolist()), values[y, x].tolist()))
+
+    def to_array(self, mapping):
+        """The grid of the values of a mapping of the states, NaN in the obstacles."""
+        values = np.full(self.rewards.shape, np.nan)
+        for (x, y), v in mapping.items():
+            values[y, x] = v
+        return values
+
+    def to_grid(self, mapping):
+        """Convert a mapping from (x, y) to v, or a grid of values[y, x], into a
+        [[..., v, ...]] grid."""
+        if not isinstance(mapping, np.ndarray):
+            return super().to_grid(mapping)
+        grid = mapping.astype(object)
+        grid[~self.free] = None
+        return grid[::-1].tolist()
+
+    def to_arrows(self, policy):
+        if not isinstance(policy, np.ndarray):
+            return super().to_arrows(policy)
+        # the characters of the actions in the order of actlist, and '.' for -1
+        return self.to_grid(np.array(['>', '^', '<', 'v', '.'], dtype=object)[policy])
+
+
+def grid_value_iteration(mdp, epsilon=0.001):
+    """Solving an ArrayGridMDP by value iteration [Figure 17.4], with a whole-grid
+    Bellman update per sweep. Returns the grid of utilities U[y, x], which
+    mdp.to_dict turns into the mapping of value_iteration."""
+
+    U1 = np.where(mdp.free, 0., np.nan)
+    gamma = mdp.gamma
+    while True:
+        U = U1
+        U1 = mdp.bellman_update(U)
+        delta = np.nanmax(np.abs(U1 - U), initial=0)
+        if delta <= epsilon * (1 - gamma) / gamma:
+            return U
+
+
+def grid_policy_iteration(mdp, k=20):
+    """Solving an ArrayGridMDP by policy iteration [Figure 17.7], with k sweeps of
+    whole-grid policy evaluation, as in policy_evaluation. Returns the grid of
+    the indices in actlist of the actions of the policy, as best_actions does."""
+
+    U = np.where(mdp.free, 0., np.nan)
+    pi = np.where(mdp.terminal | ~mdp.free, -1, 0)
+    cells = np.indices(pi.shape)
+    while True:
+        for i in range(k):
+            EU = mdp.expected_utilities(U)[pi.clip(0), cells[0], cells[1]]
+            U = mdp.rewards + mdp.gamma * np.where(pi < 0, 0, EU)
+        EU = mdp.expected_utilities(U)
+        best = np.where(pi < 0, -1, EU.argmax(axis=0))
+        # only switch to strictly better actions, so that ties can not cycle
+        improved = (pi >= 0) & (EU.max(axis=0) > EU[pi.clip(0), cells[0], cells[1]] + 1e-12)
+        if not improved.any():
+            return pi
+        pi = np.where(improved, best, pi)
+
+
 class POMDP(MDP):
     """A Partially Observable Markov Decision Process, defined by
     a transition model P(s'|s,a), actions A(s), a reward function R(s),
@@ -456,6 +764,187 @@ def pomdp_value_iteration(pomdp, epsilon=0.1):
                 return U
 
 
+# ______________________________________________________________________________
+
+
+class ArrayPOMDP:
+    """A POMDP compiled into arrays: the transition model T[k, s, s'], the
+    sensor model O[k, s', o] = P(o | s') and the rewards R[k, s] of the k-th
+    action of actions, indexed by int(action) in the models of the POMDP as in
+    pomdp_value_iteration. Beliefs are arrays of probabilities over the states,
+    and a value function is an array of alpha vectors, one per row."""
+
+    def __init__(self, pomdp):
+        self.pomdp = pomdp
+        self.gamma = pomdp.gamma
+        self.actions = list(pomdp.actions)
+        index = [int(a) for a in self.actions]
+        self.T = np.array(pomdp.t_prob, dtype=float)[index]
+        self.O = np.array(pomdp.e_prob, dtype=float)[index]
+        self.R = np.array(pomdp.rewards, dtype=float)[index]
+
+    def belief_update(self, b, k, o):
+        """The belief after doing the k-th action in belief b and observing o."""
+        b1 = self.O[k, :, o] * (b @ self.T[k])
+        return b1 / b1.sum()
+
+    def sample_beliefs(self, n, rng=np.random):
+        """The uniform belief, the corners of the belief simplex, and the beliefs
+        reached by random walks from the uniform belief, n beliefs in all."""
+        m = self.R.shape[1]
+        B = [np.full(m, 1 / m)] + list(np.eye(m))
+        b, s = B[0], rng.randint(m)
+        while len(B) < n:
+            k = rng.randint(len(self.actions))
+            s = rng.choice(m, p=self.T[k, s])
+            b = self.belief_update(b, k, rng.choice(self.O.shape[2], p=self.O[k, s]))
+            B.append(b)
+        return np.array(B[:n])
+
+    def projections(self, alphas):
+        """G[k, o, i, s] = sum(T[k, s, s'] * O[k, s', o] * alphas[i, s'] for s'),
+        the expected next values of the alpha vectors after action k and percept o."""
+        # T[k, s, s'] * O[k, s', o] by action, percept, state and next state
+        TO = self.T[:, None] * self.O.transpose(0, 2, 1)[:, :, None]
+        return (TO @ alphas.T).swapaxes(2, 3)
+
+    def backup(self, B, alphas, G=None):
+        """The point-based Bellman backup of the value function alphas at each
+        belief in B: the best new alpha vector for each belief, and the index
+        of the action of its plan. G may be given as the projections of alphas."""
+        G = self.projections(alphas) if G is None else G
+        best = (G @ B.T).argmax(axis=2)  # the best projection by action, percept and belief
+        k, o = np.arange(len(self.actions))[:, None, None], np.arange(self.O.shape[2])[:, None]
+        A = self.R[:, None] + self.gamma * G[k, o, best].sum(axis=1)  # by action, belief and state
+        actions = np.einsum('kns,ns->nk', A, B).argmax(axis=1)
+        return A[actions, np.arange(len(B))], actions
+
+    def to_plans(self, alphas, actions):
+        """Map each action to its alpha vectors, as pomdp_value_iteration does."""
+        plans = defaultdict(list)
+        for alpha, k in zip(alphas, actions):
+            plans[self.actions[k]].append(alpha)
+        return plans
+
+
+def prune_alpha_vectors(alphas, lp=False):
+    """The indices of the alpha vectors that are not dominated: no other vector
+    is at least as good in every state (the first of equal vectors is kept),
+    and, with lp, each vector is the best one at some belief, found by a
+    linear program maximizing its margin over the other vectors.
+    >>> alphas = [[1, 0], [0, 1], [0.4, 0.4], [0.6, 0.6], [0.6, 0.6], [0.45, 0.45], [0, 0]]
+    >>> prune_alpha_vectors(alphas).tolist()
+    [0, 1, 3]
+    >>> prune_alpha_vectors([[1, 0], [0, 1], [0.45, 0.45]], lp=True).tolist()
+    [0, 1]
+    """
+
+    alphas = np.asarray(alphas)
+    n = len(alphas)
+    below = (alphas[:, None, :] <= alphas[None, :, :]).all(axis=2)
+    equal = below & below.T
+    dominated = (below & ~equal).any(axis=1) | np.tril(equal, -1).any(axis=1)
+    keep = np.flatnonzero(~dominated)
+    if not lp or len(keep) < 2:
+        return keep
+    m = alphas.shape[1]
+    useful = []
+    for i in keep:
+        others = alphas[keep[keep != i]]
+        # maximize d subject to b . (alpha - other) >= d for every other vector, b a belief
+        result = linprog(np.r_[np.zeros(m), -1],
+                         A_ub=np.c_[others - alphas[i], np.ones(len(others))],
+                         b_ub=np.zeros(len(others)),
+                         A_eq=np.r_[np.ones(m), 0][None], b_eq=[1],
+                         bounds=[(0, None)] * m + [(None, None)])
+        if result.status == 0 and -result.fun > 1e-9:
+            useful.append(i)
+    return np.array(useful, dtype=int)
+
+
+def point_based_value_iteration(pomdp, beliefs=100, epsilon=0.1, max_iterations=1000, lp=False,
+                                seed=None):
+    """Solving a POMDP by point-based value iteration (PBVI): the Bellman
+    backups of the alpha vectors are done only at a set of beliefs, which may
+    be given as an array or a number of beliefs to sample, with one new alpha
+    vector per belief, or its old best vector where the backup is worse, so
+    that the values at the beliefs never decrease from the lower bound they
+    start from. It stops once the values at the beliefs change by at
+    most epsilon * (1 - gamma) / gamma, and returns a mapping from each action
+    to the alpha vectors of its plans, as pomdp_value_iteration does. Dominated
+    vectors are pruned after each backup, and with lp the vectors that are not
+    the best at any belief are pruned from the result by linear programs."""
+
+    pomdp = pomdp if isinstance(pomdp, ArrayPOMDP) else ArrayPOMDP(pomdp)
+    if pomdp.gamma >= 1:
+        raise ValueError('Point-based value iteration needs gamma < 1')
+    rng = np.random.RandomState(seed)
+    B = (pomdp.sample_beliefs(beliefs, rng) if np.ndim(beliefs) == 0
+         else np.asarray(beliefs, dtype=float))
+    # a lower bound of the utilities to start from
+    alphas = np.full((1, B.shape[1]), pomdp.R.min() / (1 - pomdp.gamma))
+    actions = np.zeros(1, dtype=int)
+    values = (B @ alphas.T).max(axis=1)
+    for _ in range(max_iterations):
+        old = (B @ alphas.T).argmax(axis=1)
+        new_alphas, new_actions = pomdp.backup(B, alphas)
+        # keep the old vector that is the best at a belief where the backup is worse,
+        # so that the values never decrease and can not oscillate
+        worse = (new_alphas * B).sum(axis=1) < values
+        new_alphas[worse], new_actions[worse] = alphas[old[worse]], actions[old[worse]]
+        keep = prune_alpha_vectors(new_alphas)
+        alphas, actions = new_alphas[keep], new_actions[keep]
+        new_values = (B @ alphas.T).max(axis=1)
+        delta, values = (new_values - values).max(), new_values
+        if delta <= epsilon * (1 - pomdp.gamma) / pomdp.gamma:
+            break
+    keep = prune_alpha_vectors(alphas, lp)
+    return pomdp.to_plans(alphas[keep], actions[keep])
+
+
+def perseus(pomdp, beliefs=100, epsilon=0.1, max_iterations=1000, lp=False, seed=None):
+    """Solving a POMDP by Perseus, a randomized point-based value iteration:
+    each stage backs up random beliefs, one at a time, until the value of every
+    belief has been improved (or kept) by the new alpha vectors, so there are
+    usually far fewer backups and vectors than beliefs. Starting from a lower
+    bound, the values at the beliefs never decrease; the arguments and the
+    result are those of point_based_value_iteration."""
+
+    pomdp = pomdp if isinstance(pomdp, ArrayPOMDP) else ArrayPOMDP(pomdp)
+    if pomdp.gamma >= 1:
+        raise ValueError('Perseus needs gamma < 1')
+    rng = np.random.RandomState(seed)
+    B = (pomdp.sample_beliefs(beliefs, rng) if np.ndim(beliefs) == 0
+         else np.asarray(beliefs, dtype=float))
+    alphas = np.full((1, B.shape[1]), pomdp.R.min() / (1 - pomdp.gamma))
+    actions = np.zeros(1, dtype=int)
+    for _ in range(max_iterations):
+        V = B @ alphas.T
+        values = V.max(axis=1)
+        new_alphas, new_actions = [], []
+        new_values = np.full(len(B), -np.inf)
+        todo = np.arange(len(B))
+        G = pomdp.projections(alphas)
+        while len(todo):
+            n = rng.choice(todo)
+            alpha, k = pomdp.backup(B[n:n + 1], alphas, G)
+            alpha, k = alpha[0], k[0]
+            if alpha @ B[n] < values[n]:
+                # keep the old vector that is the best at this belief
+                alpha, k = alphas[V[n].argmax()], actions[V[n].argmax()]
+            new_alphas.append(alpha)
+            new_actions.append(k)
+            new_values = np.maximum(new_values, B @ alpha)
+            todo = np.flatnonzero(new_values < values)
+        alphas, actions = np.array(new_alphas), np.array(new_actions)
+        keep = prune_alpha_vectors(alphas)
+        alphas, actions = alphas[keep], actions[keep]
+        if (new_values - values).max() <= epsilon * (1 - pomdp.gamma) / pomdp.gamma:
+            break
+    keep = prune_alpha_vectors(alphas, lp)
+    return pomdp.to_plans(alphas[keep], actions[keep])
+
+
 __doc__ += """
 >>> pi = best_policy(sequential_decision_environment, value_iteration(sequential_decision_environment, .01))
 
@@ -1,7 +1,11 @@
 """Planning (Chapters 10-11)"""
 
 import copy
+import heapq
 import itertools
+import operator
+import time
+import tracemalloc
 from collections import deque, defaultdict
 from functools import reduce as _reduce
 
@@ -11,7 +15,7 @@ import search
 from csp import sat_up, NaryCSP, Constraint, ac_search_solver, is_constraint
 from logic import FolKB, conjuncts, unify_mm, associate, SAT_plan, cdcl_satisfiable
 from search import Node
-from utils import Expr, expr, first
+from utils import Expr, expr, first, print_table
 
 
 class PlanningProblem:
@@ -91,7 +95,8 @@ class PlanningProblem:
                 if action.precond:
                     kb.tell(expr(str(action.domain) + ' ==> ' + str(action)))
 
-        objects = set(arg for clause in self.initial for arg in clause.args)
+        # in order of first appearance, so that the expansions do not depend on hashing
+        objects = list(dict.fromkeys(arg for clause in self.initial for arg in clause.args))
         expansions = []
         action_list = []
         if name is not None:
@@ -420,6 +425,83 @@ def simple_blocks_world():
                                            effect='~OnTable(y) & ~Clear(x) & On(y, x)')])
 
 
+def blocks_world(n):
+    """
+    BLOCKS-WORLD
+
+    A blocks-world problem with the actions of three_block_tower, scaled to n blocks
+    B1, ..., Bn: they start in a single tower with B1 at the bottom, and the goal
+    is the reversed tower.
+
+    Example:
+    >>> from planning import *
+    >>> bw = blocks_world(2)
+    >>> bw.act(expr('MoveToTable(B2, B1)'))
+    >>> bw.act(expr('Move(B1, Table, B2)'))
+    >>> bw.goal_test()
+    True
+    >>>
+    """
+    blocks = ['B{}'.format(i) for i in range(1, n + 1)]
+    initial = ['On({}, Table)'.format(blocks[0]), 'Clear({})'.format(blocks[-1])]
+    initial += ['On({}, {})'.format(b, below) for below, b in zip(blocks, blocks[1:])]
+    goals = ['On({}, {})'.format(below, b) for below, b in zip(blocks, blocks[1:])]
+    return PlanningProblem(initial=' & '.join(initial),
+                           goals=' & '.join(goals),
+                           actions=[Action('Move(b, x, y)',
+                                           precond='On(b, x) & Clear(b) & Clear(y)',
+                                           effect='On(b, y) & Clear(x) & ~On(b, x) & ~Clear(y)',
+                                           domain='Block(b) & Block(y)'),
+                                    Action('MoveToTable(b, x)',
+                                           precond='On(b, x) & Clear(b)',
+                                           effect='On(b, Table) & Clear(x) & ~On(b, x)',
+                                           domain='Block(b) & Block(x)')],
+                           domain=' & '.join('Block({})'.format(b) for b in blocks))
+
+
+def logistics(k, p, airports=2):
+    """
+    LOGISTICS
+
+    The air-cargo problem scaled to k pieces of cargo C1, ..., Ck and p planes P1, ..., Pp
+    flying between airports A1, ..., An: cargo Ci and plane Pi start at the i-th airport,
+    counting cyclically, and every piece of cargo must be delivered to the following one.
+
+    Example:
+    >>> from planning import *
+    >>> lp = logistics(1, 1)
+    >>> lp.act(expr('Load(C1, P1, A1)'))
+    >>> lp.act(expr('Fly(P1, A1, A2)'))
+    >>> lp.act(expr('Unload(C1, P1, A2)'))
+    >>> lp.goal_test()
+    True
+    >>>
+    """
+    names = ['A{}'.format(i) for i in range(1, airports + 1)]
+    cargo = ['C{}'.format(i) for i in range(1, k + 1)]
+    planes = ['P{}'.format(i) for i in range(1, p + 1)]
+    initial = ['At({}, {})'.format(c, names[i % airports]) for i, c in enumerate(cargo)]
+    initial += ['At({}, {})'.format(pl, names[i % airports]) for i, pl in enumerate(planes)]
+    goals = ['At({}, {})'.format(c, names[(i + 1) % airports]) for i, c in enumerate(cargo)]
+    domain = (['Cargo({})'.format(c) for c in cargo] + ['Plane({})'.format(pl) for pl in planes] +
+              ['Airport({})'.format(a) for a in names])
+    return PlanningProblem(initial=' & '.join(initial),
+                           goals=' & '.join(goals),
+                           actions=[Action('Load(c, p, a)',
+                                           precond='At(c, a) & At(p, a)',
+                                           effect='In(c, p) & ~At(c, a)',
+                                           domain='Cargo(c) & Plane(p) & Airport(a)'),
+                                    Action('Unload(c, p, a)',
+                                           precond='In(c, p) & At(p, a)',
+                                           effect='At(c, a) & ~In(c, p)',
+                                           domain='Cargo(c) & Plane(p) & Airport(a)'),
+                                    Action('Fly(p, f, to)',
+                                           precond='At(p, f)',
+                                           effect='At(p, to) & ~At(p, f)',
+                                           domain='Plane(p) & Airport(f) & Airport(to)')],
+                           domain=' & '.join(domain))
+
+
 def have_cake_and_eat_cake_too():
     """
     [Figure 10.7] CAKE-PROBLEM
@@ -560,25 +642,206 @@ def double_tennis_problem():
                         effect='At(actor, to) & ~At(actor, loc)')])
 
 
+class GroundedPlanningProblem:
+    """
+    A PlanningProblem compiled for search: its fluents, positive or 'Not' ones,
+    are numbered, so that a state or a set of goals is a frozen bitset (an int),
+    and each ground action is a triple of precondition, add and delete masks.
+    The add mask holds the literals in the effect of the action, and the delete
+    mask their complements, which is how Action.act updates a state.
+    Actions are indexed by one of their preconditions to generate the successors
+    of a state, and by their effects to generate the predecessors of a subgoal.
+    """
+
+    def __init__(self, planning_problem):
+        self.planning_problem = planning_problem
+        self.actions = planning_problem.expand_actions()
+        self.fluents = []
+        self.ids = {}
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
+        self.pre = [self.mask(action.precond) for action in self.actions]
+        self.add = [self.mask(action.effect) for action in self.actions]
+        self.delete = [self.mask(self.complement(e) for e in action.effect)
+                       for action in self.actions]
+        self.neg_pre = [self.mask(self.complement(p) for p in action.precond)
+                        for action in self.actions]
+        self.initial = self.mask(planning_problem.initial)
+        self.goals = self.mask(planning_problem.goals)
+        self.always_applicable = []
+        self.by_precond = defaultdict(list)  # fluent: actions keyed by that precondition
+        count = defaultdict(int)
+        for pre in self.pre:
+            for f in self.bits(pre):
+                count[f] += 1
+        for i, pre in enumerate(self.pre):
+            if pre:
+                self.by_precond[min(self.bits(pre), key=lambda f: count[f])].append(i)
+            else:
+                self.always_applicable.append(i)
+        self.by_effect = defaultdict(list)  # fluent: actions adding it
+        for i, add in enumerate(self.add):
+            for f in self.bits(add):
+                self.by_effect[f].append(i)
+        self.precond_of = defaultdict(list)  # fluent: all the actions with that precondition
+        for i, pre in enumerate(self.pre):
+            for f in self.bits(pre):
+                self.precond_of[f].append(i)
+        self.n_pre = [bin(pre).count('1') for pre in self.pre]
+
+    @staticmethod
+    def complement(literal):
+        if literal.op[:3] == 'Not':
+            return Expr(literal.op[3:], *literal.args)
+        return Expr('Not' + literal.op, *literal.args)
+
+    def fluent_id(self, literal):
+        if literal not in self.ids:
+            self.ids[literal] = len(self.fluents)
+            self.fluents.append(literal)
+        return self.ids[literal]
+
+    def mask(self, literals):
+        """The bitset of a collection of literals."""
+        m = 0
+        for literal in literals:
+            m |= 1 << self.fluent_id(literal)
+        return m
+
+    @staticmethod
+    def bits(mask):
+        """Yield the ids of the fluents in a bitset."""
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    def decode(self, mask):
+        """The list of literals in a bitset."""
+        return [self.fluents[f] for f in self.bits(mask)]
+
+    def applicable(self, state):
+        """The indices of the actions applicable in state, in the order of expand_actions."""
+        candidates = list(self.always_applicable)
+        for f in self.bits(state):
+            candidates.extend(i for i in self.by_precond.get(f, ())
+                              if state & self.pre[i] == self.pre[i])
+        return sorted(candidates)
+
+    def progress(self, state, i):
+        return (state & ~self.delete[i]) | self.add[i]
+
+    def relevant(self, subgoal):
+        """The indices of the actions relevant to subgoal: they achieve one of its literals,
+        delete none of them, and have no precondition contradicting the ones that remain."""
+        candidates = {i for f in self.bits(subgoal) for i in self.by_effect.get(f, ())}
+        return sorted(i for i in candidates
+                      if not subgoal & self.delete[i]
+                      and not subgoal & self.neg_pre[i] & ~self.add[i])
+
+    def regress(self, subgoal, i):
+        # g' = (g - effects(a)) + preconds(a)
+        return (subgoal & ~self.add[i]) | self.pre[i]
+
+    def relaxed_costs(self, state, goals=None, combine=max, all_fluents=False):
+        """
+        Compute the costs of reaching the fluents from state when delete lists are
+        ignored, by a generalized Dijkstra: every action keeps a counter of its
+        preconditions not yet reached, and fires when it drops to zero, with the cost
+        of its preconditions combined by max (h_max) or by sum (h_add), plus one.
+        Stop as soon as all the goals have their final cost, unless all_fluents is
+        true, in which case compute the costs of all the reachable fluents. Return
+        the costs and, for each fluent reached, the action that achieves it at that cost.
+        """
+        goals = self.goals if goals is None else goals
+        cost = {f: 0 for f in self.bits(state)}
+        supporter = {}
+        counter = list(self.n_pre)
+        acc = [0] * len(self.actions)
+        frontier = [(0, f) for f in cost]
+        left = goals & ~state
+        done = 0
+
+        def fire(i, c):
+            for f in self.bits(self.add[i]):
+                if c + 1 < cost.get(f, np.inf):
+                    cost[f] = c + 1
+                    supporter[f] = i
+                    heapq.heappush(frontier, (c + 1, f))
+
+        for i in self.always_applicable:
+            fire(i, 0)
+        while frontier and (left or all_fluents):
+            c, f = heapq.heappop(frontier)
+            if done >> f & 1 or c > cost[f]:
+                continue
+            done |= 1 << f
+            left &= ~(1 << f)
+            for i in self.precond_of.get(f, ()):
+                acc[i] = combine(acc[i], c)
+                counter[i] -= 1
+                if counter[i] == 0:
+                    fire(i, acc[i])
+        return cost, supporter
+
+    def h_max(self, state, goals=None):
+        """The cost of the most expensive goal in the delete relaxation (admissible)."""
+        goals = self.goals if goals is None else goals
+        cost, _ = self.relaxed_costs(state, goals, max)
+        return max((cost.get(f, np.inf) for f in self.bits(goals)), default=0)
+
+    def h_add(self, state, goals=None):
+        """The sum of the costs of the goals in the delete relaxation."""
+        goals = self.goals if goals is None else goals
+        cost, _ = self.relaxed_costs(state, goals, operator.add)
+        return sum(cost.get(f, np.inf) for f in self.bits(goals))
+
+    def h_ff(self, state, goals=None):
+        """The length of the relaxed plan extracted from the h_add supporters of the goals (FF)."""
+        goals = self.goals if goals is None else goals
+        cost, supporter = self.relaxed_costs(state, goals, operator.add)
+        plan = set()
+        open_fluents = list(self.bits(goals & ~state))
+        while open_fluents:
+            f = open_fluents.pop()
+            if f not in supporter:
+                return np.inf
+            if supporter[f] not in plan:
+                plan.add(supporter[f])
+                open_fluents.extend(self.bits(self.pre[supporter[f]] & ~state))
+        return len(plan)
+
+
 class ForwardPlan(search.Problem):
     """
     [Section 10.2.1]
-    Forward state-space search
+    Forward state-space search, over the bitset states of a GroundedPlanningProblem
     """
 
     def __init__(self, planning_problem):
-        super().__init__(associate('&', planning_problem.initial), associate('&', planning_problem.goals))
+        self.grounded = GroundedPlanningProblem(planning_problem)
+        super().__init__(self.grounded.initial, self.grounded.goals)
         self.planning_problem = planning_problem
-        self.expanded_actions = self.planning_problem.expand_actions()
+        self.expanded_actions = self.grounded.actions
+        # the relaxed actions, grounded once for all the calls to h
+        self.relaxed = None
 
     def actions(self, state):
-        return [action for action in self.expanded_actions if all(pre in conjuncts(state) for pre in action.precond)]
+        return [self.expanded_actions[i] for i in self.grounded.applicable(state)]
 
     def result(self, state, action):
-        return associate('&', action(conjuncts(state), action.args).clauses)
+        return self.grounded.progress(state, self.grounded.action_index[action])
 
     def goal_test(self, state):
-        return all(goal in conjuncts(state) for goal in self.planning_problem.goals)
+        return state & self.goal == self.goal
+
+    def h_max(self, node):
+        return self.grounded.h_max(node.state)
+
+    def h_add(self, node):
+        return self.grounded.h_add(node.state)
+
+    def h_ff(self, node):
+        return self.grounded.h_ff(node.state)
 
     def h(self, state):
         """
@@ -586,12 +849,14 @@ class ForwardPlan(search.Problem):
         by removing the delete lists from all actions, i.e. removing all negative literals from effects) that will be
         easier to solve through GraphPlan and where the length of the solution will serve as a good heuristic.
         """
-        relaxed_planning_problem = PlanningProblem(initial=state.state,
-                                                   goals=self.goal,
-                                                   actions=[action.relaxed() for action in
-                                                            self.planning_problem.actions])
+        relaxed_planning_problem = PlanningProblem(
+            initial=associate('&', self.grounded.decode(state.state)),
+            goals=associate('&', self.planning_problem.goals),
+            actions=[action.relaxed() for action in self.planning_problem.actions])
+        if self.relaxed is None:
+            self.relaxed = GroundedPlanningProblem(relaxed_planning_problem)
         try:
-            return len(linearize(GraphPlan(relaxed_planning_problem).execute()))
+            return len(linearize(GraphPlan(relaxed_planning_problem, self.relaxed).execute()))
         except:
             return np.inf
 
@@ -599,13 +864,17 @@ class ForwardPlan(search.Problem):
 class BackwardPlan(search.Problem):
     """
     [Section 10.2.2]
-    Backward relevant-states search
+    Backward relevant-states search, over the bitset subgoals of a GroundedPlanningProblem
     """
 
     def __init__(self, planning_problem):
-        super().__init__(associate('&', planning_problem.goals), associate('&', planning_problem.initial))
+        self.grounded = GroundedPlanningProblem(planning_problem)
+        super().__init__(self.grounded.goals, self.grounded.initial)
         self.planning_problem = planning_problem
-        self.expanded_actions = self.planning_problem.expand_actions()
+        self.expanded_actions = self.grounded.actions
+        # the relaxed actions, grounded once for all the calls to h
+        self.relaxed = None
+        self.costs = {}
 
     def actions(self, subgoal):
         """
@@ -614,24 +883,29 @@ class BackwardPlan(search.Problem):
         - the action doesn't delete something that needs to be achieved
         - the preconditions are consistent with other subgoals that need to be achieved
         """
-
-        def negate_clause(clause):
-            return Expr(clause.op.replace('Not', ''), *clause.args) if clause.op[:3] == 'Not' else Expr(
-                'Not' + clause.op, *clause.args)
-
-        subgoal = conjuncts(subgoal)
-        return [action for action in self.expanded_actions if
-                (any(prop in action.effect for prop in subgoal) and
-                 not any(negate_clause(prop) in subgoal for prop in action.effect) and
-                 not any(negate_clause(prop) in subgoal and negate_clause(prop) not in action.effect
-                         for prop in action.precond))]
+        return [self.expanded_actions[i] for i in self.grounded.relevant(subgoal)]
 
     def result(self, subgoal, action):
-        # g' = (g - effects(a)) + preconds(a)
-        return associate('&', set(set(conjuncts(subgoal)).difference(action.effect)).union(action.precond))
+        return self.grounded.regress(subgoal, self.grounded.action_index[action])
 
     def goal_test(self, subgoal):
-        return all(goal in conjuncts(self.goal) for goal in conjuncts(subgoal))
+        return subgoal & ~self.goal == 0
+
+    def h_max(self, node):
+        """h_max of the subgoal, from the costs of all fluents from the initial state,
+        computed once."""
+        cost = self.initial_costs(max)
+        return max((cost.get(f, np.inf) for f in self.grounded.bits(node.state)), default=0)
+
+    def h_add(self, node):
+        cost = self.initial_costs(operator.add)
+        return sum(cost.get(f, np.inf) for f in self.grounded.bits(node.state))
+
+    def initial_costs(self, combine):
+        if combine not in self.costs:
+            self.costs[combine], _ = self.grounded.relaxed_costs(self.grounded.initial,
+                                                                 combine=combine, all_fluents=True)
+        return self.costs[combine]
 
     def h(self, subgoal):
         """
@@ -639,16 +913,40 @@ class BackwardPlan(search.Problem):
         by removing the delete lists from all actions, i.e. removing all negative literals from effects) that will be
         easier to solve through GraphPlan and where the length of the solution will serve as a good heuristic.
         """
-        relaxed_planning_problem = PlanningProblem(initial=self.goal,
-                                                   goals=subgoal.state,
-                                                   actions=[action.relaxed() for action in
-                                                            self.planning_problem.actions])
+        relaxed_planning_problem = PlanningProblem(
+            initial=associate('&', self.planning_problem.initial),
+            goals=associate('&', self.grounded.decode(subgoal.state)),
+            actions=[action.relaxed() for action in self.planning_problem.actions])
+        if self.relaxed is None:
+            self.relaxed = GroundedPlanningProblem(relaxed_planning_problem)
         try:
-            return len(linearize(GraphPlan(relaxed_planning_problem).execute()))
+            return len(linearize(GraphPlan(relaxed_planning_problem, self.relaxed).execute()))
         except:
             return np.inf
 
 
+def compare_heuristics(problems=None, heuristics=('h_max', 'h_add', 'h_ff')):
+    """Print, for each heuristic of ForwardPlan, the length of the plan found by A*, the number
+    of nodes expanded, the time in seconds and the nodes expanded per second on each of the
+    problems, a dict {name: planning problem}. Add 'h' to the heuristics to compare with the
+    GraphPlan-based one, which is only practical on the smallest problems."""
+    if problems is None:
+        problems = {'air_cargo': air_cargo(), 'three_block_tower': three_block_tower(),
+                    'blocks_world(5)': blocks_world(5), 'blocks_world(6)': blocks_world(6)}
+
+    def do(heuristic, planning_problem):
+        problem = search.InstrumentedProblem(ForwardPlan(planning_problem))
+        start = time.perf_counter()
+        solution = search.astar_search(problem, h=getattr(problem.problem, heuristic)).solution()
+        elapsed = time.perf_counter() - start
+        return '{}/{}/{:.2f}s/{:.0f}'.format(len(solution), problem.succs, elapsed,
+                                             problem.succs / elapsed)
+
+    table = [[heuristic] + [do(heuristic, p) for p in problems.values()]
+             for heuristic in heuristics]
+    print_table(table, header=['Heuristic (length/expanded/time/per s)'] + list(problems))
+
+
 def CSPlan(planning_problem, solution_length, CSP_solver=ac_search_solver, arc_heuristic=sat_up):
     """
     [Section 10.4.3]
@@ -723,10 +1021,11 @@ def CSPlan(planning_problem, solution_length, CSP_solver=ac_search_solver, arc_h
             return [sol[a] for a in act_vars]
 
 
-def SATPlan(planning_problem, solution_length, SAT_solver=cdcl_satisfiable):
+def SATPlan(planning_problem, solution_length, SAT_solver=None, processes=None):
     """
     [Section 10.4.1]
-    Planning as Boolean satisfiability
+    Planning as Boolean satisfiability, trying the horizons up to solution_length
+    with one incremental solver, or concurrently in a pool of processes
     """
 
     def expand_transitions(state, actions):
@@ -746,170 +1045,212 @@ def SATPlan(planning_problem, solution_length, SAT_solver=cdcl_satisfiable):
     expand_transitions(associate('&', planning_problem.initial), planning_problem.expand_actions())
 
     return SAT_plan(associate('&', sorted(planning_problem.initial)), transition,
-                    associate('&', sorted(planning_problem.goals)), solution_length, SAT_solver=SAT_solver)
+                    associate('&', sorted(planning_problem.goals)), solution_length,
+                    SAT_solver=SAT_solver, processes=processes)
 
 
 class Level:
     """
-    Contains the state of the planning problem
-    and exhaustive list of actions which use the
-    states as pre-condition.
+    A level of the planning graph: a layer of literals, a bitset over the fluents of the
+    GroundedPlanningProblem of the graph, with the mutex relation between them stored as
+    one adjacency bitset per literal; once called, the level also holds the layer of the
+    actions applicable in it, persistence actions included, and the mutex relation between
+    those actions, stored the same way.
     """
 
-    def __init__(self, kb):
+    def __init__(self, graph, state, mutex):
         """Initializes variables to hold state and action details of a level"""
 
-        self.kb = kb
+        self.graph = graph
         # current state
-        self.current_state = kb.clauses
-        # current action to state link
-        self.current_action_links = {}
-        # current state to action link
-        self.current_state_links = {}
-        # current action to next state link
-        self.next_action_links = {}
-        # next state to current action link
-        self.next_state_links = {}
-        # mutually exclusive actions
-        self.mutex = []
-
-    def __call__(self, actions, objects):
-        self.build(actions, objects)
+        self.state = state
+        self.current_state = graph.grounded.decode(state)
+        # mutually exclusive literals: fluent -> bitset of the fluents mutex with it
+        self.mutex = mutex
+        # actions of the layer, as a list and as a bitset
+        self.actions = []
+        self.layer = 0
+        # next state literal -> bitset of the actions adding it
+        self.achievers = {}
+        # mutually exclusive actions: action -> bitset of the actions mutex with it
+        self.action_mutex = {}
+        # mutually exclusive literals of the next level
+        self.next_mutex = {}
+
+    def __call__(self):
+        self.build()
         self.find_mutex()
 
-    def separate(self, e):
-        """Separates an iterable of elements into positive and negative parts"""
+    def non_mutex(self, literals):
+        """Checks whether no two literals of a bitset are mutually exclusive"""
 
-        positive = []
-        negative = []
-        for clause in e:
-            if clause.op[:3] == 'Not':
-                negative.append(clause)
-            else:
-                positive.append(clause)
-        return positive, negative
+        return not any(self.mutex.get(f, 0) & literals for f in self.graph.bits(literals))
+
+    def build(self):
+        """Finds the actions whose preconditions are in the state and not mutually exclusive"""
+
+        graph = self.graph
+        persistence = [graph.persist + f for f in graph.bits(self.state)]
+        candidates = graph.grounded.applicable(self.state) + persistence
+        for a in candidates:
+            if self.non_mutex(graph.pre[a]):
+                self.actions.append(a)
+                self.layer |= 1 << a
+                for f in graph.bits(graph.add[a]):
+                    self.achievers[f] = self.achievers.get(f, 0) | 1 << a
 
     def find_mutex(self):
-        """Finds mutually exclusive actions"""
-
-        # Inconsistent effects
-        pos_nsl, neg_nsl = self.separate(self.next_state_links)
-
-        for negeff in neg_nsl:
-            new_negeff = Expr(negeff.op[3:], *negeff.args)
-            for poseff in pos_nsl:
-                if new_negeff == poseff:
-                    for a in self.next_state_links[poseff]:
-                        for b in self.next_state_links[negeff]:
-                            if {a, b} not in self.mutex:
-                                self.mutex.append({a, b})
-
-        # Interference will be calculated with the last step
-        pos_csl, neg_csl = self.separate(self.current_state_links)
-
-        # Competing needs
-        for pos_precond in pos_csl:
-            for neg_precond in neg_csl:
-                new_neg_precond = Expr(neg_precond.op[3:], *neg_precond.args)
-                if new_neg_precond == pos_precond:
-                    for a in self.current_state_links[pos_precond]:
-                        for b in self.current_state_links[neg_precond]:
-                            if {a, b} not in self.mutex:
-                                self.mutex.append({a, b})
-
-        # Inconsistent support
-        state_mutex = []
-        for pair in self.mutex:
-            next_state_0 = self.next_action_links[list(pair)[0]]
-            if len(pair) == 2:
-                next_state_1 = self.next_action_links[list(pair)[1]]
-            else:
-                next_state_1 = self.next_action_links[list(pair)[0]]
-            if (len(next_state_0) == 1) and (len(next_state_1) == 1):
-                state_mutex.append({next_state_0[0], next_state_1[0]})
+        """Finds mutually exclusive actions, then the mutually exclusive literals
+        of the next level"""
+
+        graph = self.graph
+        needers = defaultdict(int)
+        deleters = defaultdict(int)
+        for a in self.actions:
+            for f in graph.bits(graph.pre[a]):
+                needers[f] |= 1 << a
+            for f in graph.bits(graph.delete[a]):
+                deleters[f] |= 1 << a
+
+        # Actions needing a literal mutex with f
+        competing = {}
+        for f in graph.bits(self.state):
+            competing[f] = 0
+            for g in graph.bits(self.mutex.get(f, 0)):
+                competing[f] |= needers[g]
+
+        for a in self.actions:
+            m = 0
+            # Inconsistent effects and interference
+            for f in graph.bits(graph.add[a] | graph.pre[a]):
+                m |= deleters[f]
+            for f in graph.bits(graph.delete[a]):
+                m |= self.achievers.get(f, 0) | needers[f]
+            # Competing needs
+            for f in graph.bits(graph.pre[a]):
+                m |= competing[f]
+            self.action_mutex[a] = m & ~(1 << a)
+
+        # Inconsistent support: two literals are mutex unless some achiever of the one
+        # is compatible with some achiever of the other
+        supported = {}
+        for a in self.actions:
+            s = 0
+            for b in graph.bits(self.layer & ~self.action_mutex[a]):
+                s |= graph.add[b]
+            supported[a] = s
+        next_state = self.next_state()
+        for f, achievers in self.achievers.items():
+            s = 0
+            for a in graph.bits(achievers):
+                s |= supported[a]
+            self.next_mutex[f] = next_state & (~s | graph.negation[f])
+
+    def next_state(self):
+        state = 0
+        for f in self.achievers:
+            state |= 1 << f
+        return state
 
-        self.mutex = self.mutex + state_mutex
+    @property
+    def kb(self):
+        """The literals of the level, as a FolKB"""
 
-    def build(self, actions, objects):
-        """Populates the lists and dictionaries containing the state action dependencies"""
+        return FolKB(self.current_state)
 
-        for clause in self.current_state:
-            p_expr = Expr('P' + clause.op, *clause.args)
-            self.current_action_links[p_expr] = [clause]
-            self.next_action_links[p_expr] = [clause]
-            self.current_state_links[clause] = [p_expr]
-            self.next_state_links[clause] = [p_expr]
+    @property
+    def current_action_links(self):
+        """Links from each action of the layer to its preconditions"""
 
-        for a in actions:
-            num_args = len(a.args)
-            possible_args = tuple(itertools.permutations(objects, num_args))
-
-            for arg in possible_args:
-                if a.check_precond(self.kb, arg):
-                    for num, symbol in enumerate(a.args):
-                        if not symbol.op.islower():
-                            arg = list(arg)
-                            arg[num] = symbol
-                            arg = tuple(arg)
-
-                    new_action = a.substitute(Expr(a.name, *a.args), arg)
-                    self.current_action_links[new_action] = []
-
-                    for clause in a.precond:
-                        new_clause = a.substitute(clause, arg)
-                        self.current_action_links[new_action].append(new_clause)
-                        if new_clause in self.current_state_links:
-                            self.current_state_links[new_clause].append(new_action)
-                        else:
-                            self.current_state_links[new_clause] = [new_action]
+        graph = self.graph
+        return {graph.names[a]: graph.grounded.decode(graph.pre[a]) for a in self.actions}
 
-                    self.next_action_links[new_action] = []
-                    for clause in a.effect:
-                        new_clause = a.substitute(clause, arg)
+    @property
+    def current_state_links(self):
+        """Links from each literal of the level to the actions of the layer needing it"""
 
-                        self.next_action_links[new_action].append(new_clause)
-                        if new_clause in self.next_state_links:
-                            self.next_state_links[new_clause].append(new_action)
-                        else:
-                            self.next_state_links[new_clause] = [new_action]
+        graph = self.graph
+        links = {literal: [] for literal in self.current_state}
+        for a in self.actions:
+            for literal in graph.grounded.decode(graph.pre[a]):
+                links[literal].append(graph.names[a])
+        return links
+
+    @property
+    def next_action_links(self):
+        """Links from each action of the layer to its effects"""
+
+        graph = self.graph
+        return {graph.names[a]: graph.grounded.decode(graph.add[a]) for a in self.actions}
+
+    @property
+    def next_state_links(self):
+        """Links from each literal of the next level to the actions of the layer achieving it"""
+
+        graph = self.graph
+        return {graph.grounded.fluents[f]: [graph.names[a] for a in graph.bits(achievers)]
+                for f, achievers in self.achievers.items()}
 
     def perform_actions(self):
         """Performs the necessary actions and returns a new Level"""
 
-        new_kb = FolKB(list(set(self.next_state_links.keys())))
-        return Level(new_kb)
+        return Level(self.graph, self.next_state(), self.next_mutex)
 
 
 class Graph:
     """
     Contains levels of state and actions
-    Used in graph planning algorithm to extract a solution
+    Used in graph planning algorithm to extract a solution.
+    Actions are numbered as in the GroundedPlanningProblem of the planning problem,
+    followed by one persistence action per fluent. A GroundedPlanningProblem with the
+    same actions can be given, to be reused across problems differing by their initial
+    state and goals.
     """
 
-    def __init__(self, planning_problem):
+    bits = staticmethod(GroundedPlanningProblem.bits)
+
+    def __init__(self, planning_problem, grounded=None):
         self.planning_problem = planning_problem
-        self.kb = FolKB(planning_problem.initial)
-        self.levels = [Level(self.kb)]
-        self.objects = set(arg for clause in self.kb.clauses for arg in clause.args)
+        if grounded is None:
+            grounded = GroundedPlanningProblem(planning_problem)
+        self.grounded = grounded
+        initial = grounded.mask(planning_problem.initial)
+        self.goals = grounded.mask(planning_problem.goals)
+        self.persist = len(grounded.actions)
+        self.names = ([Expr(action.name, *action.args) for action in grounded.actions] +
+                      [Expr('P' + f.op, *f.args) for f in grounded.fluents])
+        self.pre = grounded.pre + [1 << f for f in range(len(grounded.fluents))]
+        self.add = grounded.add + self.pre[self.persist:]
+        self.delete = grounded.delete + [0] * len(grounded.fluents)
+        self.negation = [grounded.ids.get(grounded.complement(f)) for f in grounded.fluents]
+        self.negation = [0 if f is None else 1 << f for f in self.negation]
+        mutex = {f: initial & self.negation[f] for f in self.bits(initial)}
+        self.levels = [Level(self, initial, mutex)]
 
     def __call__(self):
         self.expand_graph()
 
+    @property
+    def kb(self):
+        """The initial state, as a FolKB"""
+
+        return self.levels[0].kb
+
+    @property
+    def objects(self):
+        return set(arg for clause in self.planning_problem.initial for arg in clause.args)
+
     def expand_graph(self):
         """Expands the graph by a level"""
 
         last_level = self.levels[-1]
-        last_level(self.planning_problem.actions, self.objects)
+        last_level()
         self.levels.append(last_level.perform_actions())
 
     def non_mutex_goals(self, goals, index):
-        """Checks whether the goals are mutually exclusive"""
+        """Checks whether the goals (a bitset) are mutually exclusive"""
 
-        goal_perm = itertools.combinations(goals, 2)
-        for g in goal_perm:
-            if set(g) in self.levels[index].mutex:
-                return False
-        return True
+        return self.levels[index].non_mutex(goals)
 
 
 class GraphPlan:
@@ -919,94 +1260,102 @@ class GraphPlan:
     Returns solution for the planning problem
     """
 
-    def __init__(self, planning_problem):
-        self.graph = Graph(planning_problem)
-        self.no_goods = []
+    def __init__(self, planning_problem, grounded=None):
+        self.graph = Graph(planning_problem, grounded)
+        # (level index, goals bitset) known not to be achievable
+        self.no_goods = set()
         self.solution = []
 
     def check_leveloff(self):
         """Checks if the graph has levelled off"""
 
-        check = (set(self.graph.levels[-1].current_state) == set(self.graph.levels[-2].current_state))
-
-        if check:
-            return True
+        last, previous = self.graph.levels[-1], self.graph.levels[-2]
+        return last.state == previous.state and last.mutex == previous.mutex
 
     def extract_solution(self, goals, index):
-        """Extracts the solution"""
-
-        level = self.graph.levels[index]
-        if not self.graph.non_mutex_goals(goals, index):
-            self.no_goods.append((level, goals))
-            return
-
-        level = self.graph.levels[index - 1]
-
-        # Create all combinations of actions that satisfy the goal
-        actions = []
-        for goal in goals:
-            actions.append(level.next_state_links[goal])
-
-        all_actions = list(itertools.product(*actions))
-
-        # Filter out non-mutex actions
-        non_mutex_actions = []
-        for action_tuple in all_actions:
-            action_pairs = itertools.combinations(list(set(action_tuple)), 2)
-            non_mutex_actions.append(list(set(action_tuple)))
-            for pair in action_pairs:
-                if set(pair) in level.mutex:
-                    non_mutex_actions.pop(-1)
-                    break
-
-        # Recursion
-        for action_list in non_mutex_actions:
-            if [action_list, index] not in self.solution:
-                self.solution.append([action_list, index])
-
-                new_goals = []
-                for act in set(action_list):
-                    if act in level.current_action_links:
-                        new_goals = new_goals + level.current_action_links[act]
+        """
+        Extracts a solution achieving the goals (a bitset) at the level of the given index,
+        as the list of the sets (bitsets) of actions of the levels before it, or None.
+        """
 
-                if abs(index) + 1 == len(self.graph.levels):
-                    return
-                elif (level, new_goals) in self.no_goods:
-                    return
-                else:
-                    self.extract_solution(new_goals, index - 1)
+        return next(self.extract_solutions(goals, index), None)
 
-        # Level-Order multiple solutions
-        solution = []
-        for item in self.solution:
-            if item[1] == -1:
-                solution.append([])
-                solution[-1].append(item[0])
-            else:
-                solution[-1].append(item[0])
+    def extract_solutions(self, goals, index):
+        """
+        Yields the solutions achieving the goals (a bitset) at the level of the given index,
+        each as the list of the sets (bitsets) of actions of the levels before it.
+        The goals are given achievers by backtracking, and the sets of goals with no
+        solution are stored in the no-goods table.
+        """
 
-        for num, item in enumerate(solution):
-            item.reverse()
-            solution[num] = item
+        if index == 0:
+            yield []
+            return
+        if (index, goals) in self.no_goods:
+            return
+        found = False
+        if self.graph.non_mutex_goals(goals, index):
+            level = self.graph.levels[index - 1]
+            for actions in self.assign(level, goals, 0, 0):
+                subgoals = 0
+                for a in self.graph.bits(actions):
+                    subgoals |= self.graph.pre[a]
+                for solution in self.extract_solutions(subgoals, index - 1):
+                    found = True
+                    yield solution + [actions]
+        if not found:
+            self.no_goods.add((index, goals))
+
+    def assign(self, level, goals, actions, excluded):
+        """
+        Yields the sets of pairwise non mutex actions of the level achieving the goals,
+        choosing first an achiever of the goal with the fewest left, and preferring
+        persistence actions.
+        """
 
-        return solution
+        if not goals:
+            yield actions
+            return
+        options = {g: level.achievers.get(g, 0) & ~excluded for g in self.graph.bits(goals)}
+        goal = min(options, key=lambda g: bin(options[g]).count('1'))
+        for a in sorted(self.graph.bits(options[goal]), reverse=True):
+            yield from self.assign(level, goals & ~self.graph.add[a], actions | 1 << a,
+                                   excluded | level.action_mutex[a])
 
-    def goal_test(self, kb):
-        return all(kb.ask(q) is not False for q in self.graph.planning_problem.goals)
+    def goal_test(self, level):
+        goals = self.graph.goals
+        return goals & ~level.state == 0 and level.non_mutex(goals)
 
-    def execute(self):
-        """Executes the GraphPlan algorithm for the given problem"""
+    def execute(self, solutions=1):
+        """
+        Executes the GraphPlan algorithm for the given problem. Returns a list of up to
+        the given number of solutions with the fewest levels, each a list of the lists of
+        actions of its levels, persistence actions included, or None if there is none.
+        """
 
+        goals = self.graph.goals
+        no_goods = None
         while True:
             self.graph.expand_graph()
-            if (self.goal_test(self.graph.levels[-1].kb) and self.graph.non_mutex_goals(
-                    self.graph.planning_problem.goals, -1)):
-                solution = self.extract_solution(self.graph.planning_problem.goals, -1)
-                if solution:
-                    return solution
-
-            if len(self.graph.levels) >= 2 and self.check_leveloff():
-                return None
+            index = len(self.graph.levels) - 1
+            if self.goal_test(self.graph.levels[-1]):
+                found = list(itertools.islice(self.extract_solutions(goals, index), solutions))
+                if found:
+                    names = self.graph.names
+                    found = [[[names[a] for a in self.graph.bits(actions)] for actions in solution]
+                             for solution in found]
+                    self.solution = found[0]
+                    return found
+
+            if self.check_leveloff():
+                # Once the graph has levelled off, no solution exists if the goals are not
+                # in it, or if the no-goods of its last level stop changing
+                if not self.goal_test(self.graph.levels[-1]):
+                    return None
+                count = sum(1 for level, _ in self.no_goods if level == index - 1)
+                if count == no_goods:
+                    return None
+                no_goods = count
 
 
 class Linearize:
@@ -1071,6 +1420,41 @@ def linearize(solution):
     return linear_solution
 
 
+class OrderingConstraints(frozenset):
+    """
+    A set of ordering constraints (a, b), meaning that action a comes before action b,
+    kept with its transitive closure: before[x] and after[x] are the sets of the actions
+    that must come before and after x. Adding a constraint makes a new set, with its own
+    closure, and leaves this one as it is.
+    """
+
+    def __new__(cls, constraints=()):
+        self = super().__new__(cls, constraints)
+        self.before, self.after = defaultdict(set), defaultdict(set)
+        for a, b in self:
+            self.close(a, b)
+        return self
+
+    def close(self, a, b):
+        """Update the transitive closure with a < b"""
+
+        if b not in self.after[a]:
+            before, after = self.before[a] | {a}, self.after[b] | {b}
+            for x in before:
+                self.after[x] |= after
+            for y in after:
+                self.before[y] |= before
+
+    def add(self, a, b):
+        """Return these constraints with a < b"""
+
+        constraints = frozenset.__new__(OrderingConstraints, self | {(a, b)})
+        constraints.before = defaultdict(set, {x: set(before) for x, before in self.before.items()})
+        constraints.after = defaultdict(set, {x: set(after) for x, after in self.after.items()})
+        constraints.close(a, b)
+        return constraints
+
+
 class PartialOrderPlanner:
     """
     [Section 10.13] PARTIAL-ORDER-PLANNER
@@ -1092,58 +1476,77 @@ class PartialOrderPlanner:
        demotion. If promotion or demotion is unable to solve the problem, the planning problem cannot be solved with
        the current sequence of actions or it may not be solvable at all.
     9. These steps are repeated until the set of open preconditions is empty.
+
+    The orderings are kept with their transitive closure, as OrderingConstraints, so that a new
+    constraint is checked for cycles by a lookup instead of a graph search. Causal links are
+    indexed by the literal they protect, and the actions of the plan as well as the expanded
+    actions by the literals they achieve, so that only the affected links and actions are
+    checked for threats.
     """
 
+    complement = staticmethod(GroundedPlanningProblem.complement)
+
     def __init__(self, planning_problem):
         self.tries = 1
         self.planning_problem = planning_problem
         self.causal_links = []
+        self.links_by_literal = defaultdict(list)
         self.start = Action('Start', [], self.planning_problem.initial)
         self.finish = Action('Finish', self.planning_problem.goals, [])
         self.actions = set()
-        self.actions.add(self.start)
-        self.actions.add(self.finish)
-        self.constraints = set()
-        self.constraints.add((self.start, self.finish))
+        self.achieved_by = defaultdict(list)  # literal: actions of the plan achieving it
+        self.add_action(self.start)
+        self.add_action(self.finish)
+        self.constraints = self.add_const((self.start, self.finish), OrderingConstraints())
         self.agenda = set()
         for precond in self.finish.precond:
             self.agenda.add((precond, self.finish))
         self.expanded_actions = planning_problem.expand_actions()
+        self.achievers = defaultdict(list)  # literal: expanded actions achieving it
+        for action in self.expanded_actions:
+            for effect in action.effect:
+                self.achievers[effect].append(action)
+
+    @property
+    def before(self):
+        """The actions that must come before each action, under the current constraints"""
+        return self.constraints.before
+
+    @property
+    def after(self):
+        """The actions that must come after each action, under the current constraints"""
+        return self.constraints.after
+
+    def add_action(self, action):
+        """Add an action to the plan, indexed by the literals it achieves"""
+
+        if action not in self.actions:
+            self.actions.add(action)
+            for effect in action.effect:
+                self.achieved_by[effect].append(action)
 
     def find_open_precondition(self):
-        """Find open precondition with the least number of possible actions"""
+        """Find open precondition with the least number of possible actions, or None if one of
+        the open preconditions has no possible action"""
 
         number_of_ways = dict()
-        actions_for_precondition = dict()
-        for element in self.agenda:
-            open_precondition = element[0]
-            possible_actions = list(self.actions) + self.expanded_actions
-            for action in possible_actions:
-                for effect in action.effect:
-                    if effect == open_precondition:
-                        if open_precondition in number_of_ways:
-                            number_of_ways[open_precondition] += 1
-                            actions_for_precondition[open_precondition].append(action)
-                        else:
-                            number_of_ways[open_precondition] = 1
-                            actions_for_precondition[open_precondition] = [action]
-
-        number = sorted(number_of_ways, key=number_of_ways.__getitem__)
+        for open_precondition, _ in self.agenda:
+            ways = len(self.achieved_by[open_precondition]) + len(self.achievers[open_precondition])
+            if not ways:
+                return None, None, []
+            number_of_ways[open_precondition] = ways
 
-        for k, v in number_of_ways.items():
-            if v == 0:
-                return None, None, None
+        # ties are broken by name, not to depend on the order of the agenda
+        number = sorted(number_of_ways,
+                        key=lambda precondition: (number_of_ways[precondition], str(precondition)))
 
         act1 = None
-        for element in self.agenda:
+        for element in sorted(self.agenda, key=str):
             if element[0] == number[0]:
                 act1 = element[1]
                 break
 
-        if number[0] in self.expanded_actions:
-            self.expanded_actions.remove(number[0])
-
-        return number[0], act1, actions_for_precondition[number[0]]
+        return number[0], act1, self.achieved_by[number[0]] + self.achievers[number[0]]
 
     def find_action_for_precondition(self, oprec):
         """Find action for a given precondition"""
@@ -1223,18 +1626,22 @@ class PartialOrderPlanner:
         value = any(visit(v) for v in new_graph)
         return value
 
-    def add_const(self, constraint, constraints):
-        """Add the constraint to constraints if the resulting graph is acyclic"""
+    def can_order(self, a, b, constraints=None):
+        """Check if a < b can be added to the constraints (by default the current ones)
+        without making them cyclic"""
 
-        if constraint[0] == self.finish or constraint[1] == self.start:
-            return constraints
+        constraints = self.constraints if constraints is None else constraints
+        return a != self.finish and b != self.start and a != b and a not in constraints.after[b]
 
-        new_constraints = set(constraints)
-        new_constraints.add(constraint)
+    def add_const(self, constraint, constraints):
+        """Return the constraints with constraint added if the resulting graph is acyclic,
+        and otherwise constraints"""
 
-        if self.cyclic(new_constraints):
+        if not isinstance(constraints, OrderingConstraints):
+            constraints = OrderingConstraints(constraints)
+        if not self.can_order(*constraint, constraints):
             return constraints
-        return new_constraints
+        return constraints.add(*constraint)
 
     def is_a_threat(self, precondition, effect):
         """Check if effect is a threat to precondition"""
@@ -1245,7 +1652,14 @@ class PartialOrderPlanner:
         return False
 
     def protect(self, causal_link, action, constraints):
-        """Check and resolve threats by promotion or demotion"""
+        """Check and resolve threats by promotion or demotion; return the constraints
+        that resolve the threat of action to causal_link, or None if it can not be resolved"""
+
+        return next(self.protections(causal_link, action, constraints), None)
+
+    def protections(self, causal_link, action, constraints):
+        """Yield the constraints resolving the threat of action to causal_link, by promotion
+        and then by demotion, or the constraints as they are if there is no threat"""
 
         threat = False
         for effect in action.effect:
@@ -1253,23 +1667,56 @@ class PartialOrderPlanner:
                 threat = True
                 break
 
-        if action != causal_link[0] and action != causal_link[2] and threat:
-            # try promotion
-            new_constraints = set(constraints)
-            new_constraints.add((action, causal_link[0]))
-            if not self.cyclic(new_constraints):
-                constraints = self.add_const((action, causal_link[0]), constraints)
-            else:
-                # try demotion
-                new_constraints = set(constraints)
-                new_constraints.add((causal_link[2], action))
-                if not self.cyclic(new_constraints):
-                    constraints = self.add_const((causal_link[2], action), constraints)
-                else:
-                    # both promotion and demotion fail
-                    print('Unable to resolve a threat caused by', action, 'onto', causal_link)
-                    return
-        return constraints
+        if action == causal_link[0] or action == causal_link[2] or not threat:
+            yield constraints
+            return
+        # try promotion
+        if self.can_order(action, causal_link[0], constraints):
+            yield self.add_const((action, causal_link[0]), constraints)
+        # try demotion
+        if self.can_order(causal_link[2], action, constraints):
+            yield self.add_const((causal_link[2], action), constraints)
+
+    def link_constraints(self, act0, G, act1):
+        """Return the constraints with act0 in the plan, achieving G for act1 through the
+        causal link <act0, G, act1>, and with every threat to the causal links resolved,
+        or None if a causal link would be clobbered"""
+
+        return next(self.link_options(act0, G, act1), None)
+
+    def link_options(self, act0, G, act1):
+        """Yield every set of constraints with act0 in the plan, achieving G for act1 through
+        the causal link <act0, G, act1>, and with every threat to the causal links resolved"""
+
+        # Constraints = add_const(start < act0, Constraints)
+        constraints = self.add_const((self.start, act0), self.constraints)
+
+        # Constraints = add_const(act0 < act1, Constraints)
+        if not self.can_order(act0, act1, constraints):
+            return
+        constraints = self.add_const((act0, act1), constraints)
+
+        # for each CL E CausalLinks do
+        #   Constraints = protect(CL, act0, Constraints)
+        # only the causal links protecting the complement of an effect of act0 are threatened
+        threats = [(causal_link, act0) for effect in act0.effect
+                   for causal_link in self.links_by_literal[self.complement(effect)]]
+
+        # for each A E Actions do
+        #   Constraints = protect(<act0, G, act1>, A, Constraints)
+        # only the actions achieving the complement of G threaten it
+        threats += [((act0, G, act1), action) for action in self.achieved_by[self.complement(G)]]
+        yield from self.resolve_threats(threats, constraints)
+
+    def resolve_threats(self, threats, constraints):
+        """Yield the constraints resolving all the threats, pairs of a causal link and an action"""
+
+        if not threats:
+            yield constraints
+            return
+        (causal_link, action), rest = threats[0], threats[1:]
+        for protected in self.protections(causal_link, action, constraints):
+            yield from self.resolve_threats(rest, protected)
 
     def convert(self, constraints):
         """Convert constraints into a dict of Action to set orderings"""
@@ -1322,62 +1769,194 @@ class PartialOrderPlanner:
         print('\nPartial Order Plan')
         print(list(reversed(list(self.toposort(self.convert(self.constraints))))))
 
-    def execute(self, display=True):
-        """Execute the algorithm"""
+    def execute(self, display=True, max_steps=1000):
+        """Execute the algorithm, backtracking over the achievers of the open preconditions,
+        and return the constraints and the causal links of a complete plan, or (None, None)
+        if there is none within max_steps refinements"""
 
-        step = 1
-        while len(self.agenda) > 0:
-            step += 1
-            # select <G, act1> from Agenda
-            try:
-                G, act1, possible_actions = self.find_open_precondition()
-            except IndexError:
-                print('Probably Wrong')
-                break
+        self.steps = 0
+        if not self.refine(max_steps):
+            return None, None
 
-            act0 = possible_actions[0]
-            # remove <G, act1> from Agenda
-            self.agenda.remove((G, act1))
+        if display:
+            self.display_plan()
+        else:
+            return self.constraints, self.causal_links
 
-            # For actions with variable number of arguments, use least commitment principle
-            # act0_temp, bindings = self.find_action_for_precondition(G)
-            # act0 = self.generate_action_object(act0_temp, bindings)
+    def refine(self, max_steps):
+        """Close the open preconditions of the agenda one at a time, trying every achiever
+        of each; return True once the agenda is empty, or restore the plan and return False"""
 
-            # Actions = Actions U {act0}
-            self.actions.add(act0)
+        if not self.agenda:
+            return True
+        if self.steps >= max_steps:
+            return False
+        self.steps += 1
+        # select <G, act1> from Agenda
+        G, act1, possible_actions = self.find_open_precondition()
+        if G is None:
+            # an open precondition has no achiever
+            return False
 
-            # Constraints = add_const(start < act0, Constraints)
-            self.constraints = self.add_const((self.start, act0), self.constraints)
+        # For actions with variable number of arguments, use least commitment principle
+        # act0_temp, bindings = self.find_action_for_precondition(G)
+        # act0 = self.generate_action_object(act0_temp, bindings)
 
-            # for each CL E CausalLinks do
-            #   Constraints = protect(CL, act0, Constraints)
-            for causal_link in self.causal_links:
-                self.constraints = self.protect(causal_link, act0, self.constraints)
+        # try first the achievers already in the plan, then the ones which can still be
+        # ordered before act1
+        possible_actions = sorted(possible_actions,
+                                  key=lambda action: (action not in self.actions,
+                                                      not self.can_order(action, act1)))
+        for act0, constraints in ((act0, constraints) for act0 in possible_actions
+                                  for constraints in self.link_options(act0, G, act1)):
+            saved = self.save()
 
-            # Agenda = Agenda U {<P, act0>: P is a precondition of act0}
-            for precondition in act0.precond:
-                self.agenda.add((precondition, act0))
+            # remove <G, act1> from Agenda
+            self.agenda.remove((G, act1))
 
-            # Constraints = add_const(act0 < act1, Constraints)
-            self.constraints = self.add_const((act0, act1), self.constraints)
+            # Actions = Actions U {act0}
+            new = act0 not in self.actions
+            self.add_action(act0)
+            self.constraints = constraints
+
+            # Agenda = Agenda U {<P, act0>: P is a precondition of act0}
+            if new:
+                for precondition in act0.precond:
+                    self.agenda.add((precondition, act0))
 
             # CausalLinks U {<act0, G, act1>}
-            if (act0, G, act1) not in self.causal_links:
+            if (act0, G, act1) not in self.links_by_literal[G]:
                 self.causal_links.append((act0, G, act1))
+                self.links_by_literal[G].append((act0, G, act1))
 
-            # for each A E Actions do
-            #   Constraints = protect(<act0, G, act1>, A, Constraints)
-            for action in self.actions:
-                self.constraints = self.protect((act0, G, act1), action, self.constraints)
+            if self.refine(max_steps):
+                return True
+            self.restore(saved)
+        return False
 
-            if step > 200:
-                print("Couldn't find a solution")
-                return None, None
+    def save(self):
+        """A copy of the plan, to backtrack to"""
 
-        if display:
-            self.display_plan()
-        else:
-            return self.constraints, self.causal_links
+        achieved_by = {f: list(actions) for f, actions in self.achieved_by.items()}
+        links_by_literal = {f: list(links) for f, links in self.links_by_literal.items()}
+        return (set(self.actions), achieved_by, self.constraints, set(self.agenda),
+                list(self.causal_links), links_by_literal)
+
+    def restore(self, saved):
+        """Restore the plan to a copy made by save"""
+
+        self.actions, achieved_by, self.constraints, self.agenda = saved[:4]
+        self.causal_links, links_by_literal = saved[4:]
+        self.achieved_by = defaultdict(list, achieved_by)
+        self.links_by_literal = defaultdict(list, links_by_literal)
+
+    def linearize(self):
+        """Return the actions of the plan, but Start and Finish, in an order consistent
+        with the constraints"""
+
+        levels = reversed(list(self.toposort(self.convert(self.constraints))))
+        return [action for level in levels for action in sorted(level, key=str)
+                if action not in (self.start, self.finish)]
+
+
+def run_planner(planner, planning_problem, trace_memory=True):
+    """
+    Run planner, a function from a planning problem to a list of actions or None, on a copy
+    of the planning problem. Return the length of the plan (None if no plan is found), the
+    time in seconds, the peak memory in KiB and the exception raised by the planner, if any.
+    The plan is checked by acting it out on another copy of the problem: a plan which does
+    not run or does not reach the goals is reported with an InvalidPlan error and no length.
+    With trace_memory, the planner is run a second time to trace its memory, so that tracing
+    does not slow down the timed run; otherwise the memory is None.
+    """
+    start = time.perf_counter()
+    try:
+        plan, error = planner(copy.deepcopy(planning_problem)), None
+    except Exception as exception:
+        plan, error = None, exception
+    elapsed = time.perf_counter() - start
+    if plan is not None:
+        error = check_plan(plan, planning_problem)
+        if error is not None:
+            plan = None
+    peak = None
+    if trace_memory and error is None:
+        tracemalloc.start()
+        try:
+            planner(copy.deepcopy(planning_problem))
+        finally:
+            peak = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+    return (None if plan is None else len(plan)), elapsed, peak, error
+
+
+class InvalidPlan(Exception):
+    """A plan which can not be executed or does not achieve the goals"""
+
+
+def check_plan(plan, planning_problem):
+    """Act out plan, a list of actions given as Exprs or Actions, on a copy of the planning
+    problem; return None if it reaches the goals, and an InvalidPlan error otherwise."""
+    problem = copy.deepcopy(planning_problem)
+    try:
+        for action in plan:
+            problem.act(action if isinstance(action, Expr) else Expr(action.name, *action.args))
+    except Exception as exception:
+        return InvalidPlan('{}: {}'.format(action, exception))
+    if not problem.goal_test():
+        return InvalidPlan('the goals are not achieved')
+    return None
+
+
+def compare_planners(generator=blocks_world, sizes=(2, 3), planners=None, max_length=8,
+                     trace_memory=True):
+    """
+    Print, for each planner, the length of its plan, its time and its peak memory on the
+    problems made by generator for each size (a tuple of arguments for generators with
+    several parameters, such as logistics), and return them in a dict {(planner, size):
+    (length, seconds, KiB, error)} of the results of run_planner, which runs each planner
+    twice unless trace_memory is false. A planner which raises an exception, or returns a
+    plan which does not run, is shown with its error rather than with a length. The default
+    planners are GraphPlan, A* on ForwardPlan with h_ff and on BackwardPlan with h_add,
+    SATPlan and CSPlan up to max_length, and the PartialOrderPlanner.
+    """
+
+    def partial_order_plan(planning_problem):
+        pop = PartialOrderPlanner(planning_problem)
+        constraints, _ = pop.execute(display=False)
+        return None if constraints is None else pop.linearize()
+
+    def astar_plan(problem, heuristic):
+        node = search.astar_search(problem, h=getattr(problem, heuristic))
+        if node is None:
+            return None
+        # backward search finds the actions from the goals to the initial state
+        return node.solution()[::-1] if isinstance(problem, BackwardPlan) else node.solution()
+
+    if planners is None:
+        planners = {'GraphPlan': lambda p: linearize(GraphPlan(p).execute()),
+                    'ForwardPlan': lambda p: astar_plan(ForwardPlan(p), 'h_ff'),
+                    'BackwardPlan': lambda p: astar_plan(BackwardPlan(p), 'h_add'),
+                    'SATPlan': lambda p: SATPlan(p, max_length),
+                    'CSPlan': lambda p: CSPlan(p, max_length),
+                    'PartialOrderPlanner': partial_order_plan}
+
+    results = {}
+    for size in sizes:
+        planning_problem = generator(*size) if isinstance(size, tuple) else generator(size)
+        for name, planner in planners.items():
+            results[name, size] = run_planner(planner, planning_problem, trace_memory)
+
+    def entry(length, seconds, kib, error):
+        if error is not None:
+            return 'error: {}'.format(type(error).__name__)
+        return '{}/{:.2f}s/{}'.format('-' if length is None else length, seconds,
+                                      '-' if kib is None else '{:.0f}KiB'.format(kib))
+
+    table = [[name] + [entry(*results[name, size]) for size in sizes] for name in planners]
+    header = ['{} (length/time/memory)'.format(generator.__name__)] + [str(size) for size in sizes]
+    print_table(table, header=header)
+    return results
 
 
 def spare_tire_graphPlan():
@@ -1397,7 +1976,7 @@ def air_cargo_graphPlan():
 
 def have_cake_and_eat_cake_too_graphPlan():
     """Solves the cake problem using GraphPlan"""
-    return [GraphPlan(have_cake_and_eat_cake_too()).execute()[1]]
+    return GraphPlan(have_cake_and_eat_cake_too()).execute()
 
 
 def shopping_graphPlan():
@@ -1523,6 +2102,11 @@ class RealWorldPlanningProblem(PlanningProblem):
             raise Exception("Action '{}' not found".format(action.name))
         self.initial = list_action.do_action(self.jobs, self.resources, self.initial, args).clauses
 
+    def schedule(self, refine=False):
+        """The start times of the actions of the jobs under the limits of the resources
+        (see schedule)"""
+        return schedule(self.jobs, self.resources, refine=refine)
+
     def refinements(self, library):  # refinements may be (multiple) HLA themselves ...
         """
         State is a Problem, containing the current state kb library is a
@@ -1576,16 +2160,21 @@ class RealWorldPlanningProblem(PlanningProblem):
         Forward Planning Search'
         The problem is a real-world problem defined by the problem class, and the hierarchy is
         a dictionary of HLA - refinements (see refinements generator for details)
+
+        The refinements of each HLA and the primitiveness of each action are computed once per
+        search, and a plan whose primitive prefix reaches the same state as an already expanded
+        plan, followed by the same remaining actions, is a duplicate and is not expanded again.
         """
         act = Node(self.initial, None, [self.actions[0]])
         frontier = deque()
         frontier.append(act)
+        refined, primitive, expanded = {}, {}, set()
         while True:
             if not frontier:
                 return None
             plan = frontier.popleft()
             # finds the first non primitive hla in plan actions
-            (hla, index) = RealWorldPlanningProblem.find_hla(plan, hierarchy)
+            (hla, index) = RealWorldPlanningProblem.find_hla(plan, hierarchy, primitive)
             prefix = plan.action[:index]
             outcome = RealWorldPlanningProblem(
                 RealWorldPlanningProblem.result(self.initial, prefix), self.goals, self.actions)
@@ -1594,7 +2183,13 @@ class RealWorldPlanningProblem(PlanningProblem):
                 if outcome.goal_test():
                     return plan.action
             else:
-                for sequence in RealWorldPlanningProblem.refinements(hla, hierarchy):  # find refinements
+                key = (frozenset(outcome.initial),
+                       RealWorldPlanningProblem.plan_signature(plan.action[index:]))
+                if key in expanded:  # duplicate of an expanded plan
+                    continue
+                expanded.add(key)
+                refinements = RealWorldPlanningProblem.cached_refinements(hla, hierarchy, refined)
+                for sequence in refinements:
                     frontier.append(Node(outcome.initial, plan, prefix + sequence + suffix))
 
     def result(state, actions):
@@ -1604,6 +2199,24 @@ class RealWorldPlanningProblem(PlanningProblem):
                 state = a(state, a.args).clauses
         return state
 
+    def cached_refinements(hla, hierarchy, refined):
+        """
+        The refinements of hla in hierarchy, computed once and kept in the dictionary refined,
+        keyed by the name of hla since that is all the refinements depend on
+        """
+        if hla.name not in refined:
+            refined[hla.name] = list(RealWorldPlanningProblem.refinements(hla, hierarchy))
+        return refined[hla.name]
+
+    def action_signature(action):
+        """A hashable signature of an action, shared by actions with the same name,
+        arguments, preconditions and effects"""
+        return type(action), action.name, action.args, tuple(action.precond), tuple(action.effect)
+
+    def plan_signature(actions):
+        """A hashable signature of a sequence of actions"""
+        return tuple(map(RealWorldPlanningProblem.action_signature, actions))
+
     def angelic_search(self, hierarchy, initial_plan):
         """
         [Figure 11.8]
@@ -1622,12 +2235,13 @@ class RealWorldPlanningProblem(PlanningProblem):
         $$: possibly add or remove
         """
         frontier = deque(initial_plan)
+        refined, primitive, expanded, memo = {}, {}, set(), {}
         while True:
             if not frontier:
                 return None
             plan = frontier.popleft()  # sequence of HLA/Angelic HLA's
-            opt_reachable_set = RealWorldPlanningProblem.reach_opt(self.initial, plan)
-            pes_reachable_set = RealWorldPlanningProblem.reach_pes(self.initial, plan)
+            opt_reachable_set = RealWorldPlanningProblem.reach_opt(self.initial, plan, memo)
+            pes_reachable_set = RealWorldPlanningProblem.reach_pes(self.initial, plan, memo)
             if self.intersects_goal(opt_reachable_set):
                 if RealWorldPlanningProblem.is_primitive(plan, hierarchy):
                     return [x for x in plan.action]
@@ -1636,12 +2250,19 @@ class RealWorldPlanningProblem(PlanningProblem):
                     final_state = guaranteed[0]  # any element of guaranteed
                     return RealWorldPlanningProblem.decompose(hierarchy, final_state, pes_reachable_set)
                 # there should be at least one HLA/AngelicHLA, otherwise plan would be primitive
-                hla, index = RealWorldPlanningProblem.find_hla(plan, hierarchy)
+                hla, index = RealWorldPlanningProblem.find_hla(plan, hierarchy, primitive)
                 prefix = plan.action[:index]
                 suffix = plan.action[index + 1:]
                 outcome = RealWorldPlanningProblem(
                     RealWorldPlanningProblem.result(self.initial, prefix), self.goals, self.actions)
-                for sequence in RealWorldPlanningProblem.refinements(hla, hierarchy):  # find refinements
+                key = (frozenset(outcome.initial),
+                       RealWorldPlanningProblem.plan_signature(plan.action[index:]),
+                       RealWorldPlanningProblem.plan_signature(plan.action_pes[index:]))
+                if key in expanded:  # duplicate of an expanded plan
+                    continue
+                expanded.add(key)
+                refinements = RealWorldPlanningProblem.cached_refinements(hla, hierarchy, refined)
+                for sequence in refinements:
                     frontier.append(
                         AngelicNode(outcome.initial, plan, prefix + sequence + suffix, prefix + sequence + suffix))
 
@@ -1653,54 +2274,76 @@ class RealWorldPlanningProblem(PlanningProblem):
                 for y in reachable_set[x]
                 if all(goal in y for goal in self.goals)]
 
-    def is_primitive(plan, library):
+    def is_primitive(plan, library, primitive=None):
         """
         checks if the hla is primitive action
+
+        primitive is an optional dictionary in which the answer for each action name is cached
         """
         for hla in plan.action:
-            indices = [i for i, x in enumerate(library['HLA']) if expr(x).op == hla.name]
-            for i in indices:
-                if library["steps"][i]:
+            if primitive is not None and hla.name in primitive:
+                if not primitive[hla.name]:
                     return False
+                continue
+            indices = [i for i, x in enumerate(library['HLA']) if expr(x).op == hla.name]
+            is_primitive = not any(library["steps"][i] for i in indices)
+            if primitive is not None:
+                primitive[hla.name] = is_primitive
+            if not is_primitive:
+                return False
         return True
 
-    def reach_opt(init, plan):
+    def reach_opt(init, plan, memo=None):
         """
         Finds the optimistic reachable set of the sequence of actions in plan
         """
         reachable_set = {0: [init]}
         optimistic_description = plan.action  # list of angelic actions with optimistic description
-        return RealWorldPlanningProblem.find_reachable_set(reachable_set, optimistic_description)
+        return RealWorldPlanningProblem.find_reachable_set(reachable_set, optimistic_description,
+                                                           memo)
 
-    def reach_pes(init, plan):
+    def reach_pes(init, plan, memo=None):
         """
         Finds the pessimistic reachable set of the sequence of actions in plan
         """
         reachable_set = {0: [init]}
         pessimistic_description = plan.action_pes  # list of angelic actions with pessimistic description
-        return RealWorldPlanningProblem.find_reachable_set(reachable_set, pessimistic_description)
+        return RealWorldPlanningProblem.find_reachable_set(reachable_set, pessimistic_description,
+                                                           memo)
 
-    def find_reachable_set(reachable_set, action_description):
+    def find_reachable_set(reachable_set, action_description, memo=None):
         """
         Finds the reachable states of the action_description when applied in each state of reachable set.
+
+        memo is an optional dictionary shared between calls, in which the HLAs of each angelic HLA
+        and the outcome of each action in each state are cached, keyed by the signatures of the
+        action and of the state.
         """
+        if memo is None:
+            memo = {}
         for i in range(len(action_description)):
             reachable_set[i + 1] = []
             if type(action_description[i]) is AngelicHLA:
-                possible_actions = action_description[i].angelic_action()
+                key = RealWorldPlanningProblem.action_signature(action_description[i])
+                if key not in memo:
+                    memo[key] = action_description[i].angelic_action()
+                possible_actions = memo[key]
             else:
                 possible_actions = action_description
             for action in possible_actions:
+                signature = RealWorldPlanningProblem.action_signature(action)
                 for state in reachable_set[i]:
-                    if action.check_precond(state, action.args):
-                        if action.effect[0]:
-                            new_state = action(state, action.args).clauses
-                            reachable_set[i + 1].append(new_state)
-                        else:
-                            reachable_set[i + 1].append(state)
+                    key = (signature, frozenset(state))
+                    if key not in memo:
+                        memo[key] = None
+                        if action.check_precond(state, action.args):
+                            memo[key] = (action(state, action.args).clauses if action.effect[0]
+                                         else state)
+                    if memo[key] is not None:
+                        reachable_set[i + 1].append(memo[key])
         return reachable_set
 
-    def find_hla(plan, hierarchy):
+    def find_hla(plan, hierarchy, primitive=None):
         """
         Finds the the first HLA action in plan.action, which is not primitive
         and its corresponding index in plan.action
@@ -1708,7 +2351,8 @@ class RealWorldPlanningProblem(PlanningProblem):
         hla = None
         index = len(plan.action)
         for i in range(len(plan.action)):  # find the first HLA in plan, that is not primitive
-            if not RealWorldPlanningProblem.is_primitive(Node(plan.state, plan.parent, [plan.action[i]]), hierarchy):
+            node = Node(plan.state, plan.parent, [plan.action[i]])
+            if not RealWorldPlanningProblem.is_primitive(node, hierarchy, primitive):
                 hla = plan.action[i]
                 index = i
                 break
@@ -1810,6 +2454,241 @@ def job_shop_problem():
         resources=resources)
 
 
+def job_shop(m):
+    """
+    JOB-SHOP
+
+    The job-shop problem of job_shop_problem scaled to m cars C1, ..., Cm, each with its
+    own job of adding an engine, adding wheels and being inspected, whose durations
+    alternate between the ones of the two cars of job_shop_problem.
+
+    Example:
+    >>> from planning import *
+    >>> p = job_shop(3)
+    >>> len(p.jobs)
+    3
+    >>> for job in p.jobs:
+    ...     for action in job:
+    ...         p.act(action)
+    >>> p.goal_test()
+    True
+    >>>
+    """
+    resources = {'EngineHoists': 1, 'WheelStations': 2, 'Inspectors': 2, 'LugNuts': 20 * m}
+    initial, goals, jobs = [], [], []
+    for i in range(1, m + 1):
+        car, engine, wheels = 'C{}'.format(i), 'E{}'.format(i), 'W{}'.format(i)
+        initial += ['Car({})'.format(car), 'Wheels({})'.format(wheels), 'Engine({})'.format(engine),
+                    '~Has({}, {})'.format(car, engine), '~Has({}, {})'.format(car, wheels),
+                    '~Inspected({})'.format(car)]
+        goals += ['Has({}, {})'.format(car, wheels), 'Has({}, {})'.format(car, engine),
+                  'Inspected({})'.format(car)]
+        jobs.append([HLA('AddEngine{}'.format(i), precond='~Has({}, {})'.format(car, engine),
+                         effect='Has({}, {})'.format(car, engine), duration=(30, 60)[(i - 1) % 2],
+                         use={'EngineHoists': 1}),
+                     HLA('AddWheels{}'.format(i), precond='~Has({}, {})'.format(car, wheels),
+                         effect='Has({}, {})'.format(car, wheels), duration=(30, 15)[(i - 1) % 2],
+                         use={'WheelStations': 1}, consume={'LugNuts': 20}),
+                     HLA('Inspect{}'.format(i), precond='~Inspected({})'.format(car),
+                         effect='Inspected({})'.format(car), duration=10, use={'Inspectors': 1})])
+
+    # lists of literals rather than conjunctions, which would be too deep for hundreds of jobs
+    return RealWorldPlanningProblem(initial=list(map(expr, initial)), goals=list(map(expr, goals)),
+                                    actions=[action for job in jobs for action in job],
+                                    jobs=jobs, resources=resources)
+
+
+# ______________________________________________________________________________
+# Scheduling [Section 11.1]
+
+
+def precedence_graph(jobs, orderings=()):
+    """
+    Number the actions of the jobs, lists of HLAs to be performed in that order, and return
+    them with, for each action, the indices of the actions that must end before it starts
+    and of the ones that must start after it ends, from the jobs and from the orderings,
+    pairs (a, b) of actions where a comes before b.
+    """
+    actions = [action for job in jobs for action in job]
+    index = {action: i for i, action in enumerate(actions)}
+    preds = [[] for _ in actions]
+    succs = [[] for _ in actions]
+    pairs = [(a, b) for job in jobs for a, b in zip(job, job[1:])] + list(orderings)
+    for a, b in pairs:
+        preds[index[b]].append(index[a])
+        succs[index[a]].append(index[b])
+    return actions, preds, succs
+
+
+def critical_path(jobs, orderings=()):
+    """
+    [Section 11.1.2] The critical path method: return the earliest and the latest possible
+    start times of the actions of the jobs, ignoring resources, as dicts {action: time}.
+    The actions whose earliest and latest start times are equal have no slack: they make
+    up the critical path, whose length is the shortest duration of the whole schedule.
+    >>> p = job_shop_problem()
+    >>> es, ls = critical_path(p.jobs)
+    >>> [[ls[action] - es[action] for action in job] for job in p.jobs]
+    [[15, 15, 15], [0, 0, 0]]
+    """
+    actions, preds, succs = precedence_graph(jobs, orderings)
+    es, ls = earliest_latest_starts(actions, preds, succs)
+    return dict(zip(actions, es)), dict(zip(actions, ls))
+
+
+def earliest_latest_starts(actions, preds, succs):
+    """The earliest and latest start times of the numbered actions, computed along
+    a topological order."""
+    missing = [len(p) for p in preds]
+    order = [i for i, m in enumerate(missing) if m == 0]
+    for i in order:
+        for j in succs[i]:
+            missing[j] -= 1
+            if missing[j] == 0:
+                order.append(j)
+    if len(order) < len(actions):
+        raise ValueError('The orderings are cyclic')
+    es = [0] * len(actions)
+    for i in order:
+        for j in succs[i]:
+            es[j] = max(es[j], es[i] + actions[i].duration)
+    length = max((es[i] + a.duration for i, a in enumerate(actions)), default=0)
+    ls = [length - a.duration for a in actions]
+    for i in reversed(order):
+        for j in succs[i]:
+            ls[i] = min(ls[i], ls[j] - actions[i].duration)
+    return es, ls
+
+
+def list_schedule(actions, preds, succs, resources, priority):
+    """
+    List scheduling: simulate the execution of the numbered actions, starting, whenever an action
+    ends, every action whose predecessors have all ended and whose resources are free, in the order
+    of priority (lowest first). Return the start times.
+    """
+    for action in actions:
+        for r, n in action.uses.items():
+            if n > resources.get(r, 0):
+                raise ValueError('{} needs {} of {}, more than there is'.format(action.name, n, r))
+    missing = [len(p) for p in preds]
+    ready = [(priority[i], i) for i, m in enumerate(missing) if m == 0]
+    heapq.heapify(ready)
+    running = []
+    in_use = defaultdict(int)
+    start = [None] * len(actions)
+    t = 0
+    while ready or running:
+        waiting = []
+        while ready:
+            p, i = heapq.heappop(ready)
+            uses = actions[i].uses
+            if all(in_use[r] + n <= resources.get(r, 0) for r, n in uses.items()):
+                start[i] = t
+                for r, n in uses.items():
+                    in_use[r] += n
+                heapq.heappush(running, (t + actions[i].duration, i))
+            else:
+                waiting.append((p, i))
+        ready = waiting
+        heapq.heapify(ready)
+        # move on to the end of the next action
+        t, i = heapq.heappop(running)
+        ended = [i]
+        while running and running[0][0] == t:
+            ended.append(heapq.heappop(running)[1])
+        for i in ended:
+            for r, n in actions[i].uses.items():
+                in_use[r] -= n
+            for j in succs[i]:
+                missing[j] -= 1
+                if missing[j] == 0:
+                    heapq.heappush(ready, (priority[j], j))
+    return start
+
+
+def schedule(jobs, resources, orderings=(), refine=False, passes=5):
+    """
+    [Section 11.1] Schedule the actions of the jobs, lists of HLAs to be performed in that order,
+    under the limits of resources, a dict {resource: amount} of both the reusable resources the
+    actions use and the consumable ones they consume, and return their start times as a dict
+    {action: time}. The actions are list scheduled with the least slack first, from the critical
+    path method. With refine, the schedule is also improved by forward-backward passes, which
+    list schedule the actions once latest ending first on the reversed jobs, and once more in
+    the order of that right-justified schedule, under several priority rules.
+    >>> p = job_shop_problem()
+    >>> [makespan(schedule(p.jobs, p.resources, refine=refine)) for refine in (False, True)]
+    [130, 115]
+    """
+    actions, preds, succs = precedence_graph(jobs, orderings)
+    consumed = defaultdict(int)
+    for action in actions:
+        if not action.has_usable_resource(resources):
+            raise Exception('Not enough usable resources to execute {}'.format(action.name))
+        for r, n in action.consumes.items():
+            consumed[r] += n
+    # consumable resources are never given back, so only their totals matter
+    for r, n in consumed.items():
+        if resources.get(r, 0) < n:
+            raise Exception('Not enough consumable resources of {} for the jobs'.format(r))
+
+    es, ls = earliest_latest_starts(actions, preds, succs)
+    duration = [action.duration for action in actions]
+
+    def length(start):
+        return max((t + d for t, d in zip(start, duration)), default=0)
+
+    indices = range(len(actions))
+    best = list_schedule(actions, preds, succs, resources, [(ls[i], es[i], i) for i in indices])
+    if refine:
+        rules = [[(es[i], ls[i], i) for i in indices],
+                 [(duration[i], ls[i], i) for i in indices],
+                 [(-duration[i], ls[i], i) for i in indices]]
+        for priority in rules:
+            start = list_schedule(actions, preds, succs, resources, priority)
+            if length(start) < length(best):
+                best = start
+        for _ in range(passes):
+            end = [t + d for t, d in zip(best, duration)]
+            back = list_schedule(actions, succs, preds, resources, [(-end[i], i) for i in indices])
+            horizon = length(back)
+            right = [horizon - t - d for t, d in zip(back, duration)]
+            start = list_schedule(actions, preds, succs, resources,
+                                  [(right[i], i) for i in indices])
+            if length(start) >= length(best):
+                break
+            best = start
+    return dict(zip(actions, best))
+
+
+def makespan(start_times):
+    """The time at which the last action of a schedule {action: start time} ends."""
+    return max((t + action.duration for action, t in start_times.items()), default=0)
+
+
+def compare_schedulers(sizes=(10, 100, 300)):
+    """
+    Print, for the job shops of job_shop(m) with m in sizes, a lower bound on the makespan
+    (the critical path, or the total use of the most loaded resource over its amount),
+    and the makespan and time of schedule without and with refine.
+    """
+
+    def do(p, refine):
+        start = time.perf_counter()
+        result = makespan(schedule(p.jobs, p.resources, refine=refine))
+        return '{}/{:.2f}s'.format(result, time.perf_counter() - start)
+
+    table = []
+    for m in sizes:
+        p = job_shop(m)
+        es, _ = critical_path(p.jobs)
+        bound = max(es[job[-1]] + job[-1].duration for job in p.jobs)
+        for r, amount in p.resources.items():
+            used = sum(action.duration * action.uses.get(r, 0) for job in p.jobs for action in job)
+            bound = max(bound, -(-used // amount))
+        table.append([m, bound, do(p, False), do(p, True)])
+    print_table(table, header=['Jobs', 'Lower bound', 'List scheduling', 'Refined'])
+
+
 def go_to_sfo():
     """Go to SFO Problem"""
 
@@ -1,7 +1,6 @@
 """Probability models (Chapter 13-15)"""
 
-from collections import defaultdict
-from functools import reduce
+from collections import defaultdict, deque
 
 from agents import Agent
 from utils import *
@@ -168,6 +167,7 @@ class BayesNet:
         """Nodes must be ordered with parents before children."""
         self.nodes = []
         self.variables = []
+        self.junction_tree = None  # compiled by junction_tree_ask
         node_specs = node_specs or []
         for node_spec in node_specs:
             self.add(node_spec)
@@ -182,6 +182,7 @@ class BayesNet:
         self.variables.append(node.variable)
         for parent in node.parents:
             self.variable_node(parent).children.append(node)
+        self.junction_tree = None
 
     def variable_node(self, var):
         """Return the node for the variable named var.
@@ -414,19 +415,76 @@ def enumerate_all(variables, e, bn):
 # ______________________________________________________________________________
 
 
-def elimination_ask(X, e, bn):
+def moral_graph(bn, e=None):
+    """Return the moral graph of bn, as a dict {var: set of neighbours}, in which
+    each variable is linked to its parents and the parents of each variable are
+    linked to each other. The variables of e are left out, since fixing them to
+    their values drops them from the factors.
+    >>> sorted(moral_graph(burglary, dict(Alarm=T))['Burglary'])
+    ['Earthquake']"""
+    e = e or {}
+    graph = {var: set() for var in bn.variables if var not in e}
+    for node in bn.nodes:
+        family = [X for X in [node.variable] + node.parents if X not in e]
+        for X in family:
+            graph[X].update(Y for Y in family if Y != X)
+    return graph
+
+
+def min_degree(graph, var):
+    """The number of neighbours of var in graph."""
+    return len(graph[var])
+
+
+def min_fill(graph, var):
+    """The number of edges that eliminating var from graph adds between its neighbours."""
+    neighbours = graph[var]
+    return sum(len(neighbours - graph[Y]) - 1 for Y in neighbours) // 2
+
+
+def elimination_order(variables, graph, heuristic=min_fill):
+    """Order variables by eliminating from graph, one at a time, the variable with
+    the lowest heuristic cost (ties go to the earliest in variables), linking
+    the neighbours of each eliminated variable to each other.
+    >>> elimination_order(burglary.variables, moral_graph(burglary))
+    ['Burglary', 'Earthquake', 'JohnCalls', 'Alarm', 'MaryCalls']"""
+    graph = {var: set(neighbours) for var, neighbours in graph.items()}
+    variables, order = list(variables), []
+    while variables:
+        var = min(variables, key=lambda X: heuristic(graph, X))
+        variables.remove(var)
+        order.append(var)
+        neighbours = graph.pop(var)
+        for Y in neighbours:
+            graph[Y] |= neighbours - {Y}
+            graph[Y].discard(var)
+    return order
+
+
+def elimination_ask(X, e, bn, heuristic=min_fill):
     """
     [Figure 14.11]
-    Compute bn's P(X|e) by variable elimination.
+    Compute bn's P(X|e) by variable elimination. The hidden variables are
+    eliminated in the order of elimination_order for heuristic, or in
+    reverse topological order if heuristic is None.
     >>> elimination_ask('Burglary', dict(JohnCalls=T, MaryCalls=T), burglary
     ...  ).show_approx()
+    'False: 0.716, True: 0.284'
+    >>> elimination_ask('Burglary', dict(JohnCalls=T, MaryCalls=T), burglary,
+    ...  heuristic=None).show_approx()
     'False: 0.716, True: 0.284'"""
     assert X not in e, "Query variable must be distinct from evidence"
     factors = []
-    for var in reversed(bn.variables):
-        factors.append(make_factor(var, e, bn))
-        if is_hidden(var, X, e):
-            factors = sum_out(var, factors, bn)
+    if heuristic is None:
+        for var in reversed(bn.variables):
+            factors.append(make_factor(var, e, bn))
+            if is_hidden(var, X, e):
+                factors = sum_out(var, factors, bn)
+        return pointwise_product(factors, bn).normalize()
+    factors = [make_factor(var, e, bn) for var in bn.variables]
+    hidden = [var for var in bn.variables if is_hidden(var, X, e)]
+    for var in elimination_order(hidden, moral_graph(bn, e), heuristic):
+        factors = sum_out(var, factors, bn)
     return pointwise_product(factors, bn).normalize()
 
 
@@ -440,14 +498,21 @@ def make_factor(var, e, bn):
     That is, bn's full joint distribution, projected to accord with e,
     is the pointwise product of these factors for bn's variables."""
     node = bn.variable_node(var)
-    variables = [X for X in [var] + node.parents if X not in e]
-    cpt = {event_values(e1, variables): node.p(e1[var], e1)
-           for e1 in all_events(variables, bn, e)}
-    return Factor(variables, cpt)
+    variables = [var] + node.parents
+    domains = [bn.variable_values(X) for X in variables]
+    ptrue = np.empty([len(domain) for domain in domains[1:]])
+    for values, p in node.cpt.items():
+        ptrue[tuple(domain.index(v) for v, domain in zip(values, domains[1:]))] = p
+    table = np.stack([ptrue if value else 1 - ptrue for value in domains[0]])
+    # fix the variables of e to their values, which drops their axes
+    index = tuple(domain.index(e[X]) if X in e else slice(None)
+                  for X, domain in zip(variables, domains))
+    return Factor([X for X in variables if X not in e], table[index],
+                  [domain for X, domain in zip(variables, domains) if X not in e])
 
 
 def pointwise_product(factors, bn):
-    return reduce(lambda f, g: f.pointwise_product(g, bn), factors)
+    return factor_product(factors)
 
 
 def sum_out(var, factors, bn):
@@ -455,29 +520,63 @@ def sum_out(var, factors, bn):
     result, var_factors = [], []
     for f in factors:
         (var_factors if var in f.variables else result).append(f)
-    result.append(pointwise_product(var_factors, bn).sum_out(var, bn))
+    result.append(factor_product(var_factors, [var]))
     return result
 
 
-class Factor:
-    """A factor in a joint distribution."""
+def factor_product(factors, eliminated=()):
+    """Return the pointwise product of factors with the variables in eliminated
+    summed out, as a single numpy.einsum over the tables of the factors, which
+    broadcasts them along the variables they lack.
+    >>> f = make_factor('Alarm', dict(Burglary=T), burglary)
+    >>> g = make_factor('JohnCalls', dict(JohnCalls=T), burglary)
+    >>> h = factor_product([f, g], ['Alarm'])
+    >>> h.variables, round(h.p(dict(Earthquake=T)), 4)
+    (['Earthquake'], 0.8575)"""
+    variables, domains = [], {}
+    for f in factors:
+        for X, domain in zip(f.variables, f.domains):
+            if X not in domains:
+                variables.append(X)
+                domains[X] = domain
+    axis = {X: i for i, X in enumerate(variables)}
+    operands = []
+    for f in factors:
+        operands += [f.table, [axis[X] for X in f.variables]]
+    variables = [X for X in variables if X not in eliminated]
+    table = np.einsum(*operands, [axis[X] for X in variables], optimize=len(factors) > 2)
+    return Factor(variables, table, [domains[X] for X in variables])
 
-    def __init__(self, variables, cpt):
-        self.variables = variables
-        self.cpt = cpt
+
+class Factor:
+    """A factor in a joint distribution, tabulated as an array with one axis per
+    variable, indexed by the position of each value in the domain of its variable."""
+
+    def __init__(self, variables, cpt, domains=None):
+        """cpt is either that array or a dict {(value of each variable, ...): p, ...}.
+        domains lists the values of each variable, which are boolean by default."""
+        self.variables = list(variables)
+        self.domains = domains or [[True, False] for _ in self.variables]
+        if isinstance(cpt, dict):
+            table = np.zeros([len(domain) for domain in self.domains])
+            for values, p in cpt.items():
+                table[tuple(domain.index(v) for v, domain in zip(values, self.domains))] = p
+            cpt = table
+        self.table = np.asarray(cpt, dtype=float)
+
+    @property
+    def cpt(self):
+        """My table as a dict {(value of each variable, ...): p, ...}."""
+        return {tuple(domain[i] for i, domain in zip(index, self.domains)): float(p)
+                for index, p in np.ndenumerate(self.table)}
 
     def pointwise_product(self, other, bn):
         """Multiply two factors, combining their variables."""
-        variables = list(set(self.variables) | set(other.variables))
-        cpt = {event_values(e, variables): self.p(e) * other.p(e) for e in all_events(variables, bn, {})}
-        return Factor(variables, cpt)
+        return factor_product([self, other])
 
     def sum_out(self, var, bn):
         """Make a factor eliminating var by summing over its values."""
-        variables = [X for X in self.variables if X != var]
-        cpt = {event_values(e, variables): sum(self.p(extend(e, var, val)) for val in bn.variable_values(var))
-               for e in all_events(variables, bn, {})}
-        return Factor(variables, cpt)
+        return factor_product([self], [var])
 
     def normalize(self):
         """Return my probabilities; must be down to one variable."""
@@ -486,7 +585,8 @@ class Factor:
 
     def p(self, e):
         """Look up my value tabulated for e."""
-        return self.cpt[event_values(e, self.variables)]
+        index = tuple(domain.index(e[X]) for X, domain in zip(self.variables, self.domains))
+        return float(self.table[index])
 
 
 def all_events(variables, bn, e):
@@ -500,6 +600,147 @@ def all_events(variables, bn, e):
                 yield extend(e1, X, x)
 
 
+# ______________________________________________________________________________
+
+
+class JunctionTree:
+    """
+    [Section 14.4.4]
+    The junction tree (clique tree) of a BayesNet, compiled once and then calibrated
+    for any evidence. Its cliques are those of the moral graph of the network,
+    triangulated by elimination_order, linked into a maximum spanning tree on the
+    sizes of their intersections, and each factor of the network is assigned to a
+    clique that contains its variables. Calibrating the tree for evidence e passes
+    a message along each edge in each direction, after which the marginal of every
+    variable given e can be read off any clique containing it. Messages are kept
+    between calibrations, and only the ones sent from the side of a clique whose
+    evidence has changed are computed again.
+    >>> jt = JunctionTree(burglary)
+    >>> jt.ask('Burglary', dict(JohnCalls=T, MaryCalls=T)).show_approx()
+    'False: 0.716, True: 0.284'
+    >>> jt.marginals(dict(JohnCalls=T, MaryCalls=T))['Earthquake'].show_approx()
+    'False: 0.824, True: 0.176'
+    """
+
+    def __init__(self, bn, heuristic=min_fill):
+        self.bn = bn
+        graph = moral_graph(bn)
+        cliques = []
+        for var in elimination_order(bn.variables, graph, heuristic):
+            clique = {var} | graph[var]
+            if not any(clique <= c for c in cliques):
+                cliques.append(clique)
+            for Y in graph[var]:
+                graph[Y] |= graph[var] - {Y}
+                graph[Y].discard(var)
+            del graph[var]
+        position = {var: i for i, var in enumerate(bn.variables)}
+        self.cliques = [sorted(clique, key=position.get) for clique in cliques]
+        self.sets = cliques
+        n = len(cliques)
+
+        # a maximum spanning tree on the sizes of the separators, by Prim's algorithm
+        self.neighbours = {i: [] for i in range(n)}
+        best = {j: (len(cliques[0] & cliques[j]), 0) for j in range(1, n)}
+        while best:
+            j = max(best, key=lambda k: best[k][0])
+            i = best.pop(j)[1]
+            self.neighbours[i].append(j)
+            self.neighbours[j].append(i)
+            for k in best:
+                if len(cliques[j] & cliques[k]) > best[k][0]:
+                    best[k] = (len(cliques[j] & cliques[k]), j)
+
+        # the edges in an order in which every message is sent after the ones it needs:
+        # towards the root, then away from it
+        order, parent = [0], {0: None}
+        for i in order:
+            for j in self.neighbours[i]:
+                if j not in parent:
+                    parent[j] = i
+                    order.append(j)
+        self.schedule = ([(j, parent[j]) for j in reversed(order[1:])] +
+                         [(parent[j], j) for j in order[1:]])
+
+        def smallest(variables):
+            return min((i for i in range(n) if variables <= cliques[i]),
+                       key=lambda i: len(cliques[i]))
+
+        self.factors = [[] for _ in range(n)]
+        for node in bn.nodes:
+            family = {node.variable} | set(node.parents)
+            self.factors[smallest(family)].append(make_factor(node.variable, {}, bn))
+        self.home = {var: smallest({var}) for var in bn.variables}
+        self.evidence = {}
+        self.potentials = [self.potential(i) for i in range(n)]
+        self.messages = {}
+
+    def potential(self, i):
+        """The product of the factors assigned to clique i and of the indicators
+        of the evidence on its variables."""
+        domains = [self.bn.variable_values(X) for X in self.cliques[i]]
+        factors = [Factor(self.cliques[i], np.ones([len(domain) for domain in domains]), domains)]
+        for X, x in self.evidence.items():
+            if self.home[X] == i:
+                domain = self.bn.variable_values(X)
+                factors.append(Factor([X], [float(v == x) for v in domain], [domain]))
+        return factor_product(factors + self.factors[i])
+
+    def message(self, i, j):
+        """The message from clique i to clique j, scaled to sum to 1."""
+        factors = [self.potentials[i]] + [self.messages[k, i] for k in self.neighbours[i] if k != j]
+        message = factor_product(factors, [X for X in self.cliques[i] if X not in self.sets[j]])
+        total = message.table.sum()
+        if total > 0:
+            message.table /= total
+        return message
+
+    def calibrate(self, e):
+        """Pass the messages for evidence e that are not already known."""
+        changed = {X for X in set(e) | set(self.evidence) if e.get(X) != self.evidence.get(X)}
+        self.evidence = dict(e)
+        for i in {self.home[X] for X in changed}:
+            self.potentials[i] = self.potential(i)
+            # forget every message sent away from clique i
+            frontier = [(i, j) for j in self.neighbours[i]]
+            while frontier:
+                k, j = frontier.pop()
+                self.messages.pop((k, j), None)
+                frontier.extend((j, l) for l in self.neighbours[j] if l != k)
+        for i, j in self.schedule:
+            if (i, j) not in self.messages:
+                self.messages[i, j] = self.message(i, j)
+
+    def marginal(self, X):
+        """P(X|e) for the evidence e of the last calibration."""
+        i = self.home[X]
+        factors = [self.potentials[i]] + [self.messages[k, i] for k in self.neighbours[i]]
+        return factor_product(factors, [Y for Y in self.cliques[i] if Y != X]).normalize()
+
+    def ask(self, X, e):
+        """Compute P(X|e)."""
+        assert X not in e, "Query variable must be distinct from evidence"
+        self.calibrate(e)
+        return self.marginal(X)
+
+    def marginals(self, e):
+        """Compute P(X|e) for every variable X that is not in e, from a single calibration."""
+        self.calibrate(e)
+        return {X: self.marginal(X) for X in self.bn.variables if X not in e}
+
+
+def junction_tree_ask(X, e, bn):
+    """
+    Compute bn's P(X|e) on the junction tree of bn, which is compiled on
+    the first query and kept by bn for the next ones.
+    >>> junction_tree_ask('Burglary', dict(JohnCalls=T, MaryCalls=T), burglary
+    ...  ).show_approx()
+    'False: 0.716, True: 0.284'"""
+    if bn.junction_tree is None:
+        bn.junction_tree = JunctionTree(bn)
+    return bn.junction_tree.ask(X, e)
+
+
 # ______________________________________________________________________________
 
 # [Figure 14.12a]: sprinkler network
@@ -515,12 +756,16 @@ sprinkler = BayesNet([('Cloudy', '', 0.5),
 # ______________________________________________________________________________
 
 
-def prior_sample(bn):
+def prior_sample(bn, batch_size=None, seed=None):
     """
     [Figure 14.13]
     Randomly sample from bn's full joint distribution.
-    The result is a {variable: value} dict.
+    The result is a {variable: value} dict, or with a batch_size a
+    {variable: array of batch_size values} dict of that many samples
+    drawn at once by weighted_samples from a NumPy generator seeded by seed.
     """
+    if batch_size is not None:
+        return weighted_samples(bn, {}, batch_size, np.random.default_rng(seed))[0]
     event = {}
     for node in bn.nodes:
         event[node.variable] = node.sample(event)
@@ -530,18 +775,34 @@ def prior_sample(bn):
 # _________________________________________________________________________
 
 
-def rejection_sampling(X, e, bn, N=10000):
+def rejection_sampling(X, e, bn, N=10000, batch_size=None, seed=None):
     """
     [Figure 14.14]
     Estimate the probability distribution of variable X given
     evidence e in BayesNet bn, using N samples.
     Raises a ZeroDivisionError if all the N samples are rejected,
     i.e., inconsistent with e.
+    With a batch_size, the samples are drawn batch_size at a time by
+    weighted_samples, from a NumPy generator seeded by seed.
     >>> random.seed(47)
     >>> rejection_sampling('Burglary', dict(JohnCalls=T, MaryCalls=T),
     ...   burglary, 10000).show_approx()
     'False: 0.7, True: 0.3'
+    >>> rejection_sampling('Burglary', dict(JohnCalls=T, MaryCalls=T),
+    ...   burglary, 100000, batch_size=100000, seed=47).show_approx()
+    'False: 0.744, True: 0.256'
     """
+    if batch_size is not None:
+        rng, counts = np.random.default_rng(seed), {x: 0 for x in bn.variable_values(X)}
+        tables = cpt_tables(bn)
+        for n in batches(N, batch_size):
+            samples = weighted_samples(bn, {}, n, rng, tables)[0]
+            consistent = np.ones(n, dtype=bool)
+            for var, value in e.items():
+                consistent &= samples[var] == value
+            for x in counts:
+                counts[x] += int(np.count_nonzero(samples[X][consistent] == x))
+        return ProbDist(X, counts)
     counts = {x: 0 for x in bn.variable_values(X)}  # bold N in [Figure 14.14]
     for j in range(N):
         sample = prior_sample(bn)  # boldface x in [Figure 14.14]
@@ -558,16 +819,29 @@ def consistent_with(event, evidence):
 # _________________________________________________________________________
 
 
-def likelihood_weighting(X, e, bn, N=10000):
+def likelihood_weighting(X, e, bn, N=10000, batch_size=None, seed=None):
     """
     [Figure 14.15]
     Estimate the probability distribution of variable X given
     evidence e in BayesNet bn.
+    With a batch_size, the samples are drawn batch_size at a time by
+    weighted_samples, from a NumPy generator seeded by seed.
     >>> random.seed(1017)
     >>> likelihood_weighting('Burglary', dict(JohnCalls=T, MaryCalls=T),
     ...   burglary, 10000).show_approx()
     'False: 0.702, True: 0.298'
+    >>> likelihood_weighting('Burglary', dict(JohnCalls=T, MaryCalls=T),
+    ...   burglary, 100000, batch_size=100000, seed=1017).show_approx()
+    'False: 0.76, True: 0.24'
     """
+    if batch_size is not None:
+        rng, W = np.random.default_rng(seed), {x: 0 for x in bn.variable_values(X)}
+        tables = cpt_tables(bn)
+        for n in batches(N, batch_size):
+            samples, weights = weighted_samples(bn, e, n, rng, tables)
+            for x in W:
+                W[x] += float(weights[samples[X] == x].sum())
+        return ProbDist(X, W)
     W = {x: 0 for x in bn.variable_values(X)}
     for j in range(N):
         sample, weight = weighted_sample(bn, e)  # boldface x, w in [Figure 14.15]
@@ -592,6 +866,39 @@ def weighted_sample(bn, e):
     return event, w
 
 
+def cpt_tables(bn):
+    """The arrays of P(X=true) along the axes of the parents of X, for each
+    node X of bn in order, compiled once for many calls of weighted_samples."""
+    return [make_factor(node.variable, {}, bn).table[0] for node in bn.nodes]
+
+
+def weighted_samples(bn, e, N, rng=None, tables=None):
+    """
+    Sample N events from bn that are consistent with the evidence e at once,
+    one variable at a time in the order of bn.nodes, each as an array of
+    N values drawn with the probabilities looked up for the values of its
+    parents in tables, by default cpt_tables(bn); return the {variable: array}
+    events and the array of their weights, as weighted_sample does for one event.
+    rng is the NumPy generator to sample with, by default one seeded from random.
+    """
+    rng = numpy_rng(rng)
+    samples, weights = {}, np.ones(N)
+    for node, ptrue in zip(bn.nodes, tables or cpt_tables(bn)):
+        ptrue = ptrue[tuple(np.where(samples[parent], 0, 1) for parent in node.parents)]
+        if node.variable in e:
+            weights *= ptrue if e[node.variable] else 1 - ptrue
+            samples[node.variable] = np.full(N, e[node.variable])
+        else:
+            samples[node.variable] = rng.random(N) < ptrue
+    return samples, weights
+
+
+def batches(N, batch_size):
+    """Yield the sizes of the batches of at most batch_size that make up N."""
+    for start in range(0, N, batch_size):
+        yield min(batch_size, N - start)
+
+
 # _________________________________________________________________________
 
 
@@ -625,27 +932,107 @@ def markov_blanket_sample(X, e, bn):
     return probability(Q.normalize()[True])
 
 
+def markov_blanket_tables(bn, e):
+    """For each variable Z of bn that is not in e, compile P(Z=true | mb),
+    where mb is the Markov blanket of Z with the variables of e fixed to
+    their values, into an array with one axis per remaining variable of
+    the blanket; return a list of (Z, blanket, array) in the order of bn.
+    >>> [(Z, mb) for Z, mb, _ in markov_blanket_tables(burglary, dict(JohnCalls=T))]
+    [('Burglary', ['Alarm', 'Earthquake']), ('Earthquake', ['Alarm', 'Burglary']), \
+('Alarm', ['Burglary', 'Earthquake', 'MaryCalls']), ('MaryCalls', ['Alarm'])]"""
+    tables = []
+    for Z in bn.variables:
+        if Z not in e:
+            node = bn.variable_node(Z)
+            # [Equation 14.12]
+            f = factor_product([make_factor(Z, e, bn)] +
+                               [make_factor(Y.variable, e, bn) for Y in node.children])
+            table = np.moveaxis(f.table, f.variables.index(Z), 0)
+            blanket = [Y for Y in f.variables if Y != Z]
+            tables.append((Z, blanket, table[0] / table.sum(axis=0)))
+    return tables
+
+
+def gibbs_chains_ask(X, e, bn, N=1000, chains=4, burn_in=100, thin=1, seed=None):
+    """
+    [Figure 14.16]
+    Estimate P(X|e) by Gibbs sampling with several independent chains at
+    once, each a NumPy array entry, started at random states. Every sweep
+    samples each nonevidence variable of every chain from the table of
+    markov_blanket_tables for its blanket. The first burn_in sweeps are
+    discarded, and then the state of X is kept every thin sweeps, N
+    times per chain. Return the distribution and the Gelman-Rubin R-hat
+    of the kept values of X, which approaches 1 as the chains converge.
+    >>> P, r_hat = gibbs_chains_ask('Cloudy', dict(Rain=T), sprinkler, 5000, seed=2)
+    >>> P.show_approx(), r_hat < 1.01
+    ('False: 0.206, True: 0.794', True)
+    """
+    assert X not in e, "Query variable must be distinct from evidence"
+    rng = np.random.default_rng(seed)
+    tables = markov_blanket_tables(bn, e)
+    state = {Z: rng.random(chains) < 0.5 for Z, _, _ in tables}
+    state.update({Y: np.full(chains, y) for Y, y in e.items()})
+    kept = np.empty((chains, N), dtype=bool)
+    for j in range(burn_in + N * thin):
+        for Z, blanket, table in tables:
+            p = table[tuple(np.where(state[Y], 0, 1) for Y in blanket)]
+            state[Z] = rng.random(chains) < p
+        if j >= burn_in and (j - burn_in) % thin == thin - 1:
+            kept[:, (j - burn_in) // thin] = state[X]
+    counts = {True: int(kept.sum()), False: int(kept.size - kept.sum())}
+    return ProbDist(X, counts), gelman_rubin(kept)
+
+
+def gelman_rubin(samples):
+    """The potential scale reduction factor R-hat of the samples of a
+    quantity in each chain, one chain per row: the ratio of the variance
+    estimated from all the chains to the variance within the chains.
+    >>> round(gelman_rubin(np.array([[0, 0, 0, 1], [1, 1, 1, 0]])), 3)
+    1.118"""
+    samples = np.asarray(samples, dtype=float)
+    m, n = samples.shape
+    W = samples.var(axis=1, ddof=1).mean()  # within-chain variance
+    B = n * samples.mean(axis=1).var(ddof=1)  # between-chain variance
+    if W == 0:
+        return 1.0 if B == 0 else float('inf')
+    return float(np.sqrt(((n - 1) / n * W + B / n) / W))
+
+
 # _________________________________________________________________________
 
 
 class HiddenMarkovModel:
-    """A Hidden markov model which takes Transition model and Sensor model as inputs"""
-
-    def __init__(self, transition_model, sensor_model, prior=None):
+    """A Hidden markov model which takes Transition model and Sensor model as inputs.
+    transition_model[i][j] is P(X_t = j | X_t-1 = i) and sensor_model[k][i] is
+    P(E_t = k | X_t = i) for any number of states. The observations that name
+    the rows k of sensor_model may be given as observations, for any number of
+    them; otherwise there are two, and the observation True stands for k = 0
+    and any other for k = 1. The states are named by states, which defaults to
+    True and False for two states and to their indices otherwise."""
+
+    def __init__(self, transition_model, sensor_model, prior=None, states=None, observations=None):
         self.transition_model = transition_model
         self.sensor_model = sensor_model
-        self.prior = prior or [0.5, 0.5]
+        self.T = np.asarray(transition_model, dtype=float)
+        self.O = np.asarray(sensor_model, dtype=float)
+        n = len(self.T)
+        self.prior = prior or [1 / n] * n
+        self.states = states or ([True, False] if n == 2 else list(range(n)))
+        self.observations = observations
+        self.index = None if observations is None else {o: k for k, o in enumerate(observations)}
+
+    def observation(self, ev):
+        """The index of observation ev in sensor_model."""
+        if self.observations is None:
+            return 0 if ev is True or ev is np.True_ else 1
+        return self.index[ev]
 
     def sensor_dist(self, ev):
-        if ev is True:
-            return self.sensor_model[0]
-        else:
-            return self.sensor_model[1]
+        return self.sensor_model[self.observation(ev)]
 
 
 def forward(HMM, fv, ev):
-    prediction = vector_add(scalar_vector_product(fv[0], HMM.transition_model[0]),
-                            scalar_vector_product(fv[1], HMM.transition_model[1]))
+    prediction = np.asarray(fv) @ HMM.T
     sensor_dist = HMM.sensor_dist(ev)
 
     return normalize(element_wise_product(sensor_dist, prediction))
@@ -655,8 +1042,7 @@ def backward(HMM, b, ev):
     sensor_dist = HMM.sensor_dist(ev)
     prediction = element_wise_product(sensor_dist, b)
 
-    return normalize(vector_add(scalar_vector_product(prediction[0], HMM.transition_model[0]),
-                                scalar_vector_product(prediction[1], HMM.transition_model[1])))
+    return normalize(HMM.T @ prediction)
 
 
 def forward_backward(HMM, ev):
@@ -666,11 +1052,12 @@ def forward_backward(HMM, ev):
     of a sequence of states given a sequence of observations.
     """
     t = len(ev)
+    n = len(HMM.T)
     ev.insert(0, None)  # to make the code look similar to pseudo code
 
-    fv = [[0.0, 0.0] for _ in range(len(ev))]
-    b = [1.0, 1.0]
-    sv = [[0, 0] for _ in range(len(ev))]
+    fv = [[0.0] * n for _ in range(len(ev))]
+    b = [1.0] * n
+    sv = [[0] * n for _ in range(len(ev))]
 
     fv[0] = HMM.prior
 
@@ -695,7 +1082,7 @@ def viterbi(HMM, ev):
     ev = ev.copy()
     ev.insert(0, None)
 
-    m = [[0.0, 0.0] for _ in range(len(ev) - 1)]
+    m = [[0.0] * len(HMM.T) for _ in range(len(ev) - 1)]
 
     # the recursion is initialized with m1 = forward(P(X0), e1)
     m[0] = forward(HMM, HMM.prior, ev[1])
@@ -703,11 +1090,10 @@ def viterbi(HMM, ev):
     backtracking_graph = []
 
     for i in range(1, t):
-        m[i] = element_wise_product(HMM.sensor_dist(ev[i + 1]),
-                                    [max(element_wise_product(HMM.transition_model[0], m[i - 1])),
-                                     max(element_wise_product(HMM.transition_model[1], m[i - 1]))])
-        backtracking_graph.append([np.argmax(element_wise_product(HMM.transition_model[0], m[i - 1])),
-                                   np.argmax(element_wise_product(HMM.transition_model[1], m[i - 1]))])
+        # scores[j][k] of coming to state k from state j
+        scores = np.asarray(m[i - 1])[:, np.newaxis] * HMM.T
+        m[i] = element_wise_product(HMM.sensor_dist(ev[i + 1]), scores.max(axis=0))
+        backtracking_graph.append(scores.argmax(axis=0))
 
     # computed probabilities
     ml_probabilities = [0.0] * (len(ev) - 1)
@@ -720,7 +1106,7 @@ def viterbi(HMM, ev):
 
     for i in range(t - 1, -1, -1):
         ml_probabilities[i] = m[i][i_max]
-        ml_path[i] = True if i_max == 0 else False
+        ml_path[i] = HMM.states[i_max]
         if i > 0:
             i_max = backtracking_graph[i - 1][i_max]
 
@@ -741,7 +1127,7 @@ def fixed_lag_smoothing(e_t, HMM, d, ev, t):
 
     T_model = HMM.transition_model
     f = HMM.prior
-    B = [[1, 0], [0, 1]]
+    B = np.identity(len(HMM.T))
 
     O_t = np.diag(HMM.sensor_dist(e_t))
     if t > d:
@@ -759,44 +1145,267 @@ def fixed_lag_smoothing(e_t, HMM, d, ev, t):
         return None
 
 
+class FixedLagSmoother:
+    """
+    [Figure 15.6]
+    Streaming smoothing with a fixed time lag of d steps: each observation
+    given to smooth returns P(X_t-d | e_1:t), or None while t <= d. Rather
+    than the matrix B of the figure, whose updates invert the transition
+    and sensor matrices, it keeps the forward message of time t-d and a
+    ring buffer of the last d observations, and passes a backward message
+    through the buffer, in O(d) memory and O(d n^2) time per step.
+    >>> umbrellaHMM = HiddenMarkovModel([[0.7, 0.3], [0.3, 0.7]], [[0.9, 0.2], [0.1, 0.8]])
+    >>> smoother = FixedLagSmoother(umbrellaHMM, 1)
+    >>> smoother.smooth(True) is None
+    True
+    >>> [round(p, 4) for p in smoother.smooth(True)]
+    [0.8834, 0.1166]
+    """
+
+    def __init__(self, HMM, d):
+        self.HMM, self.d = HMM, d
+        self.f = np.asarray(HMM.prior, dtype=float)  # P(X_t-d | e_1:t-d)
+        self.buffer = deque(maxlen=d)  # e_t-d+1, ..., e_t
+        self.t = 0
+
+    def smooth(self, e_t):
+        """Take in the observation of the next time step and
+        return the smoothed estimate of d steps ago."""
+        self.t += 1
+        e_t = self.HMM.observation(e_t)
+        if self.t <= self.d:
+            self.buffer.append(e_t)
+            return None
+        e = self.buffer[0] if self.d else e_t  # e_t-d, pushed out of the full buffer by e_t
+        self.buffer.append(e_t)
+        self.f = self.HMM.O[e] * (self.f @ self.HMM.T)
+        self.f /= self.f.sum()
+        b = np.ones(len(self.HMM.T))
+        for e in reversed(self.buffer):
+            b = self.HMM.T @ (self.HMM.O[e] * b)
+            b /= b.sum()
+        return normalize((self.f * b).tolist())
+
+
+# _________________________________________________________________________
+# Vectorized inference on many sequences of observations at once
+
+
+def hmm_observations(HMM, ev):
+    """The indices of the observations of a sequence ev, or of each sequence of
+    a list of sequences of the same length, as a 2-D array with a row per sequence,
+    and whether ev was a single sequence."""
+    ev = np.asarray(ev)
+    single = ev.ndim == 1
+    indices = np.vectorize(HMM.observation, otypes=[int])(np.atleast_2d(ev)) if ev.size else \
+        np.zeros((1, 0), dtype=int)
+    return indices, single
+
+
+def hmm_forward(HMM, ev, log=False):
+    """
+    [Equation 15.5]
+    Filter the sequence of observations ev, or each of a list of sequences of
+    the same length at once. Return the filtered distributions P(X_k | e_1:k)
+    for k = 1..t, as a (t, n) array per sequence, and log P(e_1:t). Messages
+    are scaled to sum to 1 at each step, and the log likelihood sums the logs
+    of the scale factors; with log=True, the recursion runs on log probabilities
+    instead, and the log of the filtered distributions is returned.
+    >>> umbrellaHMM = HiddenMarkovModel([[0.7, 0.3], [0.3, 0.7]], [[0.9, 0.2], [0.1, 0.8]])
+    >>> f, loglik = hmm_forward(umbrellaHMM, [True, True])
+    >>> f.round(4).tolist()
+    [[0.8182, 0.1818], [0.8834, 0.1166]]
+    """
+    E, single = hmm_observations(HMM, ev)
+    batch, t = E.shape
+    messages = np.empty((batch, t, len(HMM.T)))
+    if log:
+        with np.errstate(divide='ignore'):
+            log_T, log_O = np.log(HMM.T), np.log(HMM.O)
+            f = np.tile(np.log(np.asarray(HMM.prior, dtype=float)), (batch, 1))
+        for k in range(t):
+            f = np.logaddexp.reduce(f[:, :, np.newaxis] + log_T, axis=1) + log_O[E[:, k]]
+            messages[:, k] = f
+        loglik = np.logaddexp.reduce(f, axis=1) if t else np.zeros(batch)
+        messages -= np.logaddexp.reduce(messages, axis=2)[:, :, np.newaxis]
+    else:
+        f = np.tile(np.asarray(HMM.prior, dtype=float), (batch, 1))
+        loglik = np.zeros(batch)
+        for k in range(t):
+            f = (f @ HMM.T) * HMM.O[E[:, k]]
+            scale = f.sum(axis=1)
+            f /= scale[:, np.newaxis]
+            loglik += np.log(scale)
+            messages[:, k] = f
+    return (messages[0], loglik[0]) if single else (messages, loglik)
+
+
+def hmm_backward(HMM, ev, log=False):
+    """
+    [Equation 15.9]
+    The backward messages P(e_k+1:t | X_k) for k = 1..t of the sequence of
+    observations ev, or of each of a list of sequences at once, as a (t, n)
+    array per sequence, scaled to sum to 1 or, with log=True, as logs.
+    """
+    E, single = hmm_observations(HMM, ev)
+    batch, t = E.shape
+    messages = np.empty((batch, t, len(HMM.T)))
+    if log:
+        with np.errstate(divide='ignore'):
+            log_T, log_O = np.log(HMM.T), np.log(HMM.O)
+        b = np.zeros((batch, len(HMM.T)))
+        for k in range(t - 1, -1, -1):
+            messages[:, k] = b
+            b = np.logaddexp.reduce(log_T + (log_O[E[:, k]] + b)[:, np.newaxis, :], axis=2)
+    else:
+        b = np.ones((batch, len(HMM.T)))
+        for k in range(t - 1, -1, -1):
+            messages[:, k] = b
+            b = (HMM.O[E[:, k]] * b) @ HMM.T.T
+            b /= b.sum(axis=1)[:, np.newaxis]
+    return messages[0] if single else messages
+
+
+def hmm_smooth(HMM, ev, log=False):
+    """
+    [Figure 15.4]
+    The smoothed distributions P(X_k | e_1:t) for k = 1..t of the sequence of
+    observations ev, or of each of a list of sequences at once, as a (t, n) array
+    per sequence, from the scaled forward and backward messages or, with
+    log=True, from their logs.
+    >>> umbrellaHMM = HiddenMarkovModel([[0.7, 0.3], [0.3, 0.7]], [[0.9, 0.2], [0.1, 0.8]])
+    >>> hmm_smooth(umbrellaHMM, [True, True]).round(4).tolist()
+    [[0.8834, 0.1166], [0.8834, 0.1166]]
+    """
+    f, _ = hmm_forward(HMM, ev, log)
+    b = hmm_backward(HMM, ev, log)
+    if log:
+        s = f + b
+        return np.exp(s - np.logaddexp.reduce(s, axis=-1)[..., np.newaxis])
+    s = f * b
+    return s / s.sum(axis=-1)[..., np.newaxis]
+
+
+def hmm_viterbi(HMM, ev):
+    """
+    [Equation 15.11]
+    The most likely sequence of states for the sequence of observations ev, or for
+    each of a list of sequences at once, by the Viterbi algorithm in log space.
+    Return the states, as indices into HMM.states, and the log probability of the
+    path jointly with the observations.
+    >>> umbrellaHMM = HiddenMarkovModel([[0.7, 0.3], [0.3, 0.7]], [[0.9, 0.2], [0.1, 0.8]])
+    >>> path, logp = hmm_viterbi(umbrellaHMM, [True, True, False, True, True])
+    >>> [umbrellaHMM.states[i] for i in path]
+    [True, True, False, True, True]
+    """
+    E, single = hmm_observations(HMM, ev)
+    batch, t = E.shape
+    with np.errstate(divide='ignore'):
+        log_T, log_O = np.log(HMM.T), np.log(HMM.O)
+        # the recursion is initialized with the log of forward(P(X0), e1)
+        m = np.tile(np.log(np.asarray(HMM.prior, dtype=float) @ HMM.T), (batch, 1))
+    m = m + log_O[E[:, 0]] if t else m
+    pointers = np.empty((batch, t, len(HMM.T)), dtype=int)
+    for k in range(1, t):
+        scores = m[:, :, np.newaxis] + log_T  # from state i to state j
+        pointers[:, k] = scores.argmax(axis=1)
+        m = scores.max(axis=1) + log_O[E[:, k]]
+    path = np.empty((batch, t), dtype=int)
+    if t:
+        path[:, -1] = m.argmax(axis=1)
+        for k in range(t - 1, 0, -1):
+            path[:, k - 1] = pointers[np.arange(batch), k, path[:, k]]
+    logp = m.max(axis=1)
+    return (path[0], logp[0]) if single else (path, logp)
+
+
 # _________________________________________________________________________
 
 
-def particle_filtering(e, N, HMM):
-    """Particle filtering considering two states variables."""
-    dist = [0.5, 0.5]
-    # Weight Initialization
-    w = [0 for _ in range(N)]
-    # STEP 1
-    # Propagate one step using transition model given prior state
-    dist = vector_add(scalar_vector_product(dist[0], HMM.transition_model[0]),
-                      scalar_vector_product(dist[1], HMM.transition_model[1]))
-    # Assign state according to probability
-    s = ['A' if probability(dist[0]) else 'B' for _ in range(N)]
-    w_tot = 0
-    # Calculate importance weight given evidence e
-    for i in range(N):
-        if s[i] == 'A':
-            # P(U|A)*P(A)
-            w_i = HMM.sensor_dist(e)[0] * dist[0]
-        if s[i] == 'B':
-            # P(U|B)*P(B)
-            w_i = HMM.sensor_dist(e)[1] * dist[1]
-        w[i] = w_i
-        w_tot += w_i
-
-    # Normalize all the weights
-    for i in range(N):
-        w[i] = w[i] / w_tot
-
-    # Limit weights to 4 digits
-    for i in range(N):
-        w[i] = float("{0:.4f}".format(w[i]))
-
-    # STEP 2
-    s = weighted_sample_with_replacement(N, s, w)
-
-    return s
+def particle_filter(evidence, particles, P_transition_sample, P_sensor, resample_threshold=0.5,
+                    resampling=None, rng=None):
+    """
+    [Figure 15.17]
+    Particle filtering over an array of particles, one per row, which takes in
+    the observations of evidence one at a time (from any iterable, which may be
+    endless) and yields the particles and their normalized weights after each.
+    P_transition_sample(particles, rng) samples the next state of every particle
+    and P_sensor(e, particles) is the likelihood of e in the state of each. The
+    particles are resampled, by resampling (systematic_resample by default),
+    whenever their effective sample size falls below resample_threshold times
+    their number, so a threshold of 1 resamples after all but uniform weights.
+    rng is the NumPy generator to sample with, by default one seeded from random.
+    >>> steps = particle_filter([1, 1], np.zeros(4, dtype=int),
+    ...     lambda x, rng: x + 1, lambda e, x: np.array([1., 1., 1., 2.]))
+    >>> [(x.tolist(), w.round(3).tolist()) for x, w in steps]
+    [([1, 1, 1, 1], [0.2, 0.2, 0.2, 0.4]), ([2, 2, 2, 2], [0.143, 0.143, 0.143, 0.571])]
+    """
+    resampling = resampling or systematic_resample
+    rng = numpy_rng(rng)
+    N = len(particles)
+    weights = np.full(N, 1 / N)
+    for e in evidence:
+        particles = P_transition_sample(particles, rng)
+        weights = weights * P_sensor(e, particles)
+        total = weights.sum()
+        # with no particle consistent with e, start again from uniform weights
+        weights = weights / total if total > 0 else np.full(N, 1 / N)
+        if effective_sample_size(weights) < resample_threshold * N:
+            particles = particles[resampling(weights, rng)]
+            weights = np.full(N, 1 / N)
+        yield particles, weights
+
+
+def effective_sample_size(weights):
+    """The number of equally weighted particles that the normalized weights are worth."""
+    return 1 / np.sum(np.square(weights))
+
+
+def systematic_resample(weights, rng=None):
+    """Pick len(weights) indices in proportion to the normalized weights, at
+    evenly spaced positions of their cumulative sum after a single random offset.
+    >>> systematic_resample(np.array([0.5, 0.5, 0, 0])).tolist()
+    [0, 0, 1, 1]"""
+    N = len(weights)
+    return search_cumulative(weights, (numpy_rng(rng).random() + np.arange(N)) / N)
+
+
+def stratified_resample(weights, rng=None):
+    """Pick len(weights) indices in proportion to the normalized weights, at one
+    random position of their cumulative sum within each of len(weights) equal strata."""
+    N = len(weights)
+    return search_cumulative(weights, (numpy_rng(rng).random(N) + np.arange(N)) / N)
+
+
+def multinomial_resample(weights, rng=None):
+    """Pick len(weights) indices independently in proportion to the normalized weights."""
+    return search_cumulative(weights, numpy_rng(rng).random(len(weights)))
+
+
+def search_cumulative(weights, positions):
+    """The indices of the weights whose share of the cumulative sum contains each position."""
+    indices = np.searchsorted(np.cumsum(weights), positions, side='right')
+    return np.minimum(indices, len(weights) - 1)
+
+
+def particle_filtering(e, N, HMM, rng=None):
+    """Particle filtering of one observation e with N particles over the states
+    of HMM, named 'A', 'B', and so on, started from the prior of HMM; rng is
+    the NumPy generator to sample with, by default one seeded from random."""
+    rng = numpy_rng(rng)
+    cumulative_T = np.cumsum(HMM.T, axis=1)
+
+    def P_transition_sample(particles, rng):
+        u = rng.random(len(particles))[:, np.newaxis]
+        return np.minimum((u >= cumulative_T[particles]).sum(axis=1), len(HMM.T) - 1)
+
+    def P_sensor(e, particles):
+        return HMM.O[HMM.observation(e)][particles]
+
+    particles = rng.choice(len(HMM.T), N, p=normalize(HMM.prior))
+    particles, _ = next(particle_filter([e], particles, P_transition_sample, P_sensor,
+                                        resample_threshold=1, rng=rng))
+    return [chr(ord('A') + i) for i in particles]
 
 
 # _________________________________________________________________________
@@ -805,7 +1414,9 @@ def particle_filtering(e, N, HMM):
 
 class MCLmap:
     """Map which provides probability distributions and sensor readings.
-    Consists of discrete cells which are either an obstacle or empty"""
+    Consists of discrete cells which are either an obstacle or empty.
+    The range that each sensor reads from each cell and orientation is
+    precomputed into the array distances."""
 
     def __init__(self, m):
         self.m = m
@@ -813,6 +1424,26 @@ class MCLmap:
         self.ncols = len(m[0])
         # list of empty spaces in the map
         self.empty = [(i, j) for i in range(self.nrows) for j in range(self.ncols) if not m[i][j]]
+        self.distances = self.ray_cast_table()
+
+    def ray_cast_table(self):
+        """Return the array of the distances to the nearest obstacle or map boundary from
+        each cell (counting the cell itself, if empty) towards each direction 0N 1E 2S 3W"""
+        free = np.logical_not(self.m)
+        distances = np.zeros((self.nrows, self.ncols, 4), dtype=int)
+        for i in range(self.nrows):  # north and south, sweeping the rows from each end
+            above = distances[i - 1, :, 0] if i > 0 else 0
+            distances[i, :, 0] = free[i] * (1 + above)
+            k = self.nrows - 1 - i
+            below = distances[k + 1, :, 2] if k < self.nrows - 1 else 0
+            distances[k, :, 2] = free[k] * (1 + below)
+        for j in range(self.ncols):  # west and east, sweeping the columns from each end
+            left = distances[:, j - 1, 3] if j > 0 else 0
+            distances[:, j, 3] = free[:, j] * (1 + left)
+            k = self.ncols - 1 - j
+            right = distances[:, k + 1, 1] if k < self.ncols - 1 else 0
+            distances[:, k, 1] = free[:, k] * (1 + right)
+        return distances
 
     def sample(self):
         """Returns a random kinematic state possible in the map"""
@@ -822,49 +1453,103 @@ class MCLmap:
         kin_state = pos + (orient,)
         return kin_state
 
+    def samples(self, N, rng=None):
+        """Returns an (N, 3) array of random kinematic states possible in the map"""
+        rng = numpy_rng(rng)
+        pos = np.array(self.empty)[(rng.random(N) * len(self.empty)).astype(int)]
+        orient = (rng.random(N) * 4).astype(int)
+        return np.column_stack([pos, orient])
+
     def ray_cast(self, sensor_num, kin_state):
         """Returns distance to nearest obstacle or map boundary in the direction of sensor"""
-        pos = kin_state[:2]
-        orient = kin_state[2]
+        return int(self.ray_casts(sensor_num, np.array([kin_state]))[0])
+
+    def ray_casts(self, sensor_num, kin_states):
+        """Returns the distances that the sensor reads from each of an (N, 3) array
+        of kinematic states"""
         # sensor layout when orientation is 0 (towards North)
         #  0
         # 3R1
         #  2
-        delta = ((sensor_num % 2 == 0) * (sensor_num - 1), (sensor_num % 2 == 1) * (2 - sensor_num))
-        # sensor direction changes based on orientation
-        for _ in range(orient):
-            delta = (delta[1], -delta[0])
-        range_count = 0
-        while 0 <= pos[0] < self.nrows and 0 <= pos[1] < self.nrows and not self.m[pos[0]][pos[1]]:
-            pos = vector_add(pos, delta)
-            range_count += 1
-        return range_count
+        # so the direction of the sensor is turned clockwise by the orientation
+        rows, cols, orient = kin_states[:, 0], kin_states[:, 1], kin_states[:, 2]
+        inside = (0 <= rows) & (rows < self.nrows) & (0 <= cols) & (cols < self.ncols)
+        distances = self.distances[np.clip(rows, 0, self.nrows - 1),
+                                   np.clip(cols, 0, self.ncols - 1),
+                                   (sensor_num + orient) % 4]
+        return np.where(inside, distances, 0)
 
 
-def monte_carlo_localization(a, z, N, P_motion_sample, P_sensor, m, S=None):
+def monte_carlo_localization(a, z, N, P_motion_sample, P_sensor, m, S=None, rng=None):
     """
     [Figure 25.9]
-    Monte Carlo localization algorithm
+    Monte Carlo localization algorithm, a step of particle_filter with the
+    kinematic states of N particles, the motion a and the sensor readings z.
+    As with the models P_motion_sample and P_sensor, the particles are resampled
+    with the random module, by weighted sampling with replacement, unless a
+    NumPy generator rng is given for systematic resampling.
     """
 
     def ray_cast(sensor_num, kin_state, m):
         return m.ray_cast(sensor_num, kin_state)
 
     M = len(z)
-    S_ = [0] * N
-    W_ = [0] * N
     v = a['v']
     w = a['w']
 
     if S is None:
         S = [m.sample() for _ in range(N)]
 
-    for i in range(N):
-        S_[i] = P_motion_sample(S[i], v, w)
-        W_[i] = 1
-        for j in range(M):
-            z_ = ray_cast(j, S_[i], m)
-            W_[i] = W_[i] * P_sensor(z[j], z_)
+    def motion(particles, rng):
+        return np.array([P_motion_sample(tuple(kin_state.tolist()), v, w)
+                         for kin_state in particles])
+
+    def sensor(z, particles):
+        return np.array([product(P_sensor(z[j], ray_cast(j, tuple(kin_state.tolist()), m))
+                                 for j in range(M))
+                         for kin_state in particles], dtype=float)
+
+    def resample(weights, rng):
+        return search_cumulative(weights, np.array([rng.random() for _ in weights]))
 
-    S = weighted_sample_with_replacement(N, S_, W_)
-    return S
+    resampling = None
+    if rng is None:  # draw from the random module itself
+        resampling, rng = resample, random
+    S, _ = next(particle_filter([z], np.array(S), motion, sensor, resample_threshold=1,
+                                resampling=resampling, rng=rng))
+    return [tuple(kin_state.tolist()) for kin_state in S]
+
+
+def localization_filter(steps, N, P_motion_sample, P_sensor, m, S=None, rng=None,
+                        resample_threshold=1):
+    """
+    [Figure 25.9]
+    Monte Carlo localization on map m, as particle_filter over an (N, 3) array
+    of kinematic states, for a stream of steps (a, z) of motions and sensor
+    readings; yield the array of particles after each step. Unlike the models of
+    monte_carlo_localization, P_motion_sample(S, v, w, rng) moves every kinematic
+    state of S at once, and P_sensor(z, z_) gives the likelihoods of the reading z
+    of a sensor given the array z_ of its ranges from each particle, which are
+    looked up in the ray-cast table of m. rng is the NumPy generator to sample
+    with, by default one seeded from random.
+    """
+    rng = numpy_rng(rng)
+    S = m.samples(N, rng) if S is None else np.asarray(S)
+    motion = {}
+
+    def readings():
+        for a, z in steps:
+            motion.update(a)
+            yield z
+
+    def transition(S, rng):
+        return P_motion_sample(S, motion['v'], motion['w'], rng)
+
+    def sensor(z, S):
+        W = np.ones(len(S))
+        for j in range(len(z)):
+            W *= P_sensor(z[j], m.ray_casts(j, S))
+        return W
+
+    for S, _ in particle_filter(readings(), S, transition, sensor, resample_threshold, rng=rng):
+        yield S
@@ -3,7 +3,6 @@
 import copy
 import random
 from collections import defaultdict
-from functools import reduce
 
 import numpy as np
 
@@ -532,14 +531,21 @@ def make_factor(var, e, bn):
     is the pointwise product of these factors for bn's variables.
     """
     node = bn.variable_node(var)
-    variables = [X for X in [var] + node.parents if X not in e]
-    cpt = {event_values(e1, variables): node.p(e1[var], e1)
-           for e1 in all_events(variables, bn, e)}
-    return Factor(variables, cpt)
+    variables = [var] + node.parents
+    domains = [bn.variable_values(X) for X in variables]
+    ptrue = np.empty([len(domain) for domain in domains[1:]])
+    for values, p in node.cpt.items():
+        ptrue[tuple(domain.index(v) for v, domain in zip(values, domains[1:]))] = p
+    table = np.stack([ptrue if value else 1 - ptrue for value in domains[0]])
+    # fix the variables of e to their values, which drops their axes
+    index = tuple(domain.index(e[X]) if X in e else slice(None)
+                  for X, domain in zip(variables, domains))
+    return Factor([X for X in variables if X not in e], table[index],
+                  [domain for X, domain in zip(variables, domains) if X not in e])
 
 
 def pointwise_product(factors, bn):
-    return reduce(lambda f, g: f.pointwise_product(g, bn), factors)
+    return factor_product(factors)
 
 
 def sum_out(var, factors, bn):
@@ -547,31 +553,69 @@ def sum_out(var, factors, bn):
     result, var_factors = [], []
     for f in factors:
         (var_factors if var in f.variables else result).append(f)
-    result.append(pointwise_product(var_factors, bn).sum_out(var, bn))
+    result.append(factor_product(var_factors, [var]))
     return result
 
 
+def factor_product(factors, eliminated=()):
+    """
+    Return the pointwise product of factors with the variables in eliminated
+    summed out, as a single numpy.einsum over the tables of the factors, which
+    broadcasts them along the variables they lack.
+    >>> f = make_factor('Alarm', dict(Burglary=T), burglary)
+    >>> g = make_factor('JohnCalls', dict(JohnCalls=T), burglary)
+    >>> h = factor_product([f, g], ['Alarm'])
+    >>> h.variables, round(h.p(dict(Earthquake=T)), 4)
+    (['Earthquake'], 0.8575)
+    """
+    variables, domains = [], {}
+    for f in factors:
+        for X, domain in zip(f.variables, f.domains):
+            if X not in domains:
+                variables.append(X)
+                domains[X] = domain
+    axis = {X: i for i, X in enumerate(variables)}
+    operands = []
+    for f in factors:
+        operands += [f.table, [axis[X] for X in f.variables]]
+    variables = [X for X in variables if X not in eliminated]
+    table = np.einsum(*operands, [axis[X] for X in variables], optimize=len(factors) > 2)
+    return Factor(variables, table, [domains[X] for X in variables])
+
+
 class Factor:
-    """A factor in a joint distribution."""
+    """
+    A factor in a joint distribution, tabulated as an array with one axis per
+    variable, indexed by the position of each value in the domain of its variable.
+    """
 
-    def __init__(self, variables, cpt):
-        self.variables = variables
-        self.cpt = cpt
+    def __init__(self, variables, cpt, domains=None):
+        """
+        cpt is either that array or a dict {(value of each variable, ...): p, ...}.
+        domains lists the values of each variable, which are boolean by default.
+        """
+        self.variables = list(variables)
+        self.domains = domains or [[True, False] for _ in self.variables]
+        if isinstance(cpt, dict):
+            table = np.zeros([len(domain) for domain in self.domains])
+            for values, p in cpt.items():
+                table[tuple(domain.index(v) for v, domain in zip(values, self.domains))] = p
+            cpt = table
+        self.table = np.asarray(cpt, dtype=float)
+
+    @property
+    def cpt(self):
+        """My table as a dict {(value of each variable, ...): p, ...}."""
+        return {tuple(domain[i] for i, domain in zip(index, self.domains)): float(p)
+                for index, p in np.ndenumerate(self.table)}
 
     def pointwise_product(self, other, bn):
         """Multiply two factors, combining their variables."""
-        variables = list(set(self.variables) | set(other.variables))
-        cpt = {event_values(e, variables): self.p(e) * other.p(e)
-               for e in all_events(variables, bn, {})}
-        return Factor(variables, cpt)
+        return factor_product([self, other])
 
     def sum_out(self, var, bn):
         """Make a factor eliminating var by summing over its values."""
-        variables = [X for X in self.variables if X != var]
-        cpt = {event_values(e, variables): sum(self.p(extend(e, var, val))
-                                               for val in bn.variable_values(var))
-               for e in all_events(variables, bn, {})}
-        return Factor(variables, cpt)
+        return factor_product([self], [var])
 
     def normalize(self):
         """Return my probabilities; must be down to one variable."""
@@ -581,7 +625,8 @@ class Factor:
 
     def p(self, e):
         """Look up my value tabulated for e."""
-        return self.cpt[event_values(e, self.variables)]
+        index = tuple(domain.index(e[X]) for X, domain in zip(self.variables, self.domains))
+        return float(self.table[index])
 
 
 def all_events(variables, bn, e):
@@ -613,11 +658,16 @@ sprinkler = BayesNet([
 # 13.4.1 Direct sampling methods
 
 
-def prior_sample(bn):
+def prior_sample(bn, batch_size=None, seed=None):
     """
     Randomly sample from bn's full joint distribution. The result
     is a {variable: value} dict. [Figure 13.15]
+    With a batch_size, the result is a {variable: array of batch_size values}
+    dict of that many samples, drawn at once by weighted_samples from
+    a NumPy generator seeded by seed.
     """
+    if batch_size is not None:
+        return weighted_samples(bn, {}, batch_size, np.random.default_rng(seed))[0]
     event = {}
     for node in bn.nodes:
         event[node.variable] = node.sample(event)
@@ -627,18 +677,34 @@ def prior_sample(bn):
 # _________________________________________________________________________
 
 
-def rejection_sampling(X, e, bn, N=10000):
+def rejection_sampling(X, e, bn, N=10000, batch_size=None, seed=None):
     """
     [Figure 13.16]
     Estimate the probability distribution of variable X given
     evidence e in BayesNet bn, using N samples.
     Raises a ZeroDivisionError if all the N samples are rejected,
     i.e., inconsistent with e.
+    With a batch_size, the samples are drawn batch_size at a time by
+    weighted_samples, from a NumPy generator seeded by seed.
     >>> random.seed(47)
     >>> rejection_sampling('Burglary', dict(JohnCalls=T, MaryCalls=T),
     ...   burglary, 10000).show_approx()
     'False: 0.7, True: 0.3'
+    >>> rejection_sampling('Burglary', dict(JohnCalls=T, MaryCalls=T),
+    ...   burglary, 100000, batch_size=100000, seed=47).show_approx()
+    'False: 0.744, True: 0.256'
     """
+    if batch_size is not None:
+        rng, counts = np.random.default_rng(seed), {x: 0 for x in bn.variable_values(X)}
+        tables = cpt_tables(bn)
+        for n in batches(N, batch_size):
+            samples = weighted_samples(bn, {}, n, rng, tables)[0]
+            consistent = np.ones(n, dtype=bool)
+            for var, value in e.items():
+                consistent &= samples[var] == value
+            for x in counts:
+                counts[x] += int(np.count_nonzero(samples[X][consistent] == x))
+        return ProbDist(X, counts)
     counts = {x: 0 for x in bn.variable_values(X)}  # bold N in [Figure 13.16]
     for j in range(N):
         sample = prior_sample(bn)  # boldface x in [Figure 13.16]
@@ -656,16 +722,29 @@ def consistent_with(event, evidence):
 # _________________________________________________________________________
 
 
-def likelihood_weighting(X, e, bn, N=10000):
+def likelihood_weighting(X, e, bn, N=10000, batch_size=None, seed=None):
     """
     [Figure 13.17]
     Estimate the probability distribution of variable X given
     evidence e in BayesNet bn.
+    With a batch_size, the samples are drawn batch_size at a time by
+    weighted_samples, from a NumPy generator seeded by seed.
     >>> random.seed(1017)
     >>> likelihood_weighting('Burglary', dict(JohnCalls=T, MaryCalls=T),
     ...   burglary, 10000).show_approx()
     'False: 0.702, True: 0.298'
+    >>> likelihood_weighting('Burglary', dict(JohnCalls=T, MaryCalls=T),
+    ...   burglary, 100000, batch_size=100000, seed=1017).show_approx()
+    'False: 0.76, True: 0.24'
     """
+    if batch_size is not None:
+        rng, W = np.random.default_rng(seed), {x: 0 for x in bn.variable_values(X)}
+        tables = cpt_tables(bn)
+        for n in batches(N, batch_size):
+            samples, weights = weighted_samples(bn, e, n, rng, tables)
+            for x in W:
+                W[x] += float(weights[samples[X] == x].sum())
+        return ProbDist(X, W)
 
     W = {x: 0 for x in bn.variable_values(X)}
     for j in range(N):
@@ -692,6 +771,37 @@ def weighted_sample(bn, e):
     return event, w
 
 
+def cpt_tables(bn):
+    """The arrays of P(X=true) along the axes of the parents of X, for each
+    node X of bn in order, compiled once for many calls of weighted_samples."""
+    return [make_factor(node.variable, {}, bn).table[0] for node in bn.nodes]
+
+
+def weighted_samples(bn, e, N, rng=np.random, tables=None):
+    """
+    Sample N events from bn that are consistent with the evidence e at once,
+    one variable at a time in the order of bn.nodes, each as an array of
+    N values drawn with the probabilities looked up for the values of its
+    parents in tables, by default cpt_tables(bn); return the {variable: array}
+    events and the array of their weights, as weighted_sample does for one event.
+    """
+    samples, weights = {}, np.ones(N)
+    for node, ptrue in zip(bn.nodes, tables or cpt_tables(bn)):
+        ptrue = ptrue[tuple(np.where(samples[parent], 0, 1) for parent in node.parents)]
+        if node.variable in e:
+            weights *= ptrue if e[node.variable] else 1 - ptrue
+            samples[node.variable] = np.full(N, e[node.variable])
+        else:
+            samples[node.variable] = rng.random(N) < ptrue
+    return samples, weights
+
+
+def batches(N, batch_size):
+    """Yield the sizes of the batches of at most batch_size that make up N."""
+    for start in range(0, N, batch_size):
+        yield min(batch_size, N - start)
+
+
 # _________________________________________________________________________
 # 13.4.2 Inference by Markov chain simulation
 
@@ -136,6 +136,17 @@ def test_tt_true():
     assert tt_true('(A | (B & C)) <=> ((A | B) & (A | C))')
 
 
+def test_pl_compile():
+    symbols = [A, B, C]
+    for exp in [A & ~B, A | (B & C), A | '==>' | B, A | '<=>' | (B ^ C), (A | '<==' | B) & True]:
+        f = pl_compile(exp, symbols)
+        for values, ones in model_batches(len(symbols), batch_bits=2):
+            bits = f(values, ones)
+            for i in range(ones.bit_length()):
+                model = {s: bool(v >> i & 1) for s, v in zip(symbols, values)}
+                assert bool(bits >> i & 1) == pl_true(exp, model)
+
+
 def test_dpll_satisfiable():
     assert dpll_satisfiable(A & ~B & C & (A | ~D) & (~E | ~D) & (C | ~D) & (~A | ~F) & (E | ~F) & (~D | ~F) &
                             (B | ~C | D) & (A | ~E | F) & (~A | E | D)) == \
@@ -158,6 +169,29 @@ def test_cdcl_satisfiable():
     assert cdcl_satisfiable(P & ~P) is False
 
 
+def test_sat_solver():
+    solver = SATSolver([A | B, ~A | C, ~B | D])
+    assert solver.solve(assumptions=[~C])[D]
+    assert solver.solve(assumptions=[~C, ~D]) is False
+    solver.add_clause(~D)
+    assert solver.solve() == {A: True, B: False, C: True, D: False}
+    assert solver.entails(C) and solver.entails(A & ~B)
+    assert not solver.entails(E)
+    solver.add_clause(~C)
+    assert solver.solve() is False
+    kb = WumpusKB(2)
+    kb.make_percept_sentence([None, None, None, None, None], 0)
+    assert kb.ask_if_true(~pit(1, 2) & ~wumpus(2, 1))
+    assert not kb.ask_if_true(pit(2, 2)) and not kb.ask_if_true(~pit(2, 2))
+    # the clauses of answered queries do not pile up
+    n = len(kb.solver.clauses)
+    for _ in range(50):
+        assert kb.ask_if_true(~pit(1, 2) & ~wumpus(2, 1))
+        assert kb.ask_if_true(pit(2, 2) | wumpus(2, 2))
+        assert not kb.ask_if_true(pit(2, 2) | ~wumpus(2, 2))
+    assert len(kb.solver.clauses) <= 2 * n + 10
+
+
 def test_find_pure_symbol():
     assert find_pure_symbol([A, B, C], [A | ~B, ~B | ~C, C | A]) == (A, True)
     assert find_pure_symbol([A, B, C], [~A | ~B, ~B | ~C, C | A]) == (B, False)
@@ -189,6 +223,23 @@ def test_unify():
     assert unify(expr('P(x, A, F(G(y)))'), expr('P(F(z), z, F(u))')) == {x: F(A), z: A, u: G(y)}
 
 
+def test_bindings():
+    b = Bindings()
+    assert b.unify(expr('P(x, F(y))'), expr('P(y, F(A))'))
+    assert subst(b, expr('Q(x, y)')) == expr('Q(A, A)')
+    mark = b.mark()
+    assert b.unify(z, B)
+    b.undo(mark)
+    assert b.resolve(z) == z
+    assert not b.unify(expr('P(x)'), expr('P(B)'))
+    assert b.as_dict() == {x: A, y: A}
+    assert unify(x, F(x), {}) is None
+    assert unify(x, F(y), {}, occurs_check=False) == {x: F(y)}
+    assert Bindings(occurs_check=False).unify(x, F(x))
+    for p in [unification_chain(n) for n in range(1, 6)]:
+        assert unify(*p) == unify_naive(*p, {})
+
+
 def test_unify_mm():
     assert unify_mm(x, x) == {}
     assert unify_mm(x, 3) == {x: 3}
@@ -306,6 +357,10 @@ def test_pl_resolution():
     assert pl_resolution(horn_clauses_KB, B)
     assert not pl_resolution(horn_clauses_KB, P)
     assert not pl_resolution(definite_clauses_KB, P)
+    kb = WumpusKB(3)
+    kb.make_percept_sentence([None, None, None, None, None], 0)
+    assert pl_resolution(kb, ~pit(1, 2) & ~wumpus(2, 1))
+    assert not pl_resolution(kb, pit(2, 2))
 
 
 def test_standardize_variables():
@@ -325,6 +380,32 @@ def test_fol_bc_ask():
     assert repr(test_ask('Human(x)')) == '[{x: Mac}, {x: MrsMac}]'
     assert repr(test_ask('Rabbit(x)')) == '[{x: MrsRabbit}, {x: Pete}]'
     assert repr(test_ask('Criminal(x)', crime_kb)) == '[{x: West}]'
+    # the answers are resolved when found, so they survive backtracking
+    q = expr('Ancestor(P0, x)')
+    answers = [subst(a, q) for a in fol_bc_ask(ancestor_kb(5), q)]
+    assert answers == [subst(a, q) for a in fol_bc_naive_ask(ancestor_kb(5), q)]
+    assert answers == [expr('Ancestor(P0, P{})'.format(i)) for i in range(1, 6)]
+
+
+def test_fol_bc_tabled_ask():
+    def test_ask(query, kb=None):
+        q = expr(query)
+        answers = fol_bc_tabled_ask(kb or test_kb, q)
+        return sorted([dict((x, v) for x, v in list(a.items()) if x in variables(q))
+                       for a in answers], key=repr)
+
+    assert repr(test_ask('Farmer(x)')) == '[{x: Mac}]'
+    assert repr(test_ask('Human(x)')) == '[{x: Mac}, {x: MrsMac}]'
+    assert repr(test_ask('Rabbit(x)')) == '[{x: MrsRabbit}, {x: Pete}]'
+    assert repr(test_ask('Criminal(x)', crime_kb)) == '[{x: West}]'
+    # left recursion terminates, and tables are reused until the KB changes
+    kb = FolKB(map(expr, ['(Path(x, y) & Edge(y, z)) ==> Path(x, z)', 'Edge(x, y) ==> Path(x, y)',
+                          'Edge(A, B)', 'Edge(B, C)', 'Edge(C, A)']), tabled=True)
+    assert repr(test_ask('Path(B, x)', kb)) == '[{x: A}, {x: B}, {x: C}]'
+    assert kb.table.complete
+    kb.tell(expr('Edge(C, D)'))
+    assert not kb.table.complete
+    assert repr(test_ask('Path(B, x)', kb)) == '[{x: A}, {x: B}, {x: C}, {x: D}]'
 
 
 def test_fol_fc_ask():
@@ -341,6 +422,15 @@ def test_fol_fc_ask():
     assert repr(test_ask('Rabbit(x)')) == '[{x: MrsRabbit}, {x: Pete}]'
 
 
+def test_fol_fc_ask_recursive_rules():
+    kb = FolKB(map(expr, ['Edge(N{}, N{})'.format(i, i + 1) for i in range(8)] +
+                   ['Edge(x, y) ==> Path(x, y)',
+                    '(Path(x, y) & Edge(y, z)) ==> Path(x, z)']))
+    answers = list(fol_fc_ask(kb, expr('Path(N0, x)')))
+    assert sorted(repr(a[x]) for a in answers) == ['N{}'.format(i) for i in range(1, 9)]
+    assert len([c for c in kb.clauses if c.op == 'Path']) == 8 * 9 // 2
+
+
 def test_d():
     assert d(x * x - x, x) == 2 * x - 1
 
@@ -383,6 +473,11 @@ def test_SAT_plan():
                   (1, 0): {'Right': (1, 0), 'Up': (1, 0), 'Left': (1, 0), 'Down': (1, 0)},
                   (1, 1): {'Left': (1, 0), 'Up': (0, 1)}}
     assert SAT_plan((0, 0), transition, (1, 1), 4) == ['Right', 'Down']
+    assert SAT_plan((0, 0), transition, (1, 1), 4, SAT_solver=cdcl_satisfiable) == ['Right', 'Down']
+    assert SAT_plan((0, 0), transition, (1, 1), 4, t_min=3) == ['Right', 'Down', 'Up', 'Down']
+    assert SAT_plan((0, 0), transition, (1, 1), 4, processes=2) == ['Right', 'Down']
+    assert SAT_plan((0, 0), transition, (0, 0), 4, processes=2) == []
+    assert SAT_plan((1, 0), transition, (1, 1), 3, processes=2) is None
 
 
 if __name__ == '__main__':
@@ -169,6 +169,19 @@ def test_unify():
     assert unify(expr('American(x) & Weapon(B)'), expr('American(A) & Weapon(y)')) == {x: A, y: B}
 
 
+def test_bindings():
+    b = Bindings()
+    assert b.unify(expr('P(x, F(y))'), expr('P(y, F(A))'))
+    assert subst(b, expr('Q(x, y)')) == expr('Q(A, A)')
+    mark = b.mark()
+    assert b.unify(z, B)
+    b.undo(mark)
+    assert b.resolve(z) == z
+    assert unify(x, F(x), {}) is None
+    assert unify(x, F(y), {}, occurs_check=False) == {x: F(y)}
+    assert Bindings(occurs_check=False).unify(x, F(x))
+
+
 def test_pl_fc_entails():
     assert pl_fc_entails(horn_clauses_KB, expr('Q'))
     assert pl_fc_entails(definite_clauses_KB, expr('G'))
@@ -297,6 +310,27 @@ def test_fol_bc_ask():
     assert repr(test_ask('Criminal(x)', crime_kb)) == '[{x: West}]'
 
 
+def test_fol_bc_tabled_ask():
+    def test_ask(query, kb=None):
+        q = expr(query)
+        answers = fol_bc_tabled_ask(kb or test_kb, q)
+        return sorted([dict((x, v) for x, v in list(a.items()) if x in variables(q))
+                       for a in answers], key=repr)
+
+    assert repr(test_ask('Farmer(x)')) == '[{x: Mac}]'
+    assert repr(test_ask('Human(x)')) == '[{x: Mac}, {x: MrsMac}]'
+    assert repr(test_ask('Rabbit(x)')) == '[{x: MrsRabbit}, {x: Pete}]'
+    assert repr(test_ask('Criminal(x)', crime_kb)) == '[{x: West}]'
+    # left recursion terminates, and tables are reused until the KB changes
+    kb = FolKB(map(expr, ['(Path(x, y) & Edge(y, z)) ==> Path(x, z)', 'Edge(x, y) ==> Path(x, y)',
+                          'Edge(A, B)', 'Edge(B, C)', 'Edge(C, A)']), tabled=True)
+    assert repr(test_ask('Path(B, x)', kb)) == '[{x: A}, {x: B}, {x: C}]'
+    assert kb.table.complete
+    kb.tell(expr('Edge(C, D)'))
+    assert not kb.table.complete
+    assert repr(test_ask('Path(B, x)', kb)) == '[{x: A}, {x: B}, {x: C}, {x: D}]'
+
+
 def test_fol_fc_ask():
     def test_ask(query, kb=None):
         q = expr(query)
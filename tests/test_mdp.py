@@ -102,6 +102,78 @@ def test_best_policy():
                                                                  ['<', '<', '<', '<', '<', '.']]
 
 
+def test_gauss_seidel_and_prioritized_sweeping():
+    for env in [sequential_decision_environment, sequential_decision_environment_1,
+                sequential_decision_environment_2, sequential_decision_environment_3]:
+        U = value_iteration(env, 1e-8)
+        for solve in [gauss_seidel_value_iteration, prioritized_sweeping]:
+            U1 = solve(env, .001)
+            assert U1 == pytest.approx(U, abs=.001 / env.gamma)
+            if env is not sequential_decision_environment_3:  # which has ties
+                assert best_policy(env, U1) == best_policy(env, U)
+
+    random.seed(7)
+    maze = GridMDP([[None if random.random() < 0.25 else -0.04 for _ in range(12)] for _ in range(11)] + [[1] * 12],
+                   terminals=[(x, 0) for x in range(12)], gamma=0.95)
+    assert mdp_predecessors(maze)[(0, 0)][(0, 1)] == 0.8
+    assert mdp_predecessors(maze)[(2, 11)] == {(2, 11): 1.0}  # walled in
+    U = value_iteration(maze, 1e-8)
+    assert gauss_seidel_value_iteration(maze) == pytest.approx(U, abs=.001 / maze.gamma)
+    assert prioritized_sweeping(maze) == pytest.approx(U, abs=.001 / maze.gamma)
+
+
+def test_sparse_mdp():
+    mdp = SparseMDP(sequential_decision_environment)
+    assert mdp.P[0].shape == (11, 11)
+    assert mdp.available.sum(axis=1).tolist() == [9, 9, 9, 9, 2]  # the four moves and None in the terminals
+    for env in [sequential_decision_environment, sequential_decision_environment_1,
+                sequential_decision_environment_2, sequential_decision_environment_3]:
+        U = value_iteration(env, .01)
+        assert sparse_value_iteration(env, .01) == pytest.approx(U)
+        U = value_iteration(env, 1e-8)
+        pi = sparse_policy_iteration(env)
+        # the policy is optimal, up to ties
+        assert all(expected_utility(pi[s], s, U, env) == pytest.approx(expected_utility(a, s, U, env))
+                   for s, a in best_policy(env, U).items())
+    assert sparse_policy_iteration(sequential_decision_environment) == policy_iteration(sequential_decision_environment)
+
+    random.seed(5)
+    maze = GridMDP([[None if random.random() < 0.2 else -0.04 for _ in range(15)] for _ in range(14)] + [[1] * 15],
+                   terminals=[(x, 0) for x in range(15)])
+    assert sparse_value_iteration(maze) == pytest.approx(value_iteration(maze), abs=1e-6)
+
+
+def test_array_grid_mdp():
+    for env in [sequential_decision_environment, sequential_decision_environment_1,
+                sequential_decision_environment_2, sequential_decision_environment_3]:
+        mdp = ArrayGridMDP(env.grid[::-1], env.terminals, gamma=env.gamma)
+        assert mdp.states == env.states
+        assert all(mdp.R(s) == env.R(s) and mdp.actions(s) == env.actions(s) for s in env.states)
+        assert all(mdp.T(s, a) == env.T(s, a) for s in env.states for a in env.actions(s))
+        U = grid_value_iteration(mdp, .01)
+        assert mdp.to_dict(U) == pytest.approx(value_iteration(env, .01))
+        assert mdp.to_array(mdp.to_dict(U)) == pytest.approx(U, nan_ok=True)
+        assert mdp.to_arrows(mdp.best_actions(U)) == env.to_arrows(best_policy(env, mdp.to_dict(U)))
+        # the policy is optimal, up to ties
+        pi, EU = grid_policy_iteration(mdp), mdp.expected_utilities(grid_value_iteration(mdp, 1e-8))
+        y, x = np.nonzero(pi >= 0)
+        assert EU[pi[y, x], y, x] == pytest.approx(EU.max(axis=0)[y, x])
+
+    mdp = ArrayGridMDP([[-0.04, -0.04, -0.04, +1],
+                        [-0.04, None, -0.04, -1],
+                        [-0.04, -0.04, -0.04, -0.04]], terminals=[(3, 2), (3, 1)])
+    assert mdp.to_grid(mdp.rewards) == [[-0.04, -0.04, -0.04, 1], [-0.04, None, -0.04, -1], [-0.04, -0.04, -0.04, -0.04]]
+    assert mdp.to_arrows(grid_policy_iteration(mdp)) == [['>', '>', '>', '.'], ['^', None, '^', '.'], ['^', '>', '^', '<']]
+
+    rng = np.random.RandomState(3)
+    grid = np.where(rng.rand(30, 40) < 0.2, np.nan, -0.04)
+    grid[0, 39] = 1
+    mdp = ArrayGridMDP(grid, terminals=[(39, 29)])
+    assert mdp.rewards[29, 39] == 1 and len(mdp.states) == mdp.free.sum()
+    U = grid_value_iteration(mdp)
+    assert mdp.to_dict(U) == pytest.approx(sparse_value_iteration(mdp))
+
+
 def test_transition_model():
     transition_model = {'a': {'plan1': [(0.2, 'a'), (0.3, 'b'), (0.3, 'c'), (0.2, 'd')],
                               'plan2': [(0.4, 'a'), (0.15, 'b'), (0.45, 'c')],
@@ -164,5 +236,36 @@ def test_pomdp_value_iteration2():
     assert -77.31 < sum_ < -77.25 or 799 < sum_ < 800
 
 
+def test_point_based_value_iteration():
+    t_prob = [[[0.5, 0.5], [0.5, 0.5]], [[0.5, 0.5], [0.5, 0.5]], [[1.0, 0.0], [0.0, 1.0]]]
+    e_prob = [[[0.5, 0.5], [0.5, 0.5]], [[0.5, 0.5], [0.5, 0.5]], [[0.85, 0.15], [0.15, 0.85]]]
+    rewards = [[-100, 10], [10, -100], [-1, -1]]
+    pomdp = POMDP(('0', '1', '2'), t_prob, e_prob, rewards, ('0', '1'), 0.95)
+
+    arrays = ArrayPOMDP(pomdp)
+    b = arrays.belief_update(np.array([0.5, 0.5]), 2, 0)
+    assert b == pytest.approx([0.85, 0.15])
+    assert arrays.belief_update(b, 2, 0) == pytest.approx([0.85 ** 2 / (0.85 ** 2 + 0.15 ** 2),
+                                                           0.15 ** 2 / (0.85 ** 2 + 0.15 ** 2)])
+    B = arrays.sample_beliefs(20, np.random.RandomState(0))
+    assert B.shape == (20, 2) and B.sum(axis=1) == pytest.approx(np.ones(20))
+    assert sum(map(len, point_based_value_iteration(pomdp, np.int64(20), seed=0).values())) >= 1
+
+    def value(U, b):
+        return max(np.dot(alpha, b) for alphas in U.values() for alpha in alphas)
+
+    grid = np.c_[np.linspace(0, 1, 21), 1 - np.linspace(0, 1, 21)]
+    for U in [point_based_value_iteration(pomdp, grid, epsilon=0.01),
+              point_based_value_iteration(pomdp, 30, epsilon=0.01, seed=1),
+              perseus(pomdp, grid, epsilon=0.01, seed=1)]:
+        assert set(U) <= set(pomdp.actions)
+        assert 19.3 < value(U, [0.5, 0.5]) < 19.4  # listen, then act
+        assert 28.3 < value(U, [1, 0]) < 28.4
+        assert value(U, [1, 0]) == pytest.approx(value(U, [0, 1]))
+    U = point_based_value_iteration(pomdp, grid, epsilon=0.01, lp=True)
+    assert value(U, [0.3, 0.7]) == pytest.approx(value(point_based_value_iteration(pomdp, grid, epsilon=0.01),
+                                                       [0.3, 0.7]))
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -1,3 +1,5 @@
+import itertools
+
 import pytest
 
 from probability import *
@@ -163,6 +165,68 @@ def test_elimination_ask():
         burglary).show_approx() == 'False: 0.944, True: 0.0561'
 
 
+def test_factor():
+    f = make_factor('Alarm', dict(JohnCalls=T), burglary)
+    assert f.variables == ['Alarm', 'Burglary', 'Earthquake']
+    assert f.table.shape == (2, 2, 2)
+    assert f.p(dict(Alarm=F, Burglary=T, Earthquake=F)) == pytest.approx(0.06)
+    g = f.sum_out('Alarm', burglary)
+    assert g.cpt == pytest.approx({(T, T): 1, (T, F): 1, (F, T): 1, (F, F): 1})
+    h = Factor(['Alarm'], {(T,): 0.9, (F,): 0.05}).pointwise_product(f, burglary)
+    assert h.p(dict(Alarm=T, Burglary=T, Earthquake=F)) == pytest.approx(0.9 * 0.94)
+
+
+def random_network(n, seed):
+    random.seed(seed)
+    specs = []
+    for i in range(n):
+        parents = random.sample(['X{}'.format(j) for j in range(i)], min(i, 3))
+        cpt = {values: random.uniform(0.05, 0.95) for values in itertools.product((T, F), repeat=len(parents))}
+        specs.append(('X{}'.format(i), ' '.join(parents), cpt))
+    return BayesNet(specs)
+
+
+def test_elimination_ask_random_network():
+    bn = random_network(12, 13)
+    for X, e in [('X0', dict(X11=T)), ('X5', dict(X2=F, X10=T)), ('X11', {})]:
+        p = enumeration_ask(X, e, bn)[T]
+        assert elimination_ask(X, e, bn)[T] == pytest.approx(p)
+        assert elimination_ask(X, e, bn, heuristic=min_degree)[T] == pytest.approx(p)
+        assert elimination_ask(X, e, bn, heuristic=None)[T] == pytest.approx(p)
+
+
+def test_elimination_order():
+    graph = moral_graph(sprinkler)
+    assert graph['Sprinkler'] == {'Cloudy', 'Rain', 'WetGrass'}
+    assert min_fill(graph, 'Cloudy') == 0
+    assert min_fill(graph, 'Sprinkler') == 1
+    assert min_degree(graph, 'WetGrass') == 2
+    assert elimination_order(['Sprinkler', 'Cloudy'], graph) == ['Cloudy', 'Sprinkler']
+
+
+def test_junction_tree():
+    bn = random_network(12, 7)
+    jt = JunctionTree(bn)
+    assert all(any(set([node.variable] + node.parents) <= set(c) for c in jt.cliques) for node in bn.nodes)
+    for e in [{}, dict(X11=T), dict(X11=T, X3=F), dict(X3=T), dict(X11=F, X3=T, X7=T)]:
+        marginals = jt.marginals(e)
+        assert len(jt.messages) == 2 * (len(jt.cliques) - 1)
+        for X in ['X0', 'X5', 'X9']:
+            if X not in e:
+                assert marginals[X][T] == pytest.approx(enumeration_ask(X, e, bn)[T])
+    # only the messages sent away from the clique of X11 change with its evidence
+    messages = dict(jt.messages)
+    jt.calibrate(dict(X11=T, X3=T, X7=T))
+    assert any(jt.messages[edge] is messages[edge] for edge in messages)
+    assert any(jt.messages[edge] is not messages[edge] for edge in messages)
+
+    assert bn.junction_tree is None
+    assert junction_tree_ask('X2', dict(X10=T), bn)[T] == pytest.approx(enumeration_ask('X2', dict(X10=T), bn)[T])
+    assert isinstance(bn.junction_tree, JunctionTree)
+    assert junction_tree_ask('Burglary', dict(JohnCalls=T, MaryCalls=T), burglary).show_approx() == \
+           'False: 0.716, True: 0.284'
+
+
 def test_prior_sample():
     random.seed(42)
     all_obs = [prior_sample(burglary) for x in range(1000)]
@@ -268,6 +332,23 @@ def test_likelihood_weighting2():
         sprinkler, 10000).show_approx() == 'False: 0.833, True: 0.167'
 
 
+def test_batch_sampling():
+    samples = prior_sample(sprinkler, batch_size=10000, seed=3)
+    assert samples['Cloudy'].shape == (10000,)
+    assert samples['Cloudy'].mean() == pytest.approx(0.5, abs=0.02)
+    assert samples['Rain'][samples['Cloudy']].mean() == pytest.approx(0.8, abs=0.02)
+    assert rejection_sampling('Cloudy', dict(Rain=T), sprinkler, 20000,
+                              batch_size=5000, seed=1)[T] == pytest.approx(0.8, abs=0.02)
+    assert likelihood_weighting('Burglary', dict(JohnCalls=T, MaryCalls=T), burglary, 200000,
+                                batch_size=30000, seed=2)[T] == pytest.approx(0.284, abs=0.05)
+    assert likelihood_weighting('Cloudy', dict(Rain=T), sprinkler, 1000, batch_size=300, seed=5).show_approx() == \
+           likelihood_weighting('Cloudy', dict(Rain=T), sprinkler, 1000, batch_size=300, seed=5).show_approx()
+    tables = cpt_tables(burglary)
+    assert [table.shape for table in tables] == [(), (), (2, 2), (2,), (2,)]
+    samples, weights = weighted_samples(burglary, dict(JohnCalls=T), 100, np.random.default_rng(4), tables)
+    assert (weighted_samples(burglary, dict(JohnCalls=T), 100, np.random.default_rng(4))[1] == weights).all()
+
+
 def test_forward_backward():
     umbrella_transition = [[0.7, 0.3], [0.3, 0.7]]
     umbrella_sensor = [[0.9, 0.2], [0.1, 0.8]]
@@ -317,6 +398,63 @@ def test_fixed_lag_smoothing():
     assert rounder(fixed_lag_smoothing(e_t, umbrellaHMM, d, umbrella_evidence, t)) == [0.9939, 0.0061]
 
 
+def test_hmm_n_states():
+    transition = [[0.6, 0.3, 0.1], [0.2, 0.5, 0.3], [0.1, 0.2, 0.7]]
+    sensor = [[0.7, 0.2, 0.1], [0.2, 0.5, 0.3], [0.1, 0.3, 0.6]]  # 3 observations
+    hmm = HiddenMarkovModel(transition, sensor, prior=[0.5, 0.3, 0.2], observations=[0, 1, 2])
+    ev = [0, 2, 1, 2, 2]
+
+    # brute force over all the sequences of states
+    joint = {}
+    for xs in itertools.product(range(3), repeat=len(ev)):
+        p, prev = 1, hmm.prior
+        for x, e in zip(xs, ev):
+            p *= sum(prev[i] * transition[i][x] for i in range(3)) if prev is hmm.prior else transition[prev][x]
+            p *= sensor[e][x]
+            prev = x
+        joint[xs] = p
+    total = sum(joint.values())
+    smoothed = [[sum(p for xs, p in joint.items() if xs[k] == x) / total for x in range(3)] for k in range(len(ev))]
+
+    f, loglik = hmm_forward(hmm, ev)
+    assert loglik == pytest.approx(np.log(total))
+    assert hmm_smooth(hmm, ev) == pytest.approx(np.array(smoothed))
+    assert hmm_smooth(hmm, ev, log=True) == pytest.approx(np.array(smoothed))
+    log_f, log_loglik = hmm_forward(hmm, ev, log=True)
+    assert np.exp(log_f) == pytest.approx(f)
+    assert log_loglik == pytest.approx(loglik)
+
+    path, logp = hmm_viterbi(hmm, ev)
+    best = max(joint, key=joint.get)
+    assert tuple(path) == best
+    assert logp == pytest.approx(np.log(joint[best]))
+    assert viterbi(hmm, ev)[0] == list(best)
+
+    # many sequences at once
+    sequences = [ev, [1, 1, 0, 0, 2], [2, 2, 2, 2, 2]]
+    paths, logps = hmm_viterbi(hmm, sequences)
+    batch = hmm_smooth(hmm, sequences)
+    for k, sequence in enumerate(sequences):
+        assert batch[k] == pytest.approx(hmm_smooth(hmm, sequence))
+        assert list(paths[k]) == list(hmm_viterbi(hmm, sequence)[0])
+
+    # the streaming smoother agrees with smoothing the observations so far
+    for d in (0, 2):
+        smoother = FixedLagSmoother(hmm, d)
+        for t, e in enumerate(ev, 1):
+            estimate = smoother.smooth(e)
+            if t <= d:
+                assert estimate is None
+            else:
+                assert estimate == pytest.approx(hmm_smooth(hmm, ev[:t])[t - d - 1])
+        assert len(smoother.buffer) == smoother.buffer.maxlen == d
+
+    # without observations, True is the first row of the sensor model and anything else the second
+    umbrellaHMM = HiddenMarkovModel([[0.7, 0.3], [0.3, 0.7]], [[0.9, 0.2], [0.1, 0.8]])
+    assert [umbrellaHMM.observation(e) for e in [True, np.True_, False, None, 0, 1]] == [0, 0, 1, 1, 1, 1]
+    assert umbrellaHMM.sensor_dist(0) == [0.1, 0.8]
+
+
 def test_particle_filtering():
     N = 10
     umbrella_evidence = T
@@ -329,6 +467,35 @@ def test_particle_filtering():
     # XXX 'A' and 'B' are really arbitrary names, but I'm letting it stand for now
 
 
+def test_particle_filter():
+    weights = np.array([0.1, 0.2, 0.3, 0.4])
+    assert effective_sample_size(np.full(4, 0.25)) == pytest.approx(4)
+    assert effective_sample_size(np.array([1., 0, 0, 0])) == pytest.approx(1)
+    rng = np.random.default_rng(0)
+    for resampling in (systematic_resample, stratified_resample, multinomial_resample):
+        counts = np.bincount(np.concatenate([resampling(weights, rng) for _ in range(2000)]), minlength=4)
+        assert counts / counts.sum() == pytest.approx(weights, abs=0.02)
+    # systematic resampling keeps each particle floor(N w) or ceil(N w) times
+    counts = np.bincount(systematic_resample(np.array([0.05, 0.15, 0.3, 0.5]), rng), minlength=4)
+    assert all(counts[i] in (int(4 * w), int(4 * w) + 1) for i, w in enumerate([0.05, 0.15, 0.3, 0.5]))
+
+    hmm = HiddenMarkovModel([[0.7, 0.3], [0.3, 0.7]], [[0.9, 0.2], [0.1, 0.8]])
+    evidence = [T, T, F, T, T]
+    cumulative = np.cumsum(hmm.T, axis=1)
+    steps = particle_filter(iter(evidence), rng.choice(2, 20000),
+                            lambda x, rng: (rng.random(len(x))[:, np.newaxis] >= cumulative[x]).sum(axis=1),
+                            lambda e, x: hmm.O[hmm.observation(e)][x], rng=rng)
+    for (particles, weights), f in zip(steps, hmm_forward(hmm, evidence)[0]):
+        assert np.sum(weights[particles == 0]) == pytest.approx(f[0], abs=0.02)
+
+    # without an rng, random.seed makes the samples reproducible
+    random.seed(5)
+    s = particle_filtering(T, 50, hmm), systematic_resample(weights), MCLmap([[0, 1], [0, 0]]).samples(5)
+    random.seed(5)
+    assert particle_filtering(T, 50, hmm) == s[0]
+    assert (systematic_resample(weights) == s[1]).all() and (MCLmap([[0, 1], [0, 0]]).samples(5) == s[2]).all()
+
+
 def test_monte_carlo_localization():
     # TODO: Add tests for random motion/inaccurate sensors
     random.seed('aima-python')
@@ -391,12 +558,64 @@ def test_monte_carlo_localization():
     assert grid[6][7] > 700
 
 
+def test_localization_filter():
+    m = MCLmap([[0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 0, 0, 1, 0],
+                [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 0, 1, 1, 0],
+                [1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 1, 1, 1, 0, 1, 1, 0],
+                [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 0, 1, 1, 0],
+                [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 1, 1, 0],
+                [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 0, 1, 1, 0],
+                [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 0, 1, 1, 0],
+                [0, 0, 1, 1, 1, 1, 1, 0, 0, 0, 1, 1, 1, 0, 1, 1, 0],
+                [0, 0, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0],
+                [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 0],
+                [0, 0, 1, 1, 1, 1, 1, 0, 0, 0, 1, 1, 1, 0, 0, 1, 0]])
+    assert m.distances.shape == (11, 17, 4)
+    assert [m.ray_cast(j, (6, 7, 0)) for j in range(4)] == [2, 3, 5, 8]
+    assert m.ray_cast(0, (6, 7, 1)) == 3
+    assert m.ray_cast(0, (4, 4, 0)) == 0 and m.ray_cast(0, (-1, 4, 0)) == 0
+    assert list(m.ray_casts(3, np.array([[6, 7, 0], [6, 7, 1], [0, 16, 2]]))) == [8, 2, 1]
+
+    def P_motion_sample(S, v, w, rng):
+        """Turn all the kinematic states by w and then move them by v, without uncertainty"""
+        orient = (S[:, 2] + w) % 4
+        # v rotated clockwise orient times
+        dx = np.choose(orient, [v[0], v[1], -v[0], -v[1]])
+        dy = np.choose(orient, [v[1], -v[0], -v[1], v[0]])
+        return np.column_stack([S[:, 0] + dx, S[:, 1] + dy, orient])
+
+    def P_sensor(x, y):
+        return np.where(x == y, 0.8, np.where(abs(x - y) <= 2, 0.05, 0))
+
+    steps = [({'v': (0, 0), 'w': 0}, (2, 4, 1, 6)), ({'v': (0, 1), 'w': 0}, (2, 3, 5, 7))]
+    for S in localization_filter(steps, 20000, P_motion_sample, P_sensor, m, rng=np.random.default_rng(4)):
+        assert S.shape == (20000, 3)
+    assert np.mean((S[:, 0] == 6) & (S[:, 1] == 7)) > 0.7
+
+
 def test_gibbs_ask():
     possible_solutions = ['False: 0.16, True: 0.84', 'False: 0.17, True: 0.83', 'False: 0.15, True: 0.85']
     g_solution = gibbs_ask('Cloudy', dict(Rain=True), sprinkler, 200).show_approx()
     assert g_solution in possible_solutions
 
 
+def test_gibbs_chains_ask():
+    tables = markov_blanket_tables(sprinkler, dict(Rain=T))
+    Z, blanket, table = tables[0]
+    assert (Z, blanket) == ('Cloudy', ['Sprinkler'])
+    # P(Cloudy=true | Sprinkler=true, Rain=true) = .5 * .1 * .8 / (.5 * .1 * .8 + .5 * .5 * .2)
+    assert table[0] == pytest.approx(0.04 / 0.09)
+    P, r_hat = gibbs_chains_ask('Burglary', dict(JohnCalls=T, MaryCalls=T), burglary, 4000, chains=64,
+                                burn_in=50, thin=2, seed=0)
+    assert P[T] == pytest.approx(0.284, abs=0.05)
+    assert r_hat < 1.05
+    bn = random_network(12, 13)
+    P, r_hat = gibbs_chains_ask('X5', dict(X2=F, X10=T), bn, 5000, chains=16, seed=1)
+    assert P[T] == pytest.approx(enumeration_ask('X5', dict(X2=F, X10=T), bn)[T], abs=0.02)
+    assert r_hat < 1.05
+    assert gelman_rubin([[0, 0, 0, 0], [1, 1, 1, 1]]) == float('inf')
+
+
 # The following should probably go in .ipynb:
 
 """
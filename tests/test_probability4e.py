@@ -1,3 +1,5 @@
+import itertools
+
 import pytest
 
 from probability4e import *
@@ -195,6 +197,29 @@ def test_elimination_ask():
         burglary).show_approx() == 'False: 0.944, True: 0.0561'
 
 
+def test_factor():
+    f = make_factor('Alarm', dict(JohnCalls=T), burglary)
+    assert f.variables == ['Alarm', 'Burglary', 'Earthquake']
+    assert f.table.shape == (2, 2, 2)
+    assert f.p(dict(Alarm=F, Burglary=T, Earthquake=F)) == pytest.approx(0.06)
+    g = f.sum_out('Alarm', burglary)
+    assert g.cpt == pytest.approx({(T, T): 1, (T, F): 1, (F, T): 1, (F, F): 1})
+    h = Factor(['Alarm'], {(T,): 0.9, (F,): 0.05}).pointwise_product(f, burglary)
+    assert h.p(dict(Alarm=T, Burglary=T, Earthquake=F)) == pytest.approx(0.9 * 0.94)
+
+
+def test_elimination_ask_random_network():
+    random.seed(13)
+    specs = []
+    for i in range(12):
+        parents = random.sample(['X{}'.format(j) for j in range(i)], min(i, 3))
+        cpt = {values: random.uniform(0.05, 0.95) for values in itertools.product((T, F), repeat=len(parents))}
+        specs.append(('X{}'.format(i), ' '.join(parents), cpt))
+    bn = BayesNet(specs)
+    for X, e in [('X0', dict(X11=T)), ('X5', dict(X2=F, X10=T)), ('X11', {})]:
+        assert elimination_ask(X, e, bn)[T] == pytest.approx(enumeration_ask(X, e, bn)[T])
+
+
 # test sampling
 
 
@@ -303,6 +328,19 @@ def test_likelihood_weighting2():
         sprinkler, 10000).show_approx() == 'False: 0.833, True: 0.167'
 
 
+def test_batch_sampling():
+    samples = prior_sample(sprinkler, batch_size=10000, seed=3)
+    assert samples['Cloudy'].shape == (10000,)
+    assert samples['Cloudy'].mean() == pytest.approx(0.5, abs=0.02)
+    assert samples['Rain'][samples['Cloudy']].mean() == pytest.approx(0.8, abs=0.02)
+    assert rejection_sampling('Cloudy', dict(Rain=T), sprinkler, 20000,
+                              batch_size=5000, seed=1)[T] == pytest.approx(0.8, abs=0.02)
+    assert likelihood_weighting('Burglary', dict(JohnCalls=T, MaryCalls=T), burglary, 200000,
+                                batch_size=30000, seed=2)[T] == pytest.approx(0.284, abs=0.05)
+    assert likelihood_weighting('Cloudy', dict(Rain=T), sprinkler, 1000, batch_size=300, seed=5).show_approx() == \
+           likelihood_weighting('Cloudy', dict(Rain=T), sprinkler, 1000, batch_size=300, seed=5).show_approx()
+
+
 def test_gibbs_ask():
     g_solution = gibbs_ask('Cloudy', dict(Rain=True), sprinkler, 1000)
     assert abs(g_solution.prob[False] - 0.2) < 0.05
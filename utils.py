@@ -195,6 +195,12 @@ def weighted_sampler(seq, weights):
     return lambda: seq[bisect.bisect(totals, random.uniform(0, totals[-1]))]
 
 
+def numpy_rng(rng=None):
+    """Return rng, or else a NumPy generator seeded from the random module, so
+    that random.seed also makes the functions that sample with NumPy reproducible."""
+    return np.random.default_rng(random.getrandbits(64)) if rng is None else rng
+
+
 def weighted_choice(choices):
     """A weighted version of random.choice"""
     # NOTE: should be replaced by random.choices if we port to Python 3.6